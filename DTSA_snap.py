@@ -7,189 +7,884 @@ Created on Thu Nov 26 08:02:33 2020
 @author: Stefan Nickel (stefan.nickel@kit.edu)
 """
 
-from docplex.mp.model import Model
-from docplex.mp.conflict_refiner import ConflictRefiner
+import numpy as np
+from contextlib import nullcontext
 
+from Instance import Instance
+from SolverBackend import getBackend, INF
 
-def solveSnapshot(data, sol, t, crit_I_fct, crit_J_fct, verbose=True):
+
+def candidatePairs(c, C, Mc):
+    """
+        Index of the district/laboratory pairs that can be used in some period
+
+    By (7), y[(i, j, tau)] = 0 for all tau whenever c_i[j] > C + Mc, since crit_I[i] * (1 - crit_J[j]) <= 1.
+    Variables and constraints are only created for the remaining pairs.
+
+    Parameters
+    ----------
+    c : np.ndarray
+        distance matrix c[i, j].
+    C : int
+        Maximum regular assignment distance.
+    Mc : int
+        Maximum extension of assignment distance.
+
+    Returns
+    -------
+    pi, pj : np.ndarray
+        test center and laboratory index of every candidate pair, sorted by test center.
+    """
+    return np.nonzero(c <= C + Mc)
+
+
+def csr(n_rows, rows, cols, vals):
+    """Convert a coefficient matrix in coordinate format to CSR arrays (starts, index, value)."""
+    order = np.lexsort((cols, rows))
+    starts = np.zeros(n_rows, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows)[:-1], out=starts[1:])
+    return starts, np.asarray(cols)[order], np.asarray(vals, dtype=float)[order]
+
+
+class SnapshotModel:
+    """
+    Persistent model of DTSA_snap(t).
+
+    The structure of DTSA_snap(t) does not change over the planning horizon. The model is therefore
+    built once and, in every period, only the coefficients and right-hand sides that depend on
+    d_i[t], Cap_bar, Cap_t, L, crit_I and crit_J are updated in place.
+    The constraint matrix is assembled from the arrays of the Instance and handed to the SolverBackend
+    in bulk. Variables and constraints are referred to by their indices in the backend:
+        y[(i, j, tau)] of candidate pair p = (pi[p], pj[p]) is variable y_col[p, tau - 1],
+        s[i], L[j] and U_max follow.
+    The variables of the candidate pairs and constraint (5) are built by add_pair_vars and add_slot_rows
+    and updated by update_slots, the other constraints are stated on pair_col (the variables of a pair,
+    the last one is tau_max + 1).
+    """
+
+    def __init__(self, data, verbose=True, backend="cplex", threads=0):
+        self.data = data
+        self.tau_max = data["tau_max"]
+        self.K = self.tau_max + 1  # number of slots, last slot is infinity
+
+        self.I = I = data.tc_names
+        self.J = J = data.lab_names
+        self.I_index = data.tc_index
+        self.J_index = data.lab_index
+        self.c = data.c
+        self.default = data.default
+        self.default_lab = self.default.argmax(axis=1)
+        nI, nJ = len(I), len(J)
+
+        self.pi, self.pj = pi, pj = candidatePairs(self.c, data["C"], data["Mc"])
+        nP = len(pi)
+        self.pair_of = np.full((nI, nJ), -1)
+        self.pair_of[pi, pj] = np.arange(nP)
+        # pairs of test center i are pair_range[i], ..., pair_range[i + 1] - 1
+        self.pair_range = np.searchsorted(pi, np.arange(nI + 1))
+
+        b = getBackend(backend, verbose=verbose, mipgap=0.01, threads=threads)
+        self.backend = b
+
+        # variables
+        self.pair_col = pair_col = self.add_pair_vars()
+        n = pair_col.shape[1]
+        self.s_col = np.asarray(
+            b.add_vars(
+                np.zeros(nI), np.ones(nI), binary=True, names=["s_" + str(i) for i in I]
+            )
+        )
+        self.L_col = np.asarray(
+            b.add_vars(np.zeros(nJ), np.full(nJ, INF), names=["L_" + str(j) for j in J])
+        )
+        self.U_col = b.add_vars([0], [INF], names=["U_max"])[0]
+        s_col, L_col, U_col = self.s_col, self.L_col, self.U_col
+
+        # Objective - demand coefficients are set in update()
+        b.set_objective([U_col], [data["eta"]])
+
+        # constraints in coordinate format, rows are numbered consecutively over all families
+        rows, cols, vals, sense, rhs, names = [], [], [], [], [], []
+        n_rows = 0
+
+        def family(n, sns, r, col, val, name, bound=0):
+            nonlocal n_rows
+            rows.append(n_rows + np.asarray(r))
+            cols.append(np.asarray(col))
+            vals.append(np.broadcast_to(val, np.shape(col)))
+            sense.append(sns * n)
+            rhs.append(np.full(n, bound))
+            names.extend(name)
+            n_rows += n
+            return n_rows - n + np.arange(n)
+
+        # (4)
+        self.r4 = family(
+            nI,
+            "E",
+            np.repeat(pi, n),
+            pair_col.ravel(),
+            1,
+            ["#3_" + str(i) for i in I],
+            bound=1,
+        )
+
+        # (5)
+        self.add_slot_rows(family)
+
+        # (6) - redundant for default pairs
+        self.p6 = p6 = np.flatnonzero(self.default[pi, pj] == 0)
+        self.r6 = family(
+            len(p6),
+            "L",
+            np.repeat(np.arange(len(p6)), n + 1),
+            np.column_stack((pair_col[p6], s_col[pi[p6]])).ravel(),
+            np.tile(np.append(np.ones(n), -1), len(p6)),
+            ["#6_" + str(I[pi[p]]) + str(J[pj[p]]) for p in p6],
+        )
+
+        # (7) - redundant for pairs within the regular assignment distance C
+        self.p7 = p7 = np.flatnonzero(self.c[pi, pj] > data["C"])
+        self.r7 = family(
+            len(p7),
+            "L",
+            np.repeat(np.arange(len(p7)), n),
+            pair_col[p7].ravel(),
+            np.repeat(self.c[pi[p7], pj[p7]], n),
+            ["#7_" + str(I[pi[p]]) + str(J[pj[p]]) for p in p7],
+        )
+
+        # (8) - demand coefficients are set in update()
+        self.r8 = family(
+            nJ,
+            "E",
+            np.append(np.arange(nJ), pj),
+            np.append(L_col, pair_col[:, -1]),
+            np.append(np.ones(nJ), -np.ones(nP)),
+            ["#8_" + str(j) for j in J],
+        )
+
+        # (9) - 1 / Cap_t is set in update()
+        self.r9 = family(
+            nJ,
+            "L",
+            np.repeat(np.arange(nJ), 2),
+            np.column_stack((L_col, np.full(nJ, U_col))).ravel(),
+            np.tile([1, -1], nJ),
+            ["#9_" + str(j) for j in J],
+        )
+
+        self.rs = family(nI, "L", np.arange(nI), s_col, 1, ["s_" + str(i) for i in I])
+
+        starts, index, value = csr(
+            n_rows, np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+        )
+        b.add_rows(
+            "".join(sense), np.concatenate(rhs), starts, index, value, names=names
+        )
+
+        # entries that depend on the period: (8) and (9), (5) see update_slots
+        self.coef_rows = np.append(self.r8[pj], self.r9)
+        self.coef_cols = np.append(pair_col[:, -1], L_col)
+        self.obj_cols = np.append(pair_col[:, -1], s_col)
+        self.rhs_rows = np.concatenate((self.rs, self.r6, self.r7, self.r8))
+
+    def add_pair_vars(self):
+        """
+            Add the variables y[(i, j, tau)] of the candidate pairs
+
+        Returns
+        -------
+        np.ndarray
+            variable indices with shape (number of pairs, tau_max + 1).
+        """
+        I, J, K = self.I, self.J, self.K
+        nP = len(self.pi)
+        self.y_col = np.asarray(
+            self.backend.add_vars(
+                np.zeros(nP * K),
+                np.ones(nP * K),
+                binary=True,
+                names=[
+                    "y_%s_%s_%d" % (I[i], J[j], tau)
+                    for i, j in zip(self.pi, self.pj)
+                    for tau in range(1, K + 1)
+                ],
+            )
+        ).reshape(nP, K)
+        return self.y_col
+
+    def add_slot_rows(self, family):
+        """(5) - row of (j, tau) is j * tau_max + tau - 1, see update_slots."""
+        tau_max = self.tau_max
+        slots = np.arange(tau_max)
+        self.r5 = family(
+            len(self.J) * tau_max,
+            "L",
+            (self.pj[:, None] * tau_max + slots).ravel(),
+            self.y_col[:, :tau_max].ravel(),
+            1,
+            [
+                "#4_" + str(j) + str(tau)
+                for j in self.J
+                for tau in range(1, tau_max + 1)
+            ],
+        ).reshape(len(self.J), tau_max)
+        self.slot_rows = self.r5[self.pj].ravel()
+        self.slot_cols = self.y_col[:, :tau_max].ravel()
+
+    def update_slots(self, d):
+        """Write the demand d and the residual capacities of the current period into (5)."""
+        self.backend.change_coefficients(
+            self.slot_rows, self.slot_cols, np.repeat(d[self.pi], self.tau_max)
+        )
+        self.backend.change_rhs(self.r5.ravel(), self.Cap_bar.ravel())
+
+    @property
+    def d(self):
+        # read from the instance, the horizon may be extended, see Instance.append_periods
+        return self.data.d
+
+    @property
+    def Cap(self):
+        return self.data.Cap
+
+    def update(self, t, crit_I, crit_J):
+        """
+            Write the input parameters of period t into the model.
+
+        Parameters
+        ----------
+        t : int
+            period index.
+        crit_I : np.ndarray
+            crit_i values of period t, one per test center.
+        crit_J : np.ndarray
+            crit_j values of period t, one per laboratory.
+        """
+        data = self.data
+        tau_max = self.tau_max
+        pi, pj, p6, p7 = self.pi, self.pj, self.p6, self.p7
+        self.t = t
+        self.crit_I = np.asarray(crit_I)
+        self.crit_J = np.asarray(crit_J)
+        self.Cap_bar = data.Cap_bar.reshape(len(self.J), tau_max)
+        self.L_prev = data.L
+        d = self.d[:, t]
+
+        self.backend.set_objective(self.obj_cols, np.append(d[pi], data["theta"] * d))
+        self.backend.change_coefficients(
+            self.coef_rows,
+            self.coef_cols,
+            np.append(-d[pi], 1 / self.Cap[:, t + tau_max + 1]),
+        )
+        self.backend.change_rhs(
+            self.rhs_rows,
+            np.concatenate(
+                (
+                    d,
+                    self.crit_I[pi[p6]] + self.crit_J[pj[p6]],
+                    data["C"]
+                    + self.crit_I[pi[p7]] * (1 - self.crit_J[pj[p7]]) * data["Mc"],
+                    np.maximum(self.L_prev - self.Cap[:, t + tau_max], 0),
+                )
+            ),
+        )
+        self.update_slots(d)
+
+    def permitted(self, i, j):
+        """Whether (6) and (7) allow assigning test centers i to laboratories j in the current period."""
+        data = self.data
+        crit_I, crit_J = self.crit_I[i], self.crit_J[j]
+        return (
+            (self.pair_of[i, j] >= 0)
+            & (self.c[i, j] <= data["C"] + crit_I * (1 - crit_J) * data["Mc"])
+            & (
+                (j == self.default_lab[i])
+                | (self.d[i, self.t] > 0)  # s_i may be 1
+                | (crit_I + crit_J > 0)
+            )
+        )
+
+    def set_start(self, y_prev):
+        """
+            Install a MIP start for the current period and use its objective value as incumbent cutoff.
+
+        Every test center keeps the laboratory and slot tau it was assigned to in y_prev, or its default
+        laboratory if it was unassigned (period 0) or the assignment is no longer permitted. The test
+        centers are scheduled by descending demand, in their previous slot if it still has enough residual
+        capacity, else in the earliest such slot (see schedule). Test centers that are delayed are then
+        moved to another permitted laboratory with residual capacity, see relocate.
+
+        Parameters
+        ----------
+        y_prev : dict
+            values of y^(t-1)*.
+
+        Returns
+        -------
+        float
+            objective value of the MIP start, None if no feasible start could be constructed.
+        """
+        self.clear_start()
+        start = self.start_assignment(y_prev)
+        if start is None:
+            return None
+        lab, slot = start
+        obj, reassigned = self.evaluate(lab, slot)[:2]
+        self.backend.set_start(*self.assignment_columns(lab, slot, reassigned))
+        self.backend.set_cutoff(obj + 1e-6 * max(1, abs(obj)))
+        return obj
+
+    def assignment_columns(self, lab, slot, reassigned):
+        """
+            Variables of an assignment and their values, without L and U_max
+
+        Parameters
+        ----------
+        lab, slot : np.ndarray
+            laboratory index and slot tau - 1 per test center.
+        reassigned : np.ndarray
+            s_i per test center (boolean), see evaluate.
+
+        Returns
+        -------
+        cols, vals : np.ndarray
+            variable indices and values.
+        """
+        i_all = np.arange(len(self.I))
+        cols = np.append(
+            self.y_col[self.pair_of[i_all, lab], slot], self.s_col[reassigned]
+        )
+        return cols, np.ones(len(cols))
+
+    def start_assignment(self, y_prev, threshold=0.5):
+        """
+            Laboratory and slot of every test center in the MIP start, see set_start.
+
+        Parameters
+        ----------
+        y_prev : dict
+            values of y^(t-1)*.
+        threshold : float, optional
+            assignments with larger values in y_prev count. The default is 0.5.
+
+        Returns
+        -------
+        lab, slot : np.ndarray
+            laboratory index and slot tau - 1 per test center, None if no feasible start could be constructed.
+        """
+        lab = self.default_lab.copy()
+        slot = np.full(len(self.I), -1)
+        for (i, j, tau), val in y_prev.items():
+            if val > threshold:
+                lab[self.I_index[i]] = self.J_index[j]
+                slot[self.I_index[i]] = tau - 1
+        i_all = np.arange(len(self.I))
+        kept = self.permitted(i_all, lab)
+        lab[~kept] = self.default_lab[~kept]
+        slot[~kept] = -1
+        if not self.permitted(i_all, lab).all():
+            return None
+        return self.relocate(lab, self.schedule(lab, preferred=slot))
+
+    def schedule(self, lab, order=None, preferred=None):
+        """
+            Schedule the demand of every test center at its laboratory lab in its preferred slot if it has
+            enough residual capacity, else in the earliest slot tau with enough residual capacity, else in
+            tau_max + 1.
+
+        Parameters
+        ----------
+        lab : np.ndarray
+            laboratory index per test center.
+        order : np.ndarray, optional
+            order in which the test centers are scheduled. The default is None, i.e., by descending demand
+            (first fit decreasing).
+        preferred : np.ndarray, optional
+            preferred slot tau - 1 per test center, -1 for none. The default is None.
+
+        Returns
+        -------
+        np.ndarray
+            slot tau - 1 per test center.
+        """
+        d = self.d[:, self.t]
+        residual = self.Cap_bar.copy()
+        slot = np.full(len(self.I), self.tau_max)
+        if order is None:
+            order = np.argsort(-d, kind="stable")
+        for i in order:
+            j = lab[i]
+            k = -1 if preferred is None else preferred[i]
+            if not 0 <= k < self.tau_max or residual[j, k] < d[i]:
+                free = np.flatnonzero(residual[j] >= d[i])
+                k = free[0] if len(free) else self.tau_max
+            if k < self.tau_max:
+                slot[i] = k
+                residual[j, k] -= d[i]
+        return slot
+
+    def relocate(self, lab, slot, evict=True):
+        """
+            Move the delayed test centers (largest demand first) to the closest permitted laboratory with a
+            slot in time that has enough residual capacity. If there is none and evict, smaller test centers
+            are moved out of a slot of the closest possible laboratory to make room, each to another slot or
+            permitted laboratory where it fits. A test center that is no longer delayed saves d_i[t] in the
+            objective, a reassignment costs theta * d_i[t]; the result is only kept if it is better.
+
+        Returns
+        -------
+        lab, slot : np.ndarray
+            laboratory index and slot tau - 1 per test center.
+        """
+        tau_max = self.tau_max
+        d = self.d[:, self.t]
+        residual = self.Cap_bar.copy()
+        lab_new, slot_new = lab.copy(), slot.copy()
+        scheduled = np.flatnonzero(slot < tau_max)
+        np.subtract.at(residual, (lab[scheduled], slot[scheduled]), d[scheduled])
+        members = dict()  # test centers per laboratory and slot
+        for i in scheduled:
+            members.setdefault((lab[i], slot[i]), set()).add(i)
+
+        def targets(i):
+            "Permitted laboratories of test center i, closest first."
+            js = self.pj[self.pair_range[i] : self.pair_range[i + 1]]
+            js = js[self.permitted(np.full(len(js), i), js)]
+            return js[np.argsort(self.c[i, js], kind="stable")]
+
+        def fit(i, exclude=None):
+            for j in targets(i):
+                for k in np.flatnonzero(residual[j] >= d[i]):
+                    if (j, k) != exclude:
+                        return j, k
+            return None
+
+        def move(i, target):
+            if slot_new[i] < tau_max:
+                members[lab_new[i], slot_new[i]].discard(i)
+                residual[lab_new[i], slot_new[i]] += d[i]
+            lab_new[i], slot_new[i] = target
+            members.setdefault(target, set()).add(i)
+            residual[target] -= d[i]
+
+        def make_room(i):
+            "Evict smaller test centers from a slot of the closest possible laboratory, None if impossible."
+            for j in targets(i):
+                for k in range(tau_max):
+                    smaller = [h for h in members.get((j, k), ()) if d[h] < d[i]]
+                    if residual[j, k] + d[smaller].sum() < d[i]:
+                        continue
+                    moved = []
+                    for h in sorted(smaller, key=lambda h: -d[h]):
+                        target = fit(h, exclude=(j, k))
+                        if target is not None:
+                            moved.append((h, (lab_new[h], slot_new[h])))
+                            move(h, target)
+                        if residual[j, k] >= d[i]:
+                            return j, k
+                    for h, previous in reversed(moved):
+                        move(h, previous)
+            return None
+
+        delayed = np.flatnonzero((slot == tau_max) & (d > 0))
+        for i in delayed[np.argsort(-d[delayed], kind="stable")]:
+            target = fit(i)
+            if target is None and evict:
+                target = make_room(i)
+            if target is not None:
+                move(i, target)
+        if self.evaluate(lab_new, slot_new)[0] < self.evaluate(lab, slot)[0]:
+            return lab_new, slot_new
+        return lab, slot
+
+    def evaluate(self, lab, slot):
+        """
+            Objective value of assigning every test center to laboratory lab and slot slot (tau - 1)
+
+        Returns
+        -------
+        obj : float
+            objective value.
+        reassigned : np.ndarray
+            s_i per test center (boolean).
+        L : np.ndarray
+            backlog per laboratory.
+        U_max : float
+            maximum relative backlog.
+        """
+        data = self.data
+        t = self.t
+        tau_max = self.tau_max
+        d = self.d[:, t]
+        delayed = np.bincount(lab, weights=d * (slot == tau_max), minlength=len(self.J))
+        reassigned = (lab != self.default_lab) & (self.crit_I + self.crit_J[lab] == 0)
+        L = delayed + np.maximum(self.L_prev - self.Cap[:, t + tau_max], 0)
+        U_max = np.max(L / self.Cap[:, t + tau_max + 1])
+        obj = delayed.sum() + data["theta"] * d[reassigned].sum() + data["eta"] * U_max
+        return obj, reassigned, L, U_max
+
+    def clear_start(self):
+        """Remove MIP start and incumbent cutoff of a previous period."""
+        self.backend.clear_start()
+
+    def solve(self):
+        """
+            Solve the model of the current period.
+
+        Returns
+        -------
+        boolean
+            Whether a solution was found. Its solution time and objective value are stored in solve_time
+            and objective_value, a lower bound on the optimal objective value, if known, in bound.
+        """
+        solved = self.backend.solve()
+        self.solve_time = self.backend.solve_time
+        self.bound = None
+        if solved:
+            self.objective_value = self.backend.objective_value
+            self.bound = self.backend.best_bound
+        return solved
+
+    def values(self):
+        """Values of all variables in the solution of the last solve."""
+        return self.backend.values()
+
+    def assignment(self):
+        """
+            Laboratory and slot of every test center in the solution of the last solve.
+
+        Returns
+        -------
+        lab, slot : np.ndarray
+            laboratory index and slot tau - 1 per test center.
+        """
+        p, k = np.nonzero(self.values()[self.y_col] > 0.5)
+        lab = np.full(len(self.I), -1)
+        slot = np.full(len(self.I), -1)
+        lab[self.pi[p]] = self.pj[p]
+        slot[self.pi[p]] = k
+        return lab, slot
+
+    def fix_assignment(self, i_idx, lab, slot):
+        """Fix test centers i_idx to laboratories lab and slots slot (tau - 1) by the bounds of y."""
+        cols = self.y_col[np.isin(self.pi, i_idx)].ravel()
+        self.backend.change_bounds(cols, 0, 0)
+        fixed = self.y_col[self.pair_of[i_idx, lab], slot]
+        self.backend.change_bounds(fixed, 1, 1)
+
+    def free_assignment(self, i_idx):
+        """Undo fix_assignment for test centers i_idx."""
+        cols = self.y_col[np.isin(self.pi, i_idx)].ravel()
+        self.backend.change_bounds(cols, 0, 1)
+
+    def close(self):
+        """Release resources held besides the solver model (none for a single model)."""
+
+
+class CompactSnapshot(SnapshotModel):
+    """
+    Persistent model of DTSA_snap(t) with one slot decision per district instead of one per pair.
+
+    Every candidate pair p has two binary variables, x[p, 0] (assigned and processed within tau_max) and
+    x[p, 1] (assigned and delayed, tau_max + 1), (4) and (6)-(9) are formulated on x as on the sum of y
+    over the slots. The slot of district i is the binary w[i, tau] with sum_tau w[i, tau] <= 1, the tests
+    processed in time are the continuous z[p, tau] in [0, 1] with
+        sum_tau z[p, tau] = x[p, 0]  and  sum_j z[(i, j), tau] <= w[i, tau],
+    which replace y[(i, j, tau)] in (5). Since a district has a single laboratory (4) and a single slot,
+    z[p, tau] = x[p, 0] * w[i, tau] is integral in every solution: the model is exact, its optimal
+    assignments and objective value are the ones of DTSA_snap(t). It has 2 * pairs + districts * tau_max
+    binary variables instead of pairs * (tau_max + 1).
+    """
+
+    def add_pair_vars(self):
+        """
+            Add the variables x and z of the candidate pairs and the slots w of the districts
+
+        Returns
+        -------
+        np.ndarray
+            indices of x with shape (number of pairs, 2).
+        """
+        I, J, tau_max = self.I, self.J, self.tau_max
+        nP, nI = len(self.pi), len(I)
+        b = self.backend
+        self.x_col = np.asarray(
+            b.add_vars(
+                np.zeros(nP * 2),
+                np.ones(nP * 2),
+                binary=True,
+                names=[
+                    "x_%s_%s_%s" % (I[i], J[j], slot)
+                    for i, j in zip(self.pi, self.pj)
+                    for slot in ("in_time", "delayed")
+                ],
+            )
+        ).reshape(nP, 2)
+        self.z_col = np.asarray(
+            b.add_vars(
+                np.zeros(nP * tau_max),
+                np.ones(nP * tau_max),
+                names=[
+                    "z_%s_%s_%d" % (I[i], J[j], tau)
+                    for i, j in zip(self.pi, self.pj)
+                    for tau in range(1, tau_max + 1)
+                ],
+            )
+        ).reshape(nP, tau_max)
+        self.w_col = np.asarray(
+            b.add_vars(
+                np.zeros(nI * tau_max),
+                np.ones(nI * tau_max),
+                binary=True,
+                names=[
+                    "w_%s_%d" % (i, tau) for i in I for tau in range(1, tau_max + 1)
+                ],
+            )
+        ).reshape(nI, tau_max)
+        return self.x_col
+
+    def add_slot_rows(self, family):
+        """(5) on z and the rows linking z to x and w, see CompactSnapshot and update_slots."""
+        tau_max = self.tau_max
+        pi, pj = self.pi, self.pj
+        nI, nJ, nP = len(self.I), len(self.J), len(pi)
+        slots = np.arange(tau_max)
+        z_col, w_col = self.z_col, self.w_col
+        # (5) - row of (j, tau) is j * tau_max + tau - 1, demand coefficients are set in update_slots()
+        self.r5 = family(
+            nJ * tau_max,
+            "L",
+            (pj[:, None] * tau_max + slots).ravel(),
+            z_col.ravel(),
+            1,
+            [
+                "#4_" + str(j) + str(tau)
+                for j in self.J
+                for tau in range(1, tau_max + 1)
+            ],
+        ).reshape(nJ, tau_max)
+        self.rz = family(
+            nP,
+            "E",
+            np.repeat(np.arange(nP), tau_max + 1),
+            np.column_stack((z_col, self.x_col[:, 0])).ravel(),
+            np.tile(np.append(np.ones(tau_max), -1), nP),
+            ["z_" + str(self.I[i]) + str(self.J[j]) for i, j in zip(pi, pj)],
+        )
+        self.rw = family(
+            nI * tau_max,
+            "L",
+            np.concatenate(
+                ((pi[:, None] * tau_max + slots).ravel(), np.arange(nI * tau_max))
+            ),
+            np.append(z_col.ravel(), w_col.ravel()),
+            np.append(np.ones(nP * tau_max), -np.ones(nI * tau_max)),
+            ["w_" + str(i) + str(tau) for i in self.I for tau in range(1, tau_max + 1)],
+        )
+        self.rw1 = family(
+            nI,
+            "L",
+            np.repeat(np.arange(nI), tau_max),
+            w_col.ravel(),
+            1,
+            ["w_" + str(i) for i in self.I],
+            bound=1,
+        )
+        self.slot_rows = self.r5[pj].ravel()
+        self.slot_cols = z_col.ravel()
+
+    def update_slots(self, d):
+        """Write the demand d and the residual capacities of the current period into (5) and the bounds."""
+        pi, pj = self.pi, self.pj
+        super().update_slots(d)
+        # the tests of a district processed in time must fit into one slot
+        self.backend.change_bounds(
+            self.x_col[:, 0], 0, d[pi] <= self.Cap_bar[pj].max(axis=1)
+        )
+
+    def assignment_columns(self, lab, slot, reassigned):
+        """Variables of an assignment (x, z, w and s) and their values, see SnapshotModel."""
+        i_all = np.arange(len(self.I))
+        p = self.pair_of[i_all, lab]
+        in_time = slot < self.tau_max
+        cols = np.concatenate(
+            (
+                self.x_col[p, (~in_time).astype(int)],
+                self.z_col[p[in_time], slot[in_time]],
+                self.w_col[i_all[in_time], slot[in_time]],
+                self.s_col[reassigned],
+            )
+        )
+        return cols, np.ones(len(cols))
+
+    def assignment(self):
+        """Laboratory and slot of every test center in the solution of the last solve, see SnapshotModel."""
+        values = self.values()
+        p, k = np.nonzero(values[self.x_col] > 0.5)
+        lab = np.full(len(self.I), -1)
+        lab[self.pi[p]] = self.pj[p]
+        slot = np.full(len(self.I), self.tau_max)
+        in_time = p[k == 0]
+        slot[self.pi[in_time]] = values[self.z_col[in_time]].argmax(axis=1)
+        return lab, slot
+
+
+formulations = {"slots": SnapshotModel, "compact": CompactSnapshot}
+
+
+def solveSnapshot(
+    data,
+    sol,
+    t,
+    crit_I_fct,
+    crit_J_fct,
+    verbose=True,
+    snapshot=None,
+    y_start=None,
+    backend="cplex",
+    stats=None,
+    formulation="slots",
+):
     """
         Build and solve DTSA_snap(t)
 
     Parameters
     ----------
-    data : dict
-        dictionary with all problem parameters.
+    data : Instance or dict
+        all problem parameters.
     sol : Solution
         Solution object to store solution.
     t : int
         period index.
     crit_I_fct : fct
-        method to compute crit_i.
+        method to compute crit_i, see OnlineProcedure.gen_crit_I_fct.
     crit_J_fct : fct
-        method to compute crit_j.
+        method to compute crit_j, see OnlineProcedure.gen_crit_J_fct.
     verbose : boolean, optional
-        Whether or not to log CPLEX output. The default is True.
+        Whether or not to log solver output. The default is True.
+    snapshot : SnapshotModel, optional
+        Persistent model that is updated for period t instead of building a new model.
+        The default is None, i.e., a new model is built.
+    y_start : dict, optional
+        values of y^(t-1)*, used to warm start the solver (see SnapshotModel.set_start).
+        The default is None, i.e., no warm start.
+    backend : str, optional
+        Solver backend used when a new model is built, 'cplex' or 'highs'. The default is 'cplex'.
+    stats : Instrumentation, optional
+        Records the time of the phases of the period. The default is None.
+    formulation : str, optional
+        Formulation of the model if a new model is built, 'slots' (y for every slot tau, SnapshotModel) or
+        'compact' (one slot per district, CompactSnapshot). The default is 'slots'.
 
     Returns
     -------
     if solved:
         y, L: dict
             Solution values that serve as input for upcoming period / are needed to update status parameters.
+            y only holds the nonzero assignments, all other entries are 0.
     else:
         None, None.
             When problem could not be solved, print error statement.
 
     """
-    mdl = Model(name="snapshot" + str(t))
-    mdl.parameters.mip.tolerances.mipgap = 0.01
+    if snapshot is None:
+        if not isinstance(data, Instance):
+            data = Instance.from_dict(data)
+        snapshot = formulations[formulation](data, verbose=verbose, backend=backend)
+    b = snapshot.backend
+    phase = stats.phase if stats is not None else nullcontext
 
-    T = range(1, data["tau_max"] + 2)  # last element is infinity
-    tau_max = data["tau_max"]
-    crit_I = dict()
-    crit_J = dict()
-
-    for i in data["test_centers"]:
-        crit_I[i] = crit_I_fct(i, data, sol, t)
-
-    for j in data["laboratories"]:
-        crit_J[j] = crit_J_fct(j, data, sol, t)
-
-    y_idx = [
-        (i, j, t) for i in data["test_centers"] for j in data["laboratories"] for t in T
-    ]
-    s_idx = [i for i in data["test_centers"]]
-    L_idx = [j for j in data["laboratories"]]
-
-    y = mdl.binary_var_dict(y_idx, name="y")
-    s = mdl.binary_var_dict(s_idx, name="s")
-    L = mdl.continuous_var_dict(L_idx, name="L", lb=0)
-    U_max = mdl.continuous_var(name="U_max", lb=0)
-
-    # Objective
-    mdl.delay = mdl.sum(
-        data["test_centers"][i]["d_i"][t] * y[(i, j, T[tau_max])]
-        for i in data["test_centers"]
-        for j in data["laboratories"]
-    )
-    mdl.reassignment = data["theta"] * mdl.sum(
-        data["test_centers"][i]["d_i"][t] * s[i] for i in data["test_centers"]
-    )
-    mdl.backlog = data["eta"] * U_max
-    mdl.minimize(mdl.delay + mdl.reassignment + mdl.backlog)
-
-    # (4)
-    mdl.add_constraints(
-        (
-            mdl.sum(y[(i, j, tau)] for j in data["laboratories"] for tau in T) == 1
-            for i in data["test_centers"]
-        ),
-        names=["#3_" + str(i) for i in data["test_centers"]],
-    )  # 2
-
-    # (5)
-    mdl.add_constraints(
-        (
-            mdl.sum(
-                data["test_centers"][i]["d_i"][t] * y[(i, j, tau)]
-                for i in data["test_centers"]
-            )
-            <= data["laboratories"][j]["Cap_bar"][tau - 1]
-            for j in data["laboratories"]
-            for tau in T
-            if tau != tau_max + 1
-        ),
-        names=[
-            "#4_" + str(j) + str(tau)
-            for j in data["laboratories"]
-            for tau in T
-            if tau != tau_max + 1
-        ],
-    )  # 3
-
-    # (6)
-    mdl.add_constraints_(
-        (
-            mdl.sum(y[(i, j, tau)] for tau in T)
-            <= data["test_centers"][i]["default_i"][j] + s[(i)] + crit_I[i] + crit_J[j]
-            for i in data["test_centers"]
-            for j in data["laboratories"]
-        ),
-        names=[
-            "#6_" + str(i) + str(j)
-            for i in data["test_centers"]
-            for j in data["laboratories"]
-        ],
-    )
+    with phase("crit"):
+        crit_I = crit_I_fct(data, sol, t)
+        crit_J = crit_J_fct(data, sol, t)
+    with phase("model"):
+        snapshot.update(t, crit_I, crit_J)
 
-    # (7)
-    mdl.add_constraints(
-        (
-            data["test_centers"][i]["c_i"][j] * mdl.sum(y[(i, j, tau)] for tau in T)
-            <= data["C"] + crit_I[i] * (1 - crit_J[j]) * data["Mc"]
-            for i in data["test_centers"]
-            for j in data["laboratories"]
-        ),
-        names=[
-            "#7_" + str(i) + str(j)
-            for i in data["test_centers"]
-            for j in data["laboratories"]
-        ],
-    )
+    with phase("start"):
+        if y_start is not None:
+            start_obj = snapshot.set_start(y_start)
+        else:
+            start_obj = None
+            snapshot.clear_start()
 
-    # (8)
-    mdl.add_constraints(
-        (
-            L[j]
-            == mdl.sum(
-                y[(i, j, tau_max + 1)] * data["test_centers"][i]["d_i"][t]
-                for i in data["test_centers"]
-            )
-            + max(
-                data["laboratories"][j]["L"]
-                - data["laboratories"][j]["Cap_t"][t + data["tau_max"]],
-                0,
-            )
-            for j in data["laboratories"]
-        ),
-        names=["#8_" + str(j) for j in data["laboratories"]],
-    )  # 4
-
-    # (9)
-    mdl.add_constraints(
-        (
-            (1 / data["laboratories"][j]["Cap_t"][t + data["tau_max"] + 1]) * L[(j)]
-            <= U_max
-            for j in data["laboratories"]
-        ),
-        names=["#9_" + str(j) for j in data["laboratories"]],
-    )  # 7
-
-    mdl.add_constraints_(
-        (s[(i)] <= data["test_centers"][i]["d_i"][t] for i in data["test_centers"])
-    )
+    with phase("solve"):
+        solved = snapshot.solve()
+        time = snapshot.solve_time
+        if not solved and start_obj is not None:  # guard against a too tight cutoff
+            snapshot.clear_start()
+            solved = snapshot.solve()
+            time += snapshot.solve_time
 
-    if verbose:
-        mdl.context.solver.log_output = True
-
-    if mdl.solve():
-        sol.add_solution_from_period(
-            mdl.solution.get_objective_value(),
-            mdl.solution.get_value(mdl.delay),
-            mdl.solution.get_value(mdl.reassignment),
-            mdl.solution.get_value(mdl.backlog),
-            mdl.solution.solve_details.time,
-            mdl.solution.get_value_dict(y),
-            mdl.solution.get_value_dict(L),
-            mdl.solution.get_value_dict(s),
-            U_max.solution_value,
-            data["tau_max"],
-            crit_I,
-            crit_J,
-        )
-
-        return mdl.solution.get_value_dict(y), mdl.solution.get_value_dict(L)
+    if solved:
+        with phase("extract"):
+            return extractSolution(
+                data, sol, t, snapshot, time, crit_I, crit_J, start_obj
+            )
     else:
         print(f"Snapshot problem in period {t} could not be solved.")
-        cflrfr = ConflictRefiner().refine_conflict(mdl, log_output=True)
-        cflrfr.display()
+        b.explain_infeasibility()
         return None, None  # otherwise None will be returned implicitly
+
+
+def extractSolution(data, sol, t, snapshot, time, crit_I, crit_J, start_obj):
+    """
+        Add the solution of the last solve of the snapshot model to sol
+
+    Parameters
+    ----------
+    data : Instance
+        all problem parameters.
+    sol : Solution
+        Solution object to store solution.
+    t : int
+        period index.
+    snapshot : SnapshotModel
+        solved snapshot model.
+    time : float
+        solution time.
+    crit_I, crit_J : np.ndarray
+        crit_i and crit_j values of period t.
+    start_obj : float
+        objective value of the MIP start, None if solved without warm start.
+
+    Returns
+    -------
+    y, L: dict
+        Solution values that serve as input for upcoming period / are needed to update status parameters.
+        y only holds the nonzero assignments, all other entries are 0.
+    """
+    tau_max = data["tau_max"]
+    I, J = snapshot.I, snapshot.J
+    values = snapshot.values()
+    d = snapshot.d[:, t]
+    lab, slot = snapshot.assignment()
+    s = np.round(values[snapshot.s_col])
+    y_val = {
+        (I[i], J[j], k + 1): 1
+        for i, (j, k) in enumerate(zip(lab.tolist(), slot.tolist()))
+    }
+    s_val = dict(zip(I, s.tolist()))
+    L_val = dict(zip(J, values[snapshot.L_col].tolist()))
+    U_max = values[snapshot.U_col]
+    delay = float(d @ (slot == tau_max))
+    reassignment = data["theta"] * (d @ s)
+    sol.add_solution_from_period(
+        snapshot.objective_value,
+        delay,
+        reassignment,
+        data["eta"] * U_max,
+        time,
+        y_val,
+        L_val,
+        s_val,
+        U_max,
+        data["tau_max"],
+        dict(zip(I, crit_I.tolist())),
+        dict(zip(J, crit_J.tolist())),
+        warm_start=start_obj,
+        bound=snapshot.bound,
+    )
+
+    return y_val, L_val
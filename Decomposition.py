@@ -0,0 +1,237 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import os
+import time
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from DTSA_snap import SnapshotModel
+
+# state of the worker processes, see initWorker
+_regions = dict()
+_models = dict()
+_backend = "cplex"
+_threads = 1
+
+
+class DecomposedSnapshot(SnapshotModel):
+    """
+    DTSA_snap(t) decomposed by region (the Bundesland of test centers and laboratories).
+
+    A test center is interior if its default laboratory and all laboratories within distance C + Mc lie in
+    its own region. In every period the interior test centers of each region are assigned by a regional
+    DTSA_snap(t) (interior test centers and laboratories of the region) in worker processes. Every region
+    is solved by one worker, which keeps its model; the inputs of the period are sent with every call, so the
+    horizon of the instance may be extended, see Instance.append_periods.
+    The coordination step is a repair MIP: the monolithic model with the assignments of the interior test
+    centers fixed, in which only the boundary test centers, backlogs and U_max are decided. Its solution is
+    feasible for DTSA_snap(t), the regional models only ignore the capacity used by boundary test centers.
+    With compare=True the monolithic model is solved as well and the gap is reported.
+    """
+
+    def __init__(
+        self,
+        data,
+        verbose=True,
+        backend="cplex",
+        threads=0,
+        processes=None,
+        region_threads=1,
+        compare=False,
+        region_key="Bundesland",
+    ):
+        super().__init__(data, verbose=verbose, backend=backend, threads=threads)
+        self.compare = compare
+        self.y_prev = None
+        self.monolithic = []  # objective values of the monolithic model if compare
+        nI = len(self.I)
+
+        region_I = np.array([str(meta.get(region_key)) for meta in data.tc_meta])
+        region_J = np.array([str(meta.get(region_key)) for meta in data.lab_meta])
+        crossing = (self.pair_of >= 0) & (region_I[:, None] != region_J[None, :])
+        self.interior = ~crossing.any(axis=1) & (region_I == region_J[self.default_lab])
+
+        self.regions = []  # (test center indices, laboratory indices) of every region
+        self.region_of = np.full(nI, -1)
+        for region in sorted(set(region_I[self.interior])):
+            tc_idx = np.flatnonzero(self.interior & (region_I == region))
+            lab_idx = np.flatnonzero(region_J == region)
+            self.region_of[tc_idx] = len(self.regions)
+            self.regions.append((tc_idx, lab_idx))
+        print(
+            f"Decomposition into {len(self.regions)} regions, "
+            f"{self.interior.sum()} of {nI} test centers are interior."
+        )
+
+        # regions with the most test centers first, each to the worker with the fewest test centers so far
+        workers = min(processes or os.cpu_count(), len(self.regions))
+        self.worker_of = np.zeros(len(self.regions), dtype=int)
+        load = np.zeros(workers)
+        regions = [dict() for w in range(workers)]
+        for r in sorted(
+            range(len(self.regions)), key=lambda r: -len(self.regions[r][0])
+        ):
+            tc_idx, lab_idx = self.regions[r]
+            w = np.argmin(load)
+            load[w] += len(tc_idx)
+            self.worker_of[r] = w
+            # one period only, the inputs of the current period are written into it, see solveRegion
+            regions[w][r] = data.subset(tc_idx, lab_idx)
+            regions[w][r].truncate_periods(1)
+        self.pools = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=initWorker,
+                initargs=(regions[w], backend, region_threads),
+            )
+            for w in range(workers)
+        ]
+
+    def set_start(self, y_prev):
+        """
+            Warm start the regional models from y_prev, see SnapshotModel.set_start. The repair MIP is
+            solved without start since the regional assignments are fixed in it.
+
+        Returns
+        -------
+        None
+        """
+        self.clear_start()
+        self.y_prev = y_prev
+        return None
+
+    def clear_start(self):
+        self.y_prev = None
+        super().clear_start()
+
+    def solve(self):
+        """
+            Solve the regional models in parallel, then the repair MIP.
+
+        Returns
+        -------
+        boolean
+            Whether a solution was found, the wall time of both steps is stored in solve_time.
+        """
+        if self.compare:
+            self.free_assignment(np.flatnonzero(self.interior))
+            solved = super().solve()
+            self.monolithic.append(self.backend.objective_value if solved else None)
+
+        time_start = time.perf_counter()
+        y_start = [None] * len(self.regions)
+        if self.y_prev is not None:
+            y_start = [dict() for region in self.regions]
+            for key, val in self.y_prev.items():
+                r = self.region_of[self.I_index[key[0]]]
+                if r >= 0:
+                    y_start[r][key] = val
+
+        t, tau_max = self.t, self.tau_max
+        futures = [
+            self.pools[self.worker_of[r]].submit(
+                solveRegion,
+                r,
+                self.d[tc_idx, t],
+                self.Cap[lab_idx, t : t + tau_max + 2],
+                self.Cap_bar[lab_idx],
+                self.L_prev[lab_idx],
+                self.crit_I[tc_idx],
+                self.crit_J[lab_idx],
+                y_start[r],
+            )
+            for r, (tc_idx, lab_idx) in enumerate(self.regions)
+        ]
+        for (tc_idx, lab_idx), future in zip(self.regions, futures):
+            result = future.result()
+            if result is None:  # decided by the repair MIP instead
+                self.free_assignment(tc_idx)
+            else:
+                lab, slot = result
+                self.fix_assignment(tc_idx, lab_idx[lab], slot)
+
+        solved = super().solve()
+        self.solve_time = time.perf_counter() - time_start
+        self.bound = None  # of the repair MIP only, the regional assignments are fixed
+
+        if self.compare and solved and self.monolithic[-1] is not None:
+            # relative to at least one test, the objective is often 0 in early periods
+            gap = (self.backend.objective_value - self.monolithic[-1]) / max(
+                abs(self.monolithic[-1]), 1
+            )
+            print(
+                f"decomposed: {self.backend.objective_value:.4f}, "
+                f"monolithic: {self.monolithic[-1]:.4f}, gap: {gap:.2%}"
+            )
+        return solved
+
+    def close(self):
+        """Shut down the worker processes."""
+        for pool in self.pools:
+            pool.shutdown()
+
+
+def initWorker(regions, backend, threads):
+    "Keep the regional instances (dict region index -> Instance) of the worker, their models are built on first use."
+    global _regions, _backend, _threads
+    _regions = regions
+    _backend = backend
+    _threads = threads
+
+
+def solveRegion(r, d, Cap, Cap_bar, L, crit_I, crit_J, y_start):
+    """
+        Solve the regional DTSA_snap(t) of region r in the worker process of the region
+
+    Parameters
+    ----------
+    r : int
+        region index.
+    d : np.ndarray
+        tests of the test centers of the region in period t.
+    Cap : np.ndarray
+        capacities of the laboratories of the region in periods t, ..., t + tau_max + 1.
+    Cap_bar : np.ndarray
+        residual capacities of the laboratories of the region.
+    L : np.ndarray
+        backlogs of the laboratories of the region.
+    crit_I : np.ndarray
+        crit_i values of the test centers of the region.
+    crit_J : np.ndarray
+        crit_j values of the laboratories of the region.
+    y_start : dict
+        values of y^(t-1)* of the test centers of the region, None for no warm start.
+
+    Returns
+    -------
+    lab, slot : np.ndarray
+        laboratory (index within the region) and slot tau - 1 per test center, None if not solved.
+    """
+    sub = _regions[r]  # period t is period 0 of the regional instance
+    sub.d[:, 0] = d
+    sub.Cap[:] = Cap
+    sub.Cap_bar[:] = Cap_bar
+    sub.L[:] = L
+    if r not in _models:
+        _models[r] = SnapshotModel(
+            sub, verbose=False, backend=_backend, threads=_threads
+        )
+    model = _models[r]
+    model.update(0, crit_I, crit_J)
+    start_obj = model.set_start(y_start) if y_start is not None else None
+    if y_start is None:
+        model.clear_start()
+    solved = model.solve()
+    if not solved and start_obj is not None:
+        model.clear_start()
+        solved = model.solve()
+    return model.assignment() if solved else None
@@ -0,0 +1,155 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import time
+import numpy as np
+
+from DTSA_snap import SnapshotModel
+
+
+class HeuristicSnapshot(SnapshotModel):
+    """
+    Fast heuristic for DTSA_snap(t): LP relaxation, rounding and a bounded local search.
+
+    The model is the LP relaxation of DTSA_snap(t), its objective value is a lower bound on the optimal
+    objective value and stored in bound. Every test center is assigned to the permitted laboratory with
+    the largest LP value sum_tau y[(i, j, tau)] (ties by distance) and scheduled first fit decreasing, i.e.,
+    by descending demand in the earliest slot with enough residual capacity (else tau_max + 1). The result
+    respects (4)-(9) by construction. The repair then moves delayed test centers to another permitted
+    laboratory, evicting smaller test centers to other slots or laboratories if necessary (see
+    SnapshotModel.relocate), and swaps delayed test centers with smaller ones that are in time, at most
+    max_moves swaps. The relative gap between objective value and LP bound is stored in gap.
+    """
+
+    def __init__(self, data, verbose=True, backend="cplex", threads=0, max_moves=1000):
+        super().__init__(data, verbose=verbose, backend=backend, threads=threads)
+        self.backend.relax()
+        self.verbose = verbose
+        self.max_moves = max_moves
+        self.solution = None
+        self.gap = None
+
+    def set_start(self, y_prev):
+        """The LP relaxation is solved without start, see SnapshotModel.set_start."""
+        self.clear_start()
+        return None
+
+    def solve(self):
+        """
+            Solve the LP relaxation and round its solution.
+
+        Returns
+        -------
+        boolean
+            Whether a solution was found. The wall time of all steps is stored in solve_time, the
+            objective value of the assignment in objective_value and the LP bound in bound.
+        """
+        time_start = time.perf_counter()
+        if not super().solve():
+            return False
+        self.bound = self.objective_value
+        x = self.backend.values()[self.y_col]
+
+        nI, nJ = len(self.I), len(self.J)
+        allowed = np.zeros((nI, nJ), dtype=bool)
+        allowed[self.pi, self.pj] = self.permitted(self.pi, self.pj)
+        if not allowed.any(axis=1).all():
+            return False
+        mass = np.zeros((nI, nJ))
+        mass[self.pi, self.pj] = x.sum(axis=1)
+        rank = np.where(allowed, mass, -1)
+        # best laboratory by LP value, then distance
+        lab = np.lexsort((self.c, -rank), axis=1)[:, 0]
+        slot = self.schedule(lab)
+        lab, slot = self.relocate(lab, slot)
+        lab, slot = self.local_search(lab, slot, allowed)
+
+        obj, reassigned, L, U_max = self.evaluate(lab, slot)
+        values = np.zeros(self.backend.num_vars)
+        values[self.y_col[self.pair_of[np.arange(nI), lab], slot]] = 1
+        values[self.s_col[reassigned]] = 1
+        values[self.L_col] = L
+        values[self.U_col] = U_max
+        self.solution = values
+        self.objective_value = obj
+        self.gap = (obj - self.bound) / max(abs(obj), 1e-10)
+        self.solve_time = time.perf_counter() - time_start
+        if self.verbose:
+            print(
+                f"heuristic: objective {obj:.2f}, LP bound {self.bound:.2f}, "
+                f"gap {100 * self.gap:.1f}%"
+            )
+        return True
+
+    def local_search(self, lab, slot, allowed):
+        """
+            Swap delayed test centers (largest demand first) with a smaller test center that is in time at
+            a permitted laboratory, if the slot then has enough residual capacity and the objective improves.
+            The smaller test center is delayed at its laboratory.
+
+        Parameters
+        ----------
+        lab : np.ndarray
+            laboratory index per test center.
+        slot : np.ndarray
+            slot tau - 1 per test center.
+        allowed : np.ndarray
+            whether (6) and (7) permit assigning test center i to laboratory j.
+
+        Returns
+        -------
+        lab, slot : np.ndarray
+            improved assignment.
+        """
+        tau_max = self.tau_max
+        d = self.d[:, self.t]
+        residual = self.Cap_bar.copy()
+        scheduled = slot < tau_max
+        np.subtract.at(residual, (lab[scheduled], slot[scheduled]), d[scheduled])
+        obj = self.evaluate(lab, slot)[0]
+
+        moves = 0
+        improved = True
+        while improved and moves < self.max_moves:
+            improved = False
+            delayed = np.flatnonzero((slot == tau_max) & (d > 0))
+            for i in delayed[np.argsort(-d[delayed], kind="stable")]:
+                # smaller test centers in time at a permitted laboratory, smallest first
+                h_all = np.flatnonzero(
+                    allowed[i, lab] & (slot < tau_max) & (d < d[i]) & (d > 0)
+                )
+                h_all = h_all[np.argsort(d[h_all], kind="stable")]
+                for h in h_all:
+                    j, k = lab[h], slot[h]
+                    if residual[j, k] + d[h] < d[i]:
+                        continue
+                    lab_new, slot_new = lab.copy(), slot.copy()
+                    lab_new[i], slot_new[i] = j, k
+                    slot_new[h] = tau_max
+                    obj_new = self.evaluate(lab_new, slot_new)[0]
+                    if obj_new < obj - 1e-9:
+                        lab, slot, obj = lab_new, slot_new, obj_new
+                        residual[j, k] += d[h] - d[i]
+                        moves += 1
+                        improved = True
+                        break
+                if moves >= self.max_moves:
+                    break
+            if improved:  # the delayed test centers may fit elsewhere now
+                lab, slot = self.relocate(lab, slot)
+                residual = self.Cap_bar.copy()
+                scheduled = slot < tau_max
+                np.subtract.at(
+                    residual, (lab[scheduled], slot[scheduled]), d[scheduled]
+                )
+                obj = self.evaluate(lab, slot)[0]
+        return lab, slot
+
+    def values(self):
+        return self.solution
@@ -0,0 +1,409 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+from collections.abc import Mapping
+import json
+import os
+import numpy as np
+
+INF = float("inf")
+
+
+class Instance(Mapping):
+    """
+    Problem instance with integer-indexed NumPy arrays.
+
+    Test center i and laboratory j are row i of tc_names and lab_names, respectively:
+        d[i, t], inc[i, t] : number of tests and weekly incidence of test center i in period t
+        c[i, j] : distance between test center i and laboratory j (inf if not given)
+        default[i, j] : default assignment
+        Cap[j, t] : capacity of laboratory j in period t (T + tau_max + 1 periods)
+        Cap_bar[j, tau] : residual capacity of laboratory j in slot tau + 1 (procedure state)
+        L[j] : backlog of laboratory j (procedure state)
+    Item access mirrors the nested instance dictionary: instance["test_centers"][i]["d_i"][t] and
+    instance["laboratories"][j]["Cap_bar"] are read-only views on these arrays. Only top-level parameters
+    such as instance["tau_max"] can be set.
+    """
+
+    tc_arrays = {"d_i": "d", "incidence_i": "inc", "c_i": "c", "default_i": "default"}
+    lab_arrays = {"Cap_t": "Cap", "Cap_bar": "Cap_bar", "L": "L"}
+    state_arrays = ("Cap_bar", "L")  # changed by the procedure, never memory-mapped
+    entities = ("test_centers", "laboratories")
+    meta_file = "instance_meta.json"
+    json_file = "instance.json"
+
+    def __init__(
+        self,
+        properties,
+        params,
+        tc_names,
+        lab_names,
+        d,
+        inc,
+        c,
+        default,
+        Cap,
+        Cap_bar,
+        L,
+        tc_meta=None,
+        lab_meta=None,
+    ):
+        self.properties = properties
+        self.params = params
+        self.tc_names = list(tc_names)
+        self.lab_names = list(lab_names)
+        self.tc_index = {i: n for n, i in enumerate(self.tc_names)}
+        self.lab_index = {j: n for n, j in enumerate(self.lab_names)}
+        self.d = d
+        self.inc = inc
+        self.c = c
+        self.default = default
+        self.Cap = Cap
+        self.Cap_bar = Cap_bar
+        self.L = L
+        self.tc_meta = tc_meta if tc_meta is not None else [dict() for i in tc_names]
+        self.lab_meta = (
+            lab_meta if lab_meta is not None else [dict() for j in lab_names]
+        )
+        self._buffers = dict()  # arrays with spare columns for appended periods
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+            Convert a nested instance dictionary (as written by instance_generator.py)
+
+        Parameters
+        ----------
+        data : dict
+            Problem instance.
+
+        Returns
+        -------
+        Instance
+        """
+        tcs, labs = data["test_centers"], data["laboratories"]
+        tc_names, lab_names = list(tcs), list(labs)
+
+        def meta(info, arrays):
+            return {key: val for key, val in info.items() if key not in arrays}
+
+        return cls(
+            properties=dict(data["properties"]),
+            params={
+                key: val
+                for key, val in data.items()
+                if key not in cls.entities and key != "properties"
+            },
+            tc_names=tc_names,
+            lab_names=lab_names,
+            d=np.array([tcs[i]["d_i"] for i in tc_names]),
+            inc=np.array([tcs[i]["incidence_i"] for i in tc_names]),
+            c=np.array(
+                [[tcs[i]["c_i"].get(j, INF) for j in lab_names] for i in tc_names],
+                dtype=float,
+            ),
+            default=np.array(
+                [[tcs[i]["default_i"][j] for j in lab_names] for i in tc_names],
+                dtype=np.int8,
+            ),
+            Cap=np.array([labs[j]["Cap_t"] for j in lab_names]),
+            Cap_bar=np.array([labs[j]["Cap_bar"] for j in lab_names], dtype=float),
+            L=np.array([labs[j]["L"] for j in lab_names], dtype=float),
+            tc_meta=[meta(tcs[i], cls.tc_arrays) for i in tc_names],
+            lab_meta=[meta(labs[j], cls.lab_arrays) for j in lab_names],
+        )
+
+    def to_dict(self):
+        """Nested instance dictionary, e.g., for JSON export."""
+        data = {"properties": dict(self.properties)}
+        data.update(self.params)
+        data["test_centers"] = {
+            i: self._record(self.tc_meta[n], n, self.tc_arrays, export=True)
+            for n, i in enumerate(self.tc_names)
+        }
+        data["laboratories"] = {
+            j: self._record(self.lab_meta[n], n, self.lab_arrays, export=True)
+            for n, j in enumerate(self.lab_names)
+        }
+        return data
+
+    def subset(self, tc_idx, lab_idx):
+        """
+            Instance restricted to some test centers and laboratories
+
+        Parameters
+        ----------
+        tc_idx : np.ndarray
+            indices of the test centers.
+        lab_idx : np.ndarray
+            indices of the laboratories.
+
+        Returns
+        -------
+        Instance
+            copy of the data of the given test centers and laboratories, including the procedure state.
+        """
+        params = dict(self.params)
+        if "I" in params:
+            params["I"] = len(tc_idx)
+        if "J" in params:
+            params["J"] = len(lab_idx)
+        return Instance(
+            properties=dict(self.properties),
+            params=params,
+            tc_names=[self.tc_names[i] for i in tc_idx],
+            lab_names=[self.lab_names[j] for j in lab_idx],
+            d=self.d[tc_idx],
+            inc=self.inc[tc_idx],
+            c=self.c[np.ix_(tc_idx, lab_idx)],
+            default=self.default[np.ix_(tc_idx, lab_idx)],
+            Cap=self.Cap[lab_idx],
+            Cap_bar=self.Cap_bar[lab_idx],
+            L=self.L[lab_idx],
+            tc_meta=[self.tc_meta[i] for i in tc_idx],
+            lab_meta=[self.lab_meta[j] for j in lab_idx],
+        )
+
+    def append_periods(self, d, inc, Cap):
+        """
+            Extend the planning horizon by k periods. The arrays are kept in buffers with spare columns, so
+            appending takes time proportional to k (amortized).
+
+        Parameters
+        ----------
+        d : np.ndarray
+            number of tests of the new periods with shape (I, k).
+        inc : np.ndarray
+            weekly incidences of the new periods with shape (I, k).
+        Cap : np.ndarray
+            capacities of the new periods with shape (J, k). The periods after the horizon repeat the capacity
+            of the last period, as in CDPInstance.resize_capacity.
+        """
+        T = self.params["pandemic_duration"]
+        k = np.shape(d)[1]
+        pad = self.Cap.shape[1] - T
+        self._append_columns("d", T, d)
+        self._append_columns("inc", T, inc)
+        Cap = np.asarray(Cap)
+        self._append_columns(
+            "Cap", T, np.concatenate((Cap, np.repeat(Cap[:, -1:], pad, axis=1)), axis=1)
+        )
+        self._shift_horizon(k)
+
+    def truncate_periods(self, T):
+        """Shorten the planning horizon to the first T periods, e.g., to undo append_periods."""
+        k = T - self.params["pandemic_duration"]
+        pad = self.Cap.shape[1] - self.params["pandemic_duration"]
+        self.d = self.d[:, :T]
+        self.inc = self.inc[:, :T]
+        self.Cap = self.Cap[:, : T + pad]
+        if not self.Cap.flags.writeable:  # memory-mapped
+            self.Cap = np.array(self.Cap)
+        self.Cap[:, T:] = self.Cap[:, T - 1 : T]
+        self._shift_horizon(k)
+
+    def _append_columns(self, attr, n, new):
+        "Write the columns of new after the first n columns of attr."
+        new = np.asarray(new)
+        m = n + new.shape[1]
+        buf = self._buffers.get(attr)
+        if buf is None or buf.shape[1] < m or getattr(self, attr).base is not buf:
+            old = getattr(self, attr)
+            buf = np.empty(
+                (old.shape[0], max(2 * m, 16)), dtype=np.result_type(old, new)
+            )
+            buf[:, :n] = old[:, :n]
+            self._buffers[attr] = buf
+        buf[:, n:m] = new
+        setattr(self, attr, buf[:, :m])
+
+    def _shift_horizon(self, k):
+        self.params["pandemic_duration"] += k
+        if "end_date" in self.properties:
+            end_date = np.datetime64(self.properties["end_date"]) + k
+            self.properties["end_date"] = str(end_date)
+
+    def save(self, directory):
+        """
+            Write the instance in binary format: metadata (names, parameters and all non-numeric attributes)
+            to instance_meta.json and every array to instance_<array>.npy in directory.
+
+        Parameters
+        ----------
+        directory : str
+            instance directory, e.g., data/<instance name>
+        """
+        meta = {
+            "properties": self.properties,
+            "params": self.params,
+            "tc_names": self.tc_names,
+            "lab_names": self.lab_names,
+            "tc_meta": self.tc_meta,
+            "lab_meta": self.lab_meta,
+        }
+        with open(os.path.join(directory, self.meta_file), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        for attr in self._array_names():
+            path = os.path.join(directory, f"instance_{attr}.npy")
+            array = getattr(self, attr)
+            # arrays memory-mapped from their own file are written already
+            if isinstance(array, np.memmap) and os.path.exists(path):
+                if os.path.samefile(array.filename, path):
+                    continue
+            np.save(path, array)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+            Read an instance from directory. The binary format written by save is preferred, instance.json is
+            read if there is no instance_meta.json.
+
+        Parameters
+        ----------
+        directory : str
+            instance directory, e.g., data/<instance name>
+        mmap : boolean, optional
+            Memory-map the read-only arrays of the binary format instead of reading them. The default is True.
+
+        Returns
+        -------
+        Instance
+        """
+        meta_path = os.path.join(directory, cls.meta_file)
+        if not os.path.exists(meta_path):
+            with open(os.path.join(directory, cls.json_file), encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            attr: np.load(
+                os.path.join(directory, f"instance_{attr}.npy"),
+                mmap_mode="r" if mmap and attr not in cls.state_arrays else None,
+            )
+            for attr in cls._array_names()
+        }
+        return cls(**meta, **arrays)
+
+    def write_json(self, file_name):
+        "Write the instance as nested dictionary (the format of instance.json)."
+        with open(file_name, "w", encoding="utf-8") as f:
+            json.dump(
+                self.to_dict(), f, indent=4, separators=(",", ":"), ensure_ascii=False
+            )
+
+    @classmethod
+    def _array_names(cls):
+        return list(cls.tc_arrays.values()) + list(cls.lab_arrays.values())
+
+    def _record(self, meta, n, arrays, export=False):
+        record = dict(meta)
+        for key, attr in arrays.items():
+            value = getattr(self, attr)[n]
+            if key in ("c_i", "default_i"):
+                value = _Row(value, self.lab_names, self.lab_index)
+                if export:
+                    value = {j: v for j, v in value.items() if v != INF}
+            elif export:
+                value = value.tolist()
+            record[key] = value
+        return record
+
+    def __getitem__(self, key):
+        if key == "test_centers":
+            return _Entities(
+                self, self.tc_names, self.tc_index, self.tc_meta, self.tc_arrays
+            )
+        elif key == "laboratories":
+            return _Entities(
+                self, self.lab_names, self.lab_index, self.lab_meta, self.lab_arrays
+            )
+        elif key == "properties":
+            return self.properties
+        return self.params[key]
+
+    def __setitem__(self, key, value):
+        if key in self.entities or key == "properties":
+            raise TypeError(f"'{key}' of an Instance is read-only.")
+        self.params[key] = value
+
+    def __iter__(self):
+        yield "properties"
+        yield from self.params
+        yield from self.entities
+
+    def __len__(self):
+        return len(self.params) + 3
+
+
+class _Entities(Mapping):
+    """Read-only view of all test centers or all laboratories."""
+
+    def __init__(self, instance, names, index, meta, arrays):
+        self.instance = instance
+        self.names = names
+        self.index = index
+        self.meta = meta
+        self.arrays = arrays
+
+    def __getitem__(self, name):
+        n = self.index[name]
+        return _Record(self.instance, self.meta[n], n, self.arrays)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class _Record(Mapping):
+    """Read-only view of a single test center or laboratory."""
+
+    def __init__(self, instance, meta, n, arrays):
+        self.instance = instance
+        self.meta = meta
+        self.n = n
+        self.arrays = arrays
+
+    def __getitem__(self, key):
+        if key in self.arrays:
+            value = getattr(self.instance, self.arrays[key])[self.n]
+            if key in ("c_i", "default_i"):
+                return _Row(value, self.instance.lab_names, self.instance.lab_index)
+            if isinstance(value, np.ndarray):
+                value = value.view()
+                value.flags.writeable = False
+            return value
+        return self.meta[key]
+
+    def __iter__(self):
+        yield from self.meta
+        yield from self.arrays
+
+    def __len__(self):
+        return len(self.meta) + len(self.arrays)
+
+
+class _Row(Mapping):
+    """Read-only view of a row of c or default, keyed by laboratory name."""
+
+    def __init__(self, row, names, index):
+        self.row = row
+        self.names = names
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.row[self.index[name]].item()
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
@@ -0,0 +1,139 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import os
+import time
+import cProfile
+import pandas as pd
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# peak resident set size of the process before the last resetPeakRSS in MB
+_peak_before_reset = 0.0
+
+
+class Instrumentation:
+    """
+    Per-period measurements of the rolling horizon procedure.
+
+    Every period yields one record with wall and CPU time per phase (<phase>_wall, <phase>_cpu in seconds) and
+    the peak resident set size during the phase (<phase>_peak_mb, including the memory of the solver; Linux
+    only, see resetPeakRSS):
+        update : updateSnapshotInputParameters
+        crit : computation of crit_i and crit_j
+        model : writing the input parameters of the period into the model
+        start : construction of the MIP start
+        solve : solver (including a repeated solve without cutoff)
+        extract : extraction of the solution and adding it to the Solution object
+    plus the model size (vars, rows, nonzeros), MIP gap and node count of the solver, the resident set size at
+    the end of the period (rss_mb) and the peak resident set size of the process so far (peak_rss_mb, a
+    lifetime maximum, e.g., the memory of a benchmark run in its own process). The phase 'build' (model
+    construction) is recorded once in build.
+    For the periods in profile_periods, cProfile statistics are written to profile_path/period_<t>.prof.
+    """
+
+    def __init__(self, profile_periods=(), profile_path="profiles/"):
+        self.records = []
+        self.build = dict()
+        self.profile_periods = set(profile_periods)
+        self.profile_path = profile_path
+        self.current = self.build
+        self.profiler = None
+
+    @contextmanager
+    def phase(self, name):
+        "Add wall and CPU time and the peak resident set size of the enclosed code to phase name of the current period."
+        reset = resetPeakRSS()  # phases are not nested
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            measured = [
+                (name + "_wall", time.perf_counter() - wall),
+                (name + "_cpu", time.process_time() - cpu),
+            ]
+            for key, value in measured:
+                self.current[key] = self.current.get(key, 0) + value
+            if reset:  # the larger peak if the phase is entered twice in a period
+                key = name + "_peak_mb"
+                self.current[key] = max(self.current.get(key, 0), peakRSS(True))
+
+    def start_period(self, t):
+        self.current = {"t": t}
+        if t in self.profile_periods:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def end_period(self, snapshot):
+        "Complete the record of the current period with the state of the model and the process."
+        if self.profiler is not None:
+            self.profiler.disable()
+            os.makedirs(self.profile_path, exist_ok=True)
+            self.profiler.dump_stats(
+                os.path.join(self.profile_path, f"period_{self.current['t']}.prof")
+            )
+            self.profiler = None
+        b = snapshot.backend
+        self.current.update(
+            vars=b.num_vars,
+            rows=b.num_rows,
+            nonzeros=b.num_nonzeros,
+            mip_gap=b.mip_gap,
+            nodes=b.nodes,
+            rss_mb=currentRSS(),
+            peak_rss_mb=peakRSS(),
+        )
+        self.records.append(self.current)
+        self.current = dict()
+
+    def to_frame(self):
+        "One row per period."
+        return pd.DataFrame(self.records)
+
+    def to_csv(self, file_name):
+        self.to_frame().to_csv(file_name, index=False)
+
+
+def currentRSS():
+    "Current resident set size of the process in MB, None if not available (/proc only exists on Linux)."
+    try:
+        with open("/proc/self/statm") as f:
+            resident = int(f.read().split()[1])
+    except OSError:
+        return None
+    return resident * PAGE_SIZE / 2**20
+
+
+def peakRSS(since_reset=False):
+    "Peak resident set size of the process in MB since its start (since the last resetPeakRSS if since_reset)."
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+    return peak if since_reset else max(peak, _peak_before_reset)
+
+
+def resetPeakRSS():
+    "Reset the peak resident set size of the process (Linux, /proc/self/clear_refs), whether it was reset."
+    global _peak_before_reset
+    peak = peakRSS()
+    if peak is None:
+        return False
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    _peak_before_reset = peak
+    return True
@@ -7,12 +7,20 @@ Created on Thu Nov 26 08:02:33 2020
 @author: Stefan Nickel (stefan.nickel@kit.edu)
 """
 
+import os
 import sys
+import pickle
 import pandas as pd
 import numpy as np
 import warnings
-
-from DTSA_snap import solveSnapshot
+from contextlib import nullcontext
+
+from DTSA_snap import solveSnapshot, formulations
+from Decomposition import DecomposedSnapshot
+from Heuristic import HeuristicSnapshot
+from Presolve import PresolvedSnapshot
+from Instance import Instance
+from RawData import readRaw
 from Solution import Solution
 
 
@@ -26,14 +34,28 @@ def runOnlineProcedure(
     eta=1.0,
     crit_I_meth="all-zeroes",
     crit_J_meth="all-zeroes",
+    warm_start=True,
+    backend="cplex",
+    threads=0,
+    solution=None,
+    checkpoint=None,
+    checkpoint_every=1,
+    resume_from=None,
+    decompose=False,
+    processes=None,
+    compare=False,
+    heuristic=False,
+    presolve=False,
+    formulation="slots",
+    stats=None,
 ):
     """
         Start rolling horizon procedure
 
     Parameters
     ----------
-    data : dict
-        Problem instance.
+    data : Instance or dict
+        Problem instance, a dict is converted to an Instance.
     verbose : boolean, optional
         Report output. The default is False.
     tau_max : int, optional
@@ -50,6 +72,44 @@ def runOnlineProcedure(
         name of method to compute crit_i. The default is 'all-zeroes'.
     crit_J_meth : str, optional
         name of method to compute crit_j. The default is 'all-zeroes'.
+    warm_start : boolean, optional
+        Warm start every snapshot from the assignment of the previous period (the default
+        assignment in the first period). The default is True.
+    backend : str, optional
+        Solver backend, 'cplex' or 'highs'. The default is 'cplex'.
+    threads : int, optional
+        Number of solver threads, 0 lets the solver decide. The default is 0.
+    solution : Solution, optional
+        Solution object the periods are added to, e.g., a SolutionStream. If it already holds periods, the
+        procedure continues after the last one. The default is None, i.e., a new Solution.
+    checkpoint : str, optional
+        File the state of the procedure is written to every checkpoint_every periods and before exiting due
+        to an infeasible snapshot problem. The default is None, i.e., no checkpoints.
+    checkpoint_every : int, optional
+        Number of periods between two checkpoints. The default is 1.
+    resume_from : str, optional
+        Checkpoint file to continue the procedure from. The default is None.
+    decompose : boolean, optional
+        Solve every snapshot decomposed by Bundesland, see Decomposition.DecomposedSnapshot. The default is False.
+    processes : int, optional
+        Number of worker processes for the regional models if decompose. The default is None, i.e., number of cores.
+    compare : boolean, optional
+        If decompose, also solve the monolithic model and report the gap, its objective values are stored in
+        solution.sol["monolithic_obj"]. If presolve, also solve the full model and report its solution time.
+        The default is False.
+    heuristic : boolean, optional
+        Solve every snapshot heuristically (LP relaxation and rounding, see Heuristic.HeuristicSnapshot)
+        instead of to a MIP gap of 1%. The LP bound is stored in solution.sol["bound"]. The default is False.
+    presolve : boolean, optional
+        Fix non-critical test centers with an uncongested default laboratory to it before solving, see
+        Presolve.PresolvedSnapshot. The fixed test centers and eliminated variables per period are stored in
+        solution.sol["presolve"], with compare also the solution time of the full model. The default is False.
+    formulation : str, optional
+        'slots' (y for every slot tau) or 'compact' (one slot per district and flows per pair and slot,
+        DTSA_snap.CompactSnapshot, fewer binary variables). The default is 'slots'.
+    stats : Instrumentation, optional
+        Records per-phase times, model sizes, MIP gap, nodes and peak memory of every period. The records
+        are also stored in solution.sol["stats"]. The default is None.
 
     Returns
     -------
@@ -57,57 +117,252 @@ def runOnlineProcedure(
         Solution object.
     """
 
-    solution = Solution(data)  # Initialize solution object
-
-    # Initialize decision variables for first iteration (default is zeros)
-    y_idx = [
-        (i, lab, t)
-        for i in data["test_centers"]
-        for lab in data["laboratories"]
-        for t in range(1, data["tau_max"] + 2)
-    ]
-    y = dict()
-    for entry in y_idx:
-        y[entry] = 0
-    L = dict()
-    for lab, lab_info in data["laboratories"].items():
-        L[lab] = 0
+    if not isinstance(data, Instance):
+        data = Instance.from_dict(data)
+    if solution is None:
+        solution = Solution(data)  # Initialize solution object
 
     # Set model input parameters
-    data["tau_max"] = tau_max
-    data["C"] = C
-    data["Mc"] = Mc
-    data["theta"] = theta
-    data["eta"] = eta
-    crit_I_fct = gen_crit_I_fct(crit_I_meth)
-    crit_J_fct = gen_crit_J_fct(crit_J_meth)
-
-    for t in range(data["pandemic_duration"]):  # start procedure
+    setParameters(data, tau_max, C, Mc, theta, eta)
+    crit_I_fct = gen_crit_I_fct(crit_I_meth, data)
+    crit_J_fct = gen_crit_J_fct(crit_J_meth, data)
+    phase = stats.phase if stats is not None else nullcontext
+    snapshot = buildSnapshot(
+        data,
+        verbose=verbose,
+        backend=backend,
+        threads=threads,
+        decompose=decompose,
+        processes=processes,
+        compare=compare,
+        heuristic=heuristic,
+        presolve=presolve,
+        formulation=formulation,
+        stats=stats,
+    )  # built once, updated every period
+
+    if resume_from is not None:
+        t_start, y, L = readCheckpoint(resume_from, data, solution)
+    else:
+        t_start, y, L = replaySolution(data, solution)
+
+    for t in range(t_start, data["pandemic_duration"]):  # start procedure
         print("Period " + str(t))
+        if stats is not None:
+            stats.start_period(t)
 
-        updateSnapshotInputParameters(data, t, y, L)  # update snapshot parameters
+        y_prev, L_prev = y, L
+        Cap_bar_prev, L_state_prev = data.Cap_bar.copy(), data.L.copy()
+        with phase("update"):
+            updateSnapshotInputParameters(data, t, y, L)  # update snapshot parameters
         y, L = solveSnapshot(
-            data, solution, t, crit_I_fct, crit_J_fct, verbose=verbose
+            data,
+            solution,
+            t,
+            crit_I_fct,
+            crit_J_fct,
+            verbose=verbose,
+            snapshot=snapshot,
+            y_start=y if warm_start else None,
+            stats=stats,
         )  # return the information from the solution needed to update params
+        if stats is not None:
+            stats.end_period(snapshot)
 
         if y == None or L == None:
+            if checkpoint is not None:
+                # state before period t, e.g., to resume with other parameters
+                writeCheckpoint(
+                    checkpoint, t, y_prev, L_prev, Cap_bar_prev, L_state_prev, solution
+                )
             print(
                 f"\nExiting from runOnlineProcedure() due to an infeasible snapshot problem in stage {t}"
             )
+            snapshot.close()
             sys.exit()
 
+        if checkpoint is not None and (t + 1) % checkpoint_every == 0:
+            writeCheckpoint(checkpoint, t + 1, y, L, data.Cap_bar, data.L, solution)
+
+    snapshot.close()
+    if decompose and compare:
+        solution.sol["monolithic_obj"] = snapshot.monolithic
+    if presolve:
+        solution.sol["presolve"] = snapshot.report
+    if stats is not None:
+        solution.sol["stats"] = stats.records
     return solution
 
 
+def setParameters(data, tau_max, C, Mc, theta, eta):
+    "Set the model input parameters of the procedure, see runOnlineProcedure."
+    data["tau_max"] = tau_max
+    # the instance may be generated for a larger tau_max, Cap_bar holds tau_max slots
+    data.Cap_bar = np.array(data.Cap_bar[:, :tau_max])
+    data["C"] = C
+    data["Mc"] = Mc
+    data["theta"] = theta
+    data["eta"] = eta
+
+
+def buildSnapshot(
+    data,
+    verbose=False,
+    backend="cplex",
+    threads=0,
+    decompose=False,
+    processes=None,
+    compare=False,
+    heuristic=False,
+    presolve=False,
+    formulation="slots",
+    stats=None,
+):
+    """
+        Build the snapshot model, see runOnlineProcedure for the parameters
+
+    Returns
+    -------
+    SnapshotModel
+        SnapshotModel, CompactSnapshot, DecomposedSnapshot, HeuristicSnapshot or PresolvedSnapshot.
+    """
+    if decompose + heuristic + presolve > 1:
+        raise ValueError("decompose, heuristic and presolve cannot be combined.")
+    if formulation not in formulations:
+        raise ValueError(f"Unknown formulation '{formulation}'.")
+    if formulation != "slots" and (decompose or heuristic or presolve):
+        raise ValueError(
+            f"The formulation '{formulation}' cannot be combined with decompose, heuristic or presolve."
+        )
+    phase = stats.phase if stats is not None else nullcontext
+    with phase("build"):
+        if heuristic:
+            return HeuristicSnapshot(
+                data, verbose=verbose, backend=backend, threads=threads
+            )
+        elif decompose:
+            return DecomposedSnapshot(
+                data,
+                verbose=verbose,
+                backend=backend,
+                threads=threads,
+                processes=processes,
+                compare=compare,
+            )
+        elif presolve:
+            return PresolvedSnapshot(
+                data, verbose=verbose, backend=backend, threads=threads, compare=compare
+            )
+        return formulations[formulation](
+            data, verbose=verbose, backend=backend, threads=threads
+        )
+
+
+def replaySolution(data, solution):
+    """
+        Restore the state of the procedure after the periods the solution already holds
+
+    Parameters
+    ----------
+    data : Instance
+        Problem instance, the residual capacities and backlogs are updated.
+    solution : Solution
+        Solution object.
+
+    Returns
+    -------
+    t, y, L
+        index of the next period, values of y^(t-1)* and L^(t-1)* (initial values if t = 0).
+    """
+    # Initialize decision variables for first iteration (default is zeros)
+    y = dict()  # only nonzero assignments are stored
+    L = dict()
+    for lab, lab_info in data["laboratories"].items():
+        L[lab] = 0
+
+    t_start = len(solution.sol["obj"])
+    for t, (y_t, L_t) in zip(range(t_start), solution.assignments()):
+        updateSnapshotInputParameters(data, t, y, L)
+        y, L = y_t, L_t
+    return t_start, y, L
+
+
+def writeCheckpoint(file_name, t, y, L, Cap_bar, L_state, solution):
+    """
+        Write the state of the procedure before period t to file_name (pickle, replaced atomically). The
+        periods of solution are appended to file_name + '.periods' once, see Solution.get_state, a
+        SolutionStream keeps them in its own file.
+
+    Parameters
+    ----------
+    file_name : str
+        checkpoint file.
+    t : int
+        index of the next period.
+    y : dict
+        nonzero values of y^(t-1)*
+    L : dict
+        values of L^(t-1)*
+    Cap_bar : np.ndarray
+        residual capacities of the instance before period t.
+    L_state : np.ndarray
+        backlogs of the instance before period t.
+    solution : Solution
+        Solution object holding periods 0, ..., t-1.
+    """
+    state = {
+        "t": t,
+        "y": y,
+        "L": L,
+        "Cap_bar": Cap_bar,
+        "L_state": L_state,
+        "solution": solution.get_state(file_name + ".periods"),
+    }
+    with open(file_name + ".tmp", "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file_name + ".tmp", file_name)
+
+
+def readCheckpoint(file_name, data, solution):
+    """
+        Restore the state of the procedure written by writeCheckpoint
+
+    Parameters
+    ----------
+    file_name : str
+        checkpoint file.
+    data : Instance
+        Problem instance, the residual capacities and backlogs are overwritten.
+    solution : Solution
+        Solution object, continues from the stored state.
+
+    Returns
+    -------
+    t, y, L
+        index of the next period, values of y^(t-1)* and L^(t-1)*.
+    """
+    with open(file_name, "rb") as f:
+        state = pickle.load(f)
+    if state["Cap_bar"].shape != data.Cap_bar.shape:
+        raise ValueError(
+            f"Checkpoint {file_name} was written for tau_max = {state['Cap_bar'].shape[1]}."
+        )
+    data.Cap_bar[:] = state["Cap_bar"]
+    data.L[:] = state["L_state"]
+    solution.set_state(state["solution"], file_name + ".periods")
+    return state["t"], state["y"], state["L"]
+
+
 def updateSnapshotInputParameters(
     data, t, y, L
 ):  # depends on data and current assignments
     """
-        Update snapshot parameters. New values are written in the data dictionary, thus no return type.
+        Update snapshot parameters. New values are written in the state arrays Cap_bar and L of the instance,
+        thus no return type.
 
     Parameters
     ----------
-    data : dict
+    data : Instance
         Problem instance.
     t : int
         period index
@@ -117,21 +372,23 @@ def updateSnapshotInputParameters(
         values of L^(t-1)*
     """
 
-    for lab, lab_info in data["laboratories"].items():
-        Cap_bar_new = []
-        for tau in range(1, data["tau_max"]):  # tau^max-1 -->#11
-            Cap_bar_new.append(
-                lab_info["Cap_bar"][tau]
-                - sum(
-                    data["test_centers"][i]["d_i"][t - 1] * y[(i, lab, tau + 1)]
-                    for i in data["test_centers"].keys()
-                )
-            )  # 11
-        Cap_bar_new.append(
-            max(lab_info["Cap_t"][t + data["tau_max"]] - L[lab], 0)
-        )  # 12
-        lab_info["Cap_bar"] = Cap_bar_new
-        lab_info["L"] = L[lab]  # current backlog (from previous period)
+    tau_max = data["tau_max"]
+    L = np.array([L[lab] for lab in data.lab_names], dtype=float)
+
+    # tests assigned to every lab and slot, built from the nonzero assignments only
+    load = np.zeros((len(data.lab_names), tau_max + 1))
+    if y:
+        keys = list(y.keys())
+        i_idx = np.array([data.tc_index[i] for i, lab, tau in keys])
+        j_idx = np.array([data.lab_index[lab] for i, lab, tau in keys])
+        slots = np.array([tau for i, lab, tau in keys]) - 1
+        np.add.at(
+            load, (j_idx, slots), data.d[i_idx, t - 1] * np.array(list(y.values()))
+        )
+
+    data.Cap_bar[:, :-1] = data.Cap_bar[:, 1:] - load[:, 1:tau_max]  # 11
+    data.Cap_bar[:, -1] = np.maximum(data.Cap[:, t + tau_max] - L, 0)  # 12
+    data.L[:] = L  # current backlog (from previous period)
 
 
 def compact_warning(message, category, filename, lineno, file=None, line=None):
@@ -141,99 +398,162 @@ def compact_warning(message, category, filename, lineno, file=None, line=None):
 warnings.formatwarning = compact_warning
 
 
-def gen_crit_I_fct(method):
+def gen_crit_I_fct(method, data):
     """
-        Generate crit_i values
+        Generate crit_i values. Methods that only depend on the instance are evaluated for all periods at once.
 
     Parameters
     ----------
     method : str
         name of crit i computation method.
+    data : Instance
+        Problem instance.
 
     Returns
     -------
     function
-        function to compute crit_i values in upcoming procedure.
+        function f(data, sol, t) returning the crit_i values of period t as array over the test centers.
 
     """
     print(f"Using crit_I() method '{method}'.")
+    crit = crit_I_values(method, data)
 
-    if method == "all-zeroes":
+    def f(data, sol, t, crit=crit):
+        return crit[:, t]
 
-        def f(i, data, sol, t):
-            return 0
+    return f
 
-        return f
 
-    elif method == "incidences":
+def crit_I_values(method, data, t=None):
+    """
+        crit_i values of all periods, see gen_crit_I_fct
 
-        def f(i, data, sol, t):
-            threshold = 100
-            return int(threshold < data["test_centers"][i]["incidence_i"][t])
+    Parameters
+    ----------
+    method : str
+        crit_I() method.
+    data : Instance
+        Problem instance.
+    t : int, optional
+        only the values of period t are computed (the R value methods read all periods). The default is None.
 
-        return f
+    Returns
+    -------
+    np.ndarray
+        crit_i values with shape (number of test centers, pandemic_duration), (number of test centers,) if t
+        is given
+    """
+    T = data["pandemic_duration"]
+    periods = slice(None, T) if t is None else t
 
-    elif method == "workload":
+    if method == "all-zeroes":
+        shape = (len(data.tc_names), T) if t is None else len(data.tc_names)
+        crit = np.zeros(shape, dtype=int)
 
-        def f(i, data, sol, t):
-            threshold = 1.5
-            if data["test_centers"][i]["d_i"][t - 1] > 0:
-                return int(
-                    threshold
-                    < data["test_centers"][i]["d_i"][t]
-                    / data["test_centers"][i]["d_i"][t - 1]
-                )
-            else:
-                return 0
+    elif method == "incidences":
+        threshold = 100
+        crit = (threshold < data.inc[:, periods]).astype(int)
 
-        return f
+    elif method == "workload":
+        threshold = 1.5
+        if t is None:
+            d = np.asarray(data.d, dtype=float)
+            d_prev = np.roll(d, 1, axis=1)  # d_i[t - 1], in t = 0 the last entry of d_i
+        else:
+            d = data.d[:, t].astype(float)
+            d_prev = data.d[:, t - 1].astype(float)
+        ratio = np.divide(d, d_prev, out=np.zeros_like(d), where=d_prev > 0)
+        crit = (threshold < ratio).astype(int)
+        if t is None:
+            crit = crit[:, :T]
 
     elif method == "R_values":
-        R_df = pd.read_json("data_raw/R_per_district_vs_time_DF.json")
-        # R_df.info()
-        R_plausible_ub = 5
-        R_crit_threshold = 1.5
-
-        def f(i, data, sol, t, df=R_df):
-            t_as_day = pd.Timestamp(data["properties"]["start_date"]) + pd.to_timedelta(
-                t, unit="d"
-            )
+        crit = crit_from_R_values(data, "data_raw/R_per_district_vs_time_DF.json", "R")
+        crit = crit[:, periods]
 
-            R_val = df.loc[t_as_day, i]
-            if not np.isfinite(R_val) or R_val > R_plausible_ub:
-                warnings.warn(
-                    f"Criticality is set to 0 because R value for {i} on {t_as_day} is dubious: {R_val} > {R_plausible_ub}."
-                )
-                # sys.exit()
-                return 0
-            return int(R_val > R_crit_threshold)
+    elif method == "R7_values":
+        crit = crit_from_R_values(
+            data, "data_raw/R7_per_district_vs_time_DF.json", "R7"
+        )
+        crit = crit[:, periods]
 
-        return f
+    else:
+        raise ValueError(f"unknown crit_I method {method!r}")
 
-    elif method == "R7_values":
-        R7_df = pd.read_json("data_raw/R7_per_district_vs_time_DF.json")
-        # R_df.info()
-        R_plausible_ub = 5
-        R_crit_threshold = 1.5
-
-        def f(i, data, sol, t, df=R7_df):
-            t_as_day = pd.Timestamp(data["properties"]["start_date"]) + pd.to_timedelta(
-                t, unit="d"
-            )
+    return crit
 
-            R_val = df.loc[t_as_day, i]
-            if not np.isfinite(R_val) or R_val > R_plausible_ub:
-                warnings.warn(
-                    f"Criticality is set to 0 because R7 value for {i} on {t_as_day} is dubious: {R_val} > {R_plausible_ub}."
-                )
-                # sys.exit()
-                return 0
-            return int(R_val > R_crit_threshold)
 
-        return f
+def crit_from_R_values(data, file_name, label, R_plausible_ub=5, R_crit_threshold=1.5):
+    """
+        crit_i values of all periods based on (7-day) R values.
+        Dubious R values, i.e., not finite or above R_plausible_ub, give crit_i = 0 and are reported in a
+        single warning.
+
+    Parameters
+    ----------
+    data : Instance
+        Problem instance.
+    file_name : str
+        path to the R values per district (columns) and day (rows).
+    label : str
+        name of the values in the warning.
+    R_plausible_ub : float, optional
+        largest plausible R value. The default is 5.
+    R_crit_threshold : float, optional
+        test centers with R values above are critical. The default is 1.5.
+
+    Returns
+    -------
+    np.ndarray
+        crit_i values with shape (number of test centers, pandemic_duration)
+
+    """
+    R_df = readRaw(file_name, "dataframe")
+    days = pd.Timestamp(data["properties"]["start_date"]) + pd.to_timedelta(
+        np.arange(data["pandemic_duration"]), unit="D"
+    )
+    R_val = R_df.loc[days, data.tc_names].to_numpy(dtype=float).T
+    return crit_from_R(
+        R_val, data.tc_names, days, label, R_plausible_ub, R_crit_threshold
+    )
+
+
+def crit_from_R(
+    R_val, tc_names, days, label="R", R_plausible_ub=5, R_crit_threshold=1.5
+):
+    """
+        crit_i values of R values, see crit_from_R_values
 
+    Parameters
+    ----------
+    R_val : np.ndarray
+        R values with shape (number of test centers, number of days).
+    tc_names : list
+        names of the test centers.
+    days : pd.DatetimeIndex
+        days of the columns of R_val.
 
-def gen_crit_J_fct(method):
+    Returns
+    -------
+    np.ndarray
+        crit_i values with the shape of R_val
+    """
+    dubious = ~np.isfinite(R_val) | (R_val > R_plausible_ub)
+    if dubious.any():
+        n_examples = 10
+        examples = ", ".join(
+            f"{tc_names[i]} on {days[t].date()}: {R_val[i, t]}"
+            for i, t in list(zip(*np.nonzero(dubious)))[:n_examples]
+        )
+        if dubious.sum() > n_examples:
+            examples += ", ..."
+        warnings.warn(
+            f"Criticality is set to 0 for {dubious.sum()} dubious {label} values (not finite or > {R_plausible_ub}): {examples}"
+        )
+    return ((R_val > R_crit_threshold) & ~dubious).astype(int)
+
+
+def gen_crit_J_fct(method, data):
     """
         Generate crit_j values
 
@@ -241,72 +561,56 @@ def gen_crit_J_fct(method):
     ----------
     method : str
         name of crit j computation method.
+    data : Instance
+        Problem instance.
 
     Returns
     -------
     function
-        function to compute crit_j values in upcoming procedure.
+        function f(data, sol, t) returning the crit_j values of period t as array over the laboratories.
 
     """
     print(f"Using crit_J() method '{method}'.")
+    J = len(data.lab_names)
+
     if method == "all-zeroes":
 
-        def f(j, data, sol, t):
-            return 0
+        def f(data, sol, t):
+            return np.zeros(J, dtype=int)
 
         return f
 
     elif method == "incidences":
 
-        def f(j, data, sol, t):
-            if t > 0:
-                threshold = 100
-                if (
-                    sum(
-                        data["test_centers"][i]["d_i"][t - 1]
-                        * sol.sol["y"][t - 1][i][j][0]
-                        for i in data["test_centers"]
-                    )
-                ) > 0:
-                    return int(
-                        threshold
-                        < sum(
-                            data["test_centers"][i]["incidence_i"][t - 1]
-                            * sol.sol["y"][t - 1][i][j][0]
-                            * data["test_centers"][i]["d_i"][t - 1]
-                            for i in data["test_centers"]
-                        )
-                        / (
-                            sum(
-                                data["test_centers"][i]["d_i"][t - 1]
-                                * sol.sol["y"][t - 1][i][j][0]
-                                for i in data["test_centers"]
-                            )
-                        )
-                    )
-                else:
-                    return 0
-            else:
-                return 0
+        def f(data, sol, t):
+            if t == 0:
+                return np.zeros(J, dtype=int)
+            threshold = 100
+            # tests of period t-1 processed in tau = 1 per lab, see Solution.aggregate
+            tests = sol.lab_load[:, 0]
+            incidence = np.divide(
+                sol.lab_weighted[:, 0], tests, out=np.zeros(J), where=tests > 0
+            )  # mean incidence of the tests processed by the lab
+            return (threshold < incidence).astype(int)
 
         return f
 
     elif method == "workload":
-
-        def f(j, data, sol, t):
-            threshold = 0.8
-            if t > 0:
-                if data["laboratories"][j]["Cap"] > 0:
-                    return int(
-                        threshold
-                        < (
-                            data["laboratories"][j]["Cap_bar"][0]
-                            / data["laboratories"][j]["Cap"]
-                        )
-                    )
-                else:
-                    return 0
-            else:
-                return 0
+        threshold = 0.8
+        Cap = np.array(
+            [lab_info["Cap"] for lab_info in data["laboratories"].values()],
+            dtype=float,
+        )
+
+        def f(data, sol, t):
+            if t == 0:
+                return np.zeros(J, dtype=int)
+            workload = np.divide(
+                data.Cap_bar[:, 0], Cap, out=np.zeros(J), where=Cap > 0
+            )
+            return (threshold < workload).astype(int)
 
         return f
+
+    else:
+        raise ValueError(f"unknown crit_J method {method!r}")
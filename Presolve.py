@@ -0,0 +1,208 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import numpy as np
+
+from DTSA_snap import SnapshotModel
+
+
+class PresolvedSnapshot(SnapshotModel):
+    """
+    DTSA_snap(t) with a presolve that fixes variables which take the same value in an optimal solution.
+
+    Stable test centers: a laboratory j is uncongested in period t if the demand of all test centers that
+    (6) and (7) permit to be assigned to j fits into its first slot, sum_i d_i[t] <= Cap_bar[j, 1]. Then
+    every test center whose default laboratory is uncongested can be moved to (default_i, tau = 1) in any
+    solution without violating (4)-(9) and without increasing the objective: its demand is no longer
+    delayed, s_i can be 0 and the backlogs of the other laboratories do not grow. The presolve fixes all
+    such test centers with crit_i = 0 (y by the bounds, see fix_assignment, and s_i = 0). A fixed test
+    center no longer counts at other laboratories, so the test is repeated until no further laboratory
+    becomes uncongested (the fixings only grow, the argument holds for the final set). Test centers
+    without tests (d_i[t] = 0, about 30% of the districts and days in data_raw) neither use capacity nor
+    appear in the objective, they are fixed to (default_i, tau = 1) as well.
+
+    Reduced cost fixing: with the MIP start as incumbent (objective value UB), the LP relaxation of the
+    presolved model is solved (objective value LB, reduced costs rc). Every solution with a binary
+    variable at its other bound has objective value at least LB + |rc|, so variables at their lower
+    bound with rc > UB - LB are fixed to 0, variables at their upper bound with rc < -(UB - LB) to 1. No
+    solution better than the MIP start is cut off. This mostly removes delayed slots (rc about d_i[t])
+    whenever the MIP start is close to the LP bound, e.g., with the start of SnapshotModel.set_start.
+
+    The number of fixed test centers and of variables eliminated by both steps is stored in report for
+    every period. With compare=True the full model is solved as well, from the same MIP start and before the
+    presolved model, and its solution time is reported.
+    """
+
+    def __init__(self, data, verbose=True, backend="cplex", threads=0, compare=False):
+        super().__init__(data, verbose=verbose, backend=backend, threads=threads)
+        self.verbose = verbose
+        self.compare = compare
+        self.fixed = np.zeros(len(self.I), dtype=bool)
+        self.rc_cols = np.zeros(0, dtype=int)  # variables fixed by reduced costs
+        self.y_prev = None  # MIP start of the current period, see set_start
+        self.start_obj = None
+        self.report = []  # one record per period
+
+    def update(self, t, crit_I, crit_J):
+        """Write the input parameters of period t into the model and fix the stable test centers."""
+        super().update(t, crit_I, crit_J)
+        self.release()
+
+        d = self.d[:, t]
+        i_all = np.arange(len(self.I))
+        pi, pj = self.pi, self.pj
+        permitted = self.permitted(pi, pj)
+        stable = (self.crit_I == 0) & self.permitted(i_all, self.default_lab)
+        empty = (d == 0) & self.permitted(i_all, self.default_lab)
+        fixed = empty.copy()
+        # fixed test centers only count at their default laboratory, more laboratories become uncongested
+        while True:
+            counted = permitted & (~fixed[pi] | (pj == self.default_lab[pi]))
+            eligible = np.bincount(pj, weights=d[pi] * counted, minlength=len(self.J))
+            uncongested = eligible <= self.Cap_bar[:, 0]
+            fixed_new = empty | stable & uncongested[self.default_lab]
+            if (fixed_new == fixed).all():
+                break
+            fixed = fixed_new
+        self.fixed = fixed
+        self.fix()
+
+        n_pairs = np.bincount(self.pi, minlength=len(self.I))
+        self.report.append(
+            {
+                "t": t,
+                "variables": self.backend.num_vars,
+                "fixed": int(self.fixed.sum()),
+                # y of all candidate pairs and s of the fixed test centers
+                "eliminated": int(
+                    n_pairs[self.fixed].sum() * self.K + self.fixed.sum()
+                ),
+                "rc_eliminated": 0,
+            }
+        )
+
+    def fix(self):
+        i_idx = np.flatnonzero(self.fixed)
+        self.fix_assignment(i_idx, self.default_lab[i_idx], np.zeros(len(i_idx), int))
+        self.backend.change_bounds(self.s_col[i_idx], 0, 0)
+
+    def release(self):
+        "Undo the fixings of the previous period."
+        i_idx = np.flatnonzero(self.fixed)
+        self.free_assignment(i_idx)
+        self.backend.change_bounds(self.s_col[i_idx], 0, 1)
+        self.fixed[:] = False
+        self.backend.change_bounds(self.rc_cols, 0, 1)
+        self.rc_cols = np.zeros(0, dtype=int)
+
+    def start_assignment(self, y_prev, threshold=0.5):
+        """
+        MIP start of SnapshotModel.start_assignment with the fixed test centers at (default_i, tau = 1).
+        They have no tests or their default laboratory has room for all permitted test centers in tau = 1.
+        """
+        y_prev = {
+            key: val
+            for key, val in y_prev.items()
+            if not self.fixed[self.I_index[key[0]]]
+        }
+        start = super().start_assignment(y_prev, threshold)
+        if start is not None:
+            lab, slot = start
+            lab[self.fixed] = self.default_lab[self.fixed]
+            slot[self.fixed] = 0
+        return start
+
+    def set_start(self, y_prev):
+        """MIP start of SnapshotModel.set_start, kept to be installed again after the LP relaxation."""
+        start_obj = super().set_start(y_prev)  # clears the previous start first
+        self.y_prev, self.start_obj = y_prev, start_obj
+        return start_obj
+
+    def clear_start(self):
+        self.y_prev = self.start_obj = None
+        super().clear_start()
+
+    def restart(self):
+        "Install the MIP start of the current period again, without solutions of earlier solves."
+        y_prev = self.y_prev
+        if y_prev is None:
+            self.clear_start()
+        else:
+            self.set_start(y_prev)
+
+    def fix_reduced_costs(self):
+        """
+            Fix binary variables by their reduced costs in the LP relaxation, see PresolvedSnapshot.
+
+        Returns
+        -------
+        int
+            number of fixed variables.
+        """
+        self.rc_cols = np.zeros(0, dtype=int)
+        if self.start_obj is None:
+            return 0
+        relaxation = self.backend.solve_relaxation()
+        if relaxation is None:
+            return 0
+        values, rc = relaxation
+        gap = self.start_obj - self.backend.objective_value
+        gap += 1e-6 * max(1, abs(self.start_obj))
+        free = np.ones(len(self.I), dtype=bool)
+        free[self.fixed] = False
+        cols = np.concatenate((self.y_col[free[self.pi]].ravel(), self.s_col[free]))
+        at_zero = cols[(values[cols] < 1e-6) & (rc[cols] > gap)]
+        at_one = cols[(values[cols] > 1 - 1e-6) & (rc[cols] < -gap)]
+        self.backend.change_bounds(at_zero, 0, 0)
+        self.backend.change_bounds(at_one, 1, 1)
+        self.rc_cols = np.concatenate((at_zero, at_one))
+        return len(self.rc_cols)
+
+    def solve(self):
+        """
+            Solve the presolved model of the current period.
+
+        Returns
+        -------
+        boolean
+            Whether a solution was found. The solution time includes the LP relaxation of the reduced cost
+            fixing. With compare, the solution time of the full model is stored in report as well.
+        """
+        record = self.report[-1]
+        if self.compare and "full_solve_time" not in record:
+            fixed = self.fixed.copy()
+            self.release()
+            self.restart()
+            super().solve()
+            record["full_solve_time"] = self.solve_time
+            self.fixed = fixed
+            self.fix()
+            self.restart()  # the presolved model does not start from the full solution
+
+        # fixings of an earlier solve of the period, e.g., before its start was cleared
+        self.backend.change_bounds(self.rc_cols, 0, 1)
+        record["rc_eliminated"] = self.fix_reduced_costs()
+        lp_time = self.backend.solve_time if record["rc_eliminated"] else 0
+        self.restart()
+        solved = super().solve()
+        self.solve_time += lp_time
+        record["solve_time"] = self.solve_time
+        if self.verbose or self.compare:
+            message = (
+                f"presolve: {record['fixed']} of {len(self.I)} test centers fixed, "
+                f"{record['eliminated'] + record['rc_eliminated']} variables eliminated "
+                f"({record['rc_eliminated']} by reduced costs)"
+            )
+            if self.compare:
+                message += (
+                    f", solve time {self.solve_time:.3f}s "
+                    f"(full model {record['full_solve_time']:.3f}s)"
+                )
+            print(message)
+        return solved
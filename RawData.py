@@ -0,0 +1,160 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import os
+import hashlib
+import json
+import pickle
+import warnings
+import numpy as np
+import pandas as pd
+
+# parsed raw data files are stored in cache_path (pickle, named by the hash of the source file), None for no
+# persistent cache
+cache_path = "data_raw/cache/"
+
+# weekly incidences per district, not part of data_raw, see readIncidences
+incidence_file = "data_raw/weekly_incidences_per_district_vs_time_DF.json"
+
+# parsed data per source file of this process, pickled such that every caller gets its own copy
+_cache = dict()
+
+
+def readJSON(file_name, encoding="utf-8"):
+    with open(file_name, encoding=encoding) as f:
+        return json.load(f)
+
+
+def readDataFrame(file_name, encoding="utf-8"):
+    with open(file_name, encoding=encoding) as f:
+        return pd.read_json(f)
+
+
+def readExcel(file_name, index=None):
+    df = pd.read_excel(file_name, engine="openpyxl")
+    if index is not None:
+        df.set_index(index, inplace=True)
+    return df
+
+
+readers = {"json": readJSON, "dataframe": readDataFrame, "excel": readExcel}
+
+
+def readRaw(file_name, reader="json", **kwargs):
+    """
+        Parsed content of a raw data file. Every file is parsed at most once per process and, if cache_path
+        is set, once per version of the file: the parsed data is stored in cache_path/<file>.<hash>.pkl, where
+        hash is computed from the content of the file, the reader and its arguments.
+
+    Parameters
+    ----------
+    file_name : str
+        path of the raw data file.
+    reader : str, optional
+        'json' (json.load), 'dataframe' (pd.read_json) or 'excel' (pd.read_excel). The default is 'json'.
+    **kwargs
+        arguments of the reader, e.g., encoding or index.
+
+    Returns
+    -------
+    object
+        parsed data, a new copy on every call (callers may change it).
+    """
+    stat = os.stat(file_name)
+    key = (os.path.abspath(file_name), reader, tuple(sorted(kwargs.items())))
+    version = (stat.st_mtime_ns, stat.st_size)
+    if key not in _cache or _cache[key][0] != version:
+        _cache[key] = (version, _parse(file_name, reader, kwargs))
+    return pickle.loads(_cache[key][1])
+
+
+def _parse(file_name, reader, kwargs):
+    "Pickled data of file_name, from the persistent cache if possible."
+    if cache_path is None:
+        return pickle.dumps(readers[reader](file_name, **kwargs))
+
+    h = hashlib.sha256(repr((reader, sorted(kwargs.items()))).encode())
+    with open(file_name, "rb") as f:
+        h.update(f.read())
+    cache_file = os.path.join(
+        cache_path, f"{os.path.basename(file_name)}.{h.hexdigest()[:16]}.pkl"
+    )
+    try:
+        with open(cache_file, "rb") as f:
+            return f.read()
+    except OSError:
+        pass
+
+    data = pickle.dumps(
+        readers[reader](file_name, **kwargs), protocol=pickle.HIGHEST_PROTOCOL
+    )
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+        # concurrent processes write the same content
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"Raw data cache {cache_file} could not be written: {e}")
+    return data
+
+
+def readIncidences(
+    file_name=None,
+    test_file="data_raw/tests_per_district_vs_time_DF.json",
+    district_file="data_raw/district_data.json",
+    pos_rate_file="data_raw/pos_rates_day_state.xlsx",
+    derive=False,
+):
+    """
+        Weekly incidences per district (columns) and day (index). The incidence file is not part of data_raw;
+        if it is missing and derive is set, a proxy is derived from the tracked files (with a warning):
+        positive tests per district and day are the tests times the positive rate of its state (the first
+        and last known rate are used before and after the rates in pos_rate_file), the weekly incidence is
+        the sum of the last 7 days per 100,000 inhabitants.
+
+    Parameters
+    ----------
+    file_name : str, optional
+        incidence file. The default is None, i.e., incidence_file.
+    derive : boolean, optional
+        Derive the incidences if file_name is missing. The default is False, i.e., FileNotFoundError.
+
+    Returns
+    -------
+    pd.DataFrame
+        weekly incidences, a new copy on every call.
+    """
+    if file_name is None:
+        file_name = incidence_file
+    if os.path.exists(file_name):
+        return readRaw(file_name, "dataframe")
+    if not derive:
+        raise FileNotFoundError(
+            f"{file_name} is missing, derive=True derives the incidences from the tests and positive rates."
+        )
+    warnings.warn(
+        f"{file_name} is missing, the incidences are derived from the tests times the positive rate of "
+        "the state (sum of 7 days per 100,000 inhabitants)."
+    )
+
+    tests = readRaw(test_file, "dataframe")
+    districts = readRaw(district_file, "json")
+    rates = readRaw(pos_rate_file, "excel", index="Date")
+    rates = rates.reindex(tests.index).bfill().ffill()
+    states = [districts[i]["Bundesland"] for i in tests.columns]
+    population = np.array([districts[i]["population"] for i in tests.columns])
+    positive = tests.to_numpy() * rates[states].to_numpy() / 100
+    weekly = pd.DataFrame(positive, index=tests.index).rolling(7, min_periods=1).sum()
+    return pd.DataFrame(
+        np.round(weekly.to_numpy() * 1e5 / population, 1),
+        index=tests.index,
+        columns=tests.columns,
+    )
@@ -7,6 +7,11 @@ Created on Thu Nov 26 08:02:33 2020
 @author: Stefan Nickel (stefan.nickel@kit.edu)
 """
 
+import os
+import json
+import pickle
+import numpy as np
+
 
 class Solution:
     """
@@ -34,6 +39,16 @@ class Solution:
         ] = (
             []
         )  # target format sol["time"][t] --> time it took to solve problem at this iteration
+        self.sol[
+            "warm_start"
+        ] = (
+            []
+        )  # target format sol["warm_start"][t] --> objective value of the MIP start, None if solved without warm start
+        self.sol[
+            "bound"
+        ] = (
+            []
+        )  # target format sol["bound"][t] --> lower bound on the optimal objective value, None if not known
 
         # track crit I and crit J
         self.sol["crit_i"] = dict()  # target format sol["crit_i][i][t]
@@ -41,7 +56,15 @@ class Solution:
 
         # Track leftover capacity in each period
         self.sol["unused_cap"] = dict()
+        # target format sol["utilization"][t][j] --> share of Cap_bar[j][0] used in tau = 1
+        self.sol["utilization"] = []
         self.data = data  # added for convinience reasons
+        self.y_last = dict()  # nonzero assignments of the last period
+        # per laboratory aggregates of the last period, see aggregate
+        self.lab_load = None
+        self.lab_weighted = None
+        self.lab_utilization = None
+        self.journal = (None, 0)  # journal file of get_state and number of periods written to it
 
     def add_solution_from_period(
         self,
@@ -57,6 +80,8 @@ class Solution:
         tau_max,
         crit_i,
         crit_j,
+        warm_start=None,
+        bound=None,
     ):
         "In every period add solution from snapshot"
         self.sol["obj"].append(obj)
@@ -65,6 +90,8 @@ class Solution:
         self.sol["backlog"].append(backlog)
 
         self.sol["time"].append(time)
+        self.sol["warm_start"].append(warm_start)
+        self.sol["bound"].append(bound)
         # problem with y --> tuple key is not json "dumpable"
         self.sol["y"].append(dict())
         for i in s.keys():
@@ -72,13 +99,302 @@ class Solution:
             for j in L.keys():
                 self.sol["y"][-1][i][j] = []
                 for tau in range(1, tau_max + 2):
-                    self.sol["y"][-1][i][j].append(y[(i, j, tau)])
+                    self.sol["y"][-1][i][j].append(y.get((i, j, tau), 0))
+        self.y_last = y
+        self.aggregate(len(self.sol["L"]))
         self.sol["L"].append(L)
         self.sol["s"].append(s)
         self.sol["U_max"].append(U_max)
+        self.sol["utilization"].append(
+            dict(zip(self.data.lab_names, self.lab_utilization.tolist()))
+        )
 
         for i, i_val in crit_i.items():
             if i not in self.sol["crit_i"]:
                 self.sol["crit_i"][i] = [i_val]
             else:
                 self.sol["crit_i"][i].append(i_val)
+
+    def aggregate(self, t, utilization=None):
+        """
+            Compute the per laboratory aggregates of the assignments y_last of period t: lab_load and
+            lab_weighted hold the assigned tests and the incidence-weighted tests (sum of d_i[t] *
+            incidence_i[t]) per laboratory and slot tau with shape (J, tau_max + 1), lab_utilization the share
+            of the residual capacity Cap_bar[j][0] of period t used in tau = 1. Criteria on laboratory level
+            (see OnlineProcedure.gen_crit_J_fct) read these arrays instead of the assignments.
+
+        Parameters
+        ----------
+        t : int
+            period of y_last.
+        utilization : np.ndarray, optional
+            lab_utilization, e.g., if the residual capacities of period t are no longer known. The default
+            is None, i.e., computed from the current residual capacities of the instance.
+        """
+        data = self.data
+        shape = (len(data.lab_names), data["tau_max"] + 1)
+        self.lab_load = np.zeros(shape)
+        self.lab_weighted = np.zeros(shape)
+        if self.y_last:
+            keys = list(self.y_last)
+            i_idx = np.array([data.tc_index[i] for i, j, tau in keys])
+            index = (
+                np.array([data.lab_index[j] for i, j, tau in keys]),
+                np.array([tau for i, j, tau in keys]) - 1,
+            )
+            d = data.d[i_idx, t] * np.array(list(self.y_last.values()))
+            np.add.at(self.lab_load, index, d)
+            np.add.at(self.lab_weighted, index, data.inc[i_idx, t] * d)
+        if utilization is None:
+            Cap_bar = data.Cap_bar[:, 0]
+            utilization = np.divide(
+                self.lab_load[:, 0],
+                Cap_bar,
+                out=np.zeros(len(Cap_bar)),
+                where=Cap_bar > 0,
+            )
+        self.lab_utilization = np.asarray(utilization, dtype=float)
+
+    series = [
+        "obj",
+        "delay",
+        "reassignment",
+        "backlog",
+        "L",
+        "s",
+        "U_max",
+        "time",
+        "warm_start",
+        "bound",
+        "utilization",
+    ]
+
+    def period_record(self, t):
+        "Period t of sol with the nonzero assignments y only, see get_state."
+        record = {key: self.sol[key][t] for key in self.series}
+        record["y"] = {
+            (i, j, tau + 1): val
+            for i, y_i in self.sol["y"][t].items()
+            for j, y_ij in y_i.items()
+            for tau, val in enumerate(y_ij)
+            if val
+        }
+        record["crit_i"] = {i: i_val[t] for i, i_val in self.sol["crit_i"].items()}
+        return record
+
+    def add_period_record(self, record):
+        "Append a period returned by period_record to sol."
+        for key in self.series:
+            self.sol[key].append(record[key])
+        y = record["y"]
+        self.sol["y"].append(dict())
+        for i in record["s"].keys():
+            self.sol["y"][-1][i] = dict()
+            for j in record["L"].keys():
+                self.sol["y"][-1][i][j] = []
+                for tau in range(1, self.data["tau_max"] + 2):
+                    self.sol["y"][-1][i][j].append(y.get((i, j, tau), 0))
+        for i, i_val in record["crit_i"].items():
+            self.sol["crit_i"].setdefault(i, []).append(i_val)
+
+    def get_state(self, journal):
+        """
+            State to continue from, e.g., for checkpoints. The stored periods are not part of the state, the
+            periods not yet written to the file journal are appended to it (pickled, see period_record) and the
+            state holds the size of the journal instead. Thus, every period is written once and the state does
+            not grow with the number of periods.
+
+        Parameters
+        ----------
+        journal : str
+            file the periods are appended to, rewritten if the periods so far were written to another file.
+        """
+        name, written = self.journal
+        if name != journal:
+            written = 0
+        with open(journal, "ab" if written else "wb") as f:
+            for t in range(written, len(self.sol["obj"])):
+                pickle.dump(self.period_record(t), f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        self.journal = (journal, len(self.sol["obj"]))
+        return {
+            "periods": len(self.sol["obj"]),
+            "journal_size": size,
+            "y_last": self.y_last,
+            "lab_load": self.lab_load,
+            "lab_weighted": self.lab_weighted,
+            "lab_utilization": self.lab_utilization,
+        }
+
+    def set_state(self, state, journal):
+        "Continue from a state returned by get_state, periods appended to journal afterwards are dropped."
+        if "sol" in state:  # states written before the periods were journaled
+            self.sol = state["sol"]
+        else:
+            self.sol = Solution(self.data).sol
+            with open(journal, "r+b") as f:
+                for _ in range(state["periods"]):
+                    self.add_period_record(pickle.load(f))
+                f.truncate(state["journal_size"])
+            self.journal = (journal, state["periods"])
+        self.y_last = state["y_last"]
+        if state.get("lab_load") is not None:
+            self.lab_load = state["lab_load"]
+            self.lab_weighted = state["lab_weighted"]
+            self.lab_utilization = state["lab_utilization"]
+        elif self.sol["obj"]:  # states written before the aggregates were stored
+            self.aggregate(len(self.sol["obj"]) - 1, state.get("lab_utilization"))
+
+    def assignments(self):
+        "Nonzero assignments y and backlogs L of all stored periods, one (y, L) per period."
+        for y, L in zip(self.sol["y"], self.sol["L"]):
+            y = {
+                (i, j, tau + 1): val
+                for i, y_i in y.items()
+                for j, y_ij in y_i.items()
+                for tau, val in enumerate(y_ij)
+                if val
+            }
+            yield y, L
+
+
+class SolutionStream(Solution):
+    """
+    Solution that appends every period as one line to a JSON Lines file instead of keeping it in memory.
+
+    Only the summary series (see summary) are kept in sol. A line holds these values, the nonzero assignments
+    y as [i, j, tau, value], the backlogs L, the reassigned test centers s, crit_i, crit_j and the
+    aggregates of the laboratories (load, weighted load and utilization, see Solution.aggregate) of a period.
+    The aggregates are read back on resume, the instance may not (yet) contain the periods of the file, e.g.,
+    if the service restarts after updates, see service.AssignmentService.
+    With resume=True the periods of an existing file are read back and new periods are appended, see the
+    solution argument of OnlineProcedure.runOnlineProcedure.
+    """
+
+    summary = [
+        "obj",
+        "delay",
+        "reassignment",
+        "backlog",
+        "U_max",
+        "time",
+        "warm_start",
+        "bound",
+    ]
+
+    def __init__(self, data, file_name, resume=False):
+        super().__init__(data)
+        self.sol = {key: [] for key in self.summary}
+        self.file_name = file_name
+        if resume and os.path.exists(file_name):
+            self._restore()
+        else:
+            open(file_name, "w").close()
+
+    def _restore(self):
+        "Read the summary series and last assignments back, drop an incomplete last line of an interrupted run."
+        complete = 0
+        with open(self.file_name, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                period = json.loads(line)
+                complete += len(line)
+                for key in self.summary:
+                    self.sol[key].append(period.get(key))
+                self.y_last = {(i, j, tau): val for i, j, tau, val in period["y"]}
+        with open(self.file_name, "r+b") as f:
+            f.truncate(complete)
+        if self.sol["obj"]:
+            shape = (len(self.data.lab_names), self.data["tau_max"] + 1)
+            utilization = period.get("utilization", dict())
+            load = period.get("lab_load", dict())
+            weighted = period.get("lab_weighted", dict())
+            self.lab_load = np.zeros(shape)
+            self.lab_weighted = np.zeros(shape)
+            for j, lab in enumerate(self.data.lab_names):
+                self.lab_load[j] = load.get(lab, 0)
+                self.lab_weighted[j] = weighted.get(lab, 0)
+            self.lab_utilization = np.array(
+                [utilization.get(j, 0) for j in self.data.lab_names], dtype=float
+            )
+
+    def add_solution_from_period(
+        self,
+        obj,
+        delay,
+        reassignment,
+        backlog,
+        time,
+        y,
+        L,
+        s,
+        U_max,
+        tau_max,
+        crit_i,
+        crit_j,
+        warm_start=None,
+        bound=None,
+    ):
+        "In every period append solution from snapshot to the file"
+        self.y_last = y
+        self.aggregate(len(self.sol["obj"]))
+        period = {
+            "t": len(self.sol["obj"]),
+            "obj": obj,
+            "delay": delay,
+            "reassignment": reassignment,
+            "backlog": backlog,
+            "U_max": U_max,
+            "time": time,
+            "warm_start": warm_start,
+            "bound": bound,
+            "y": [[i, j, tau, val] for (i, j, tau), val in y.items() if val],
+            "L": L,
+            "s": [i for i, val in s.items() if val],
+            "crit_i": crit_i,
+            "crit_j": crit_j,
+            "utilization": dict(
+                zip(self.data.lab_names, self.lab_utilization.tolist())
+            ),
+            "lab_load": dict(zip(self.data.lab_names, self.lab_load.tolist())),
+            "lab_weighted": dict(
+                zip(self.data.lab_names, self.lab_weighted.tolist())
+            ),
+        }
+        with open(self.file_name, "a", encoding="utf-8") as f:
+            f.write(json.dumps(period, ensure_ascii=False) + "\n")
+        for key in self.summary:
+            self.sol[key].append(period[key])
+
+    def get_state(self, journal=None):
+        "State to continue from, the file of the stream takes the place of journal."
+        return {
+            "file_size": os.path.getsize(self.file_name),
+            "summary": {key: list(self.sol[key]) for key in self.summary},
+            "y_last": self.y_last,
+            "lab_load": self.lab_load,
+            "lab_weighted": self.lab_weighted,
+            "lab_utilization": self.lab_utilization,
+        }
+
+    def set_state(self, state, journal=None):
+        "Continue from a state returned by get_state, periods appended to the file afterwards are dropped."
+        if os.path.getsize(self.file_name) < state["file_size"]:
+            raise ValueError(
+                f"{self.file_name} holds fewer periods than the state to continue from."
+            )
+        self.sol = state["summary"] if "summary" in state else state["sol"]
+        self.y_last = state["y_last"]
+        self.lab_load = state.get("lab_load")
+        self.lab_weighted = state.get("lab_weighted")
+        self.lab_utilization = state.get("lab_utilization")
+        with open(self.file_name, "r+b") as f:
+            f.truncate(state["file_size"])
+
+    def assignments(self):
+        with open(self.file_name, encoding="utf-8") as f:
+            for line in f:
+                period = json.loads(line)
+                y = {(i, j, tau): val for i, j, tau, val in period["y"]}
+                yield y, period["L"]
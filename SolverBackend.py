@@ -0,0 +1,464 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+INF = float("inf")
+
+
+class SolverBackend(ABC):
+    """
+    Interface of the MILP solvers DTSA_snap(t) can be built and solved with.
+
+    Variables and constraints (rows) are addressed by the consecutive indices returned when they are added.
+    All methods take NumPy arrays, constraints are passed in bulk as a CSR matrix (starts, index, value)
+    with sorted column indices in every row.
+    Rows have a fixed sense ('L': <=, 'E': ==, 'G': >=), only their coefficients and right-hand sides change.
+    The objective is always minimized.
+    """
+
+    name = None
+
+    def __init__(self, verbose=False, mipgap=0.01, threads=0):
+        self.verbose = verbose
+        self.mipgap = mipgap
+        self.threads = threads
+        self.num_vars = 0
+        self.num_rows = 0
+        self.num_nonzeros = 0
+        self.binaries = []
+        self.mip_gap = None  # relative MIP gap and number of branch-and-bound nodes of the last solve
+        self.nodes = None
+        self.best_bound = None  # dual bound on the objective value of the last solve
+
+    @abstractmethod
+    def add_vars(self, lb, ub, binary=False, names=None):
+        "Add len(lb) variables and return their indices."
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_rows(self, sense, rhs, starts, index, value, names=None):
+        "Add len(rhs) constraints with CSR coefficient matrix (starts, index, value) and return their indices."
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_objective(self, cols, coefs):
+        "Set the objective coefficients of the given variables."
+        raise NotImplementedError
+
+    @abstractmethod
+    def change_bounds(self, cols, lb, ub):
+        "Set the bounds of the given variables."
+        raise NotImplementedError
+
+    @abstractmethod
+    def change_coefficients(self, rows, cols, coefs):
+        "Set the coefficients of the given (row, col) entries."
+        raise NotImplementedError
+
+    @abstractmethod
+    def change_rhs(self, rows, rhs):
+        "Set the right-hand sides of the given rows."
+        raise NotImplementedError
+
+    @abstractmethod
+    def relax(self):
+        "Make all binary variables continuous in [0, 1], i.e., turn the model into its LP relaxation."
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_start(self, cols, values):
+        "Install a MIP start. Binary variables that are not given are 0."
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_cutoff(self, value):
+        "Discard solutions with objective value above value."
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear_start(self):
+        "Remove MIP start, cutoff and solutions of previous solves."
+        raise NotImplementedError
+
+    @abstractmethod
+    def solve(self):
+        """
+            Solve the model. Sets solve_time, objective_value (if solved), mip_gap, nodes and best_bound (None if not known).
+
+        Returns
+        -------
+        boolean
+            Whether a solution was found.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def values(self):
+        "Values of all variables in the solution found by the last solve."
+        raise NotImplementedError
+
+    @abstractmethod
+    def solve_relaxation(self):
+        """
+            Solve the LP relaxation of the model, the model itself keeps its binary variables. Sets solve_time
+            and objective_value (if solved). MIP starts may be lost, the cutoff is kept.
+
+        Returns
+        -------
+        values, reduced_costs : np.ndarray
+            values and reduced costs of all variables in the LP solution, None if not solved.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def explain_infeasibility(self):
+        "Report why the last solve did not find a solution."
+        raise NotImplementedError
+
+    def _new_vars(self, n, binary):
+        idx = range(self.num_vars, self.num_vars + n)
+        if binary:
+            self.binaries.extend(idx)
+        self.num_vars += n
+        return idx
+
+    def _new_rows(self, n, nonzeros):
+        idx = range(self.num_rows, self.num_rows + n)
+        self.num_rows += n
+        self.num_nonzeros += nonzeros
+        return idx
+
+    def _start_vector(self, cols, values):
+        "Complete a MIP start with zeros for all binary variables that are not given."
+        start = dict.fromkeys(self.binaries, 0.0)
+        start.update(zip(np.asarray(cols).tolist(), np.asarray(values).tolist()))
+        return list(start.keys()), list(start.values())
+
+
+class CplexBackend(SolverBackend):
+    """
+    CPLEX through its Python matrix API.
+    """
+
+    name = "cplex"
+
+    def __init__(self, verbose=False, mipgap=0.01, threads=0):
+        import cplex
+
+        super().__init__(verbose, mipgap, threads)
+        self.cplex = cplex
+        cpx = cplex.Cplex()
+        cpx.set_problem_name("snapshot")
+        cpx.parameters.mip.tolerances.mipgap.set(mipgap)
+        if threads:
+            cpx.parameters.threads.set(threads)
+        if not verbose:
+            cpx.set_log_stream(None)
+            cpx.set_results_stream(None)
+            cpx.set_warning_stream(None)
+        self.cpx = cpx
+
+    def add_vars(self, lb, ub, binary=False, names=None):
+        n = len(lb)
+        self.cpx.variables.add(
+            lb=np.asarray(lb, dtype=float).tolist(),
+            ub=np.asarray(ub, dtype=float).tolist(),
+            types=("B" if binary else "C") * n,
+            names=names,
+        )
+        return self._new_vars(n, binary)
+
+    def add_rows(self, sense, rhs, starts, index, value, names=None):
+        n = len(rhs)
+        idx = self._new_rows(n, len(index))
+        self.cpx.linear_constraints.add(
+            senses="".join(sense),
+            rhs=np.asarray(rhs, dtype=float).tolist(),
+            names=names,
+        )
+        rows = idx.start + np.repeat(
+            np.arange(n), np.diff(np.append(starts, len(index)))
+        )
+        self.change_coefficients(rows, index, value)
+        return idx
+
+    def set_objective(self, cols, coefs):
+        self.cpx.objective.set_linear(
+            zip(np.asarray(cols).tolist(), np.asarray(coefs, dtype=float).tolist())
+        )
+
+    def change_bounds(self, cols, lb, ub):
+        cols = np.asarray(cols).tolist()
+        lb = np.broadcast_to(np.asarray(lb, dtype=float), len(cols)).tolist()
+        ub = np.broadcast_to(np.asarray(ub, dtype=float), len(cols)).tolist()
+        if cols:
+            self.cpx.variables.set_lower_bounds(list(zip(cols, lb)))
+            self.cpx.variables.set_upper_bounds(list(zip(cols, ub)))
+
+    def change_coefficients(self, rows, cols, coefs):
+        self.cpx.linear_constraints.set_coefficients(
+            list(
+                zip(
+                    np.asarray(rows).tolist(),
+                    np.asarray(cols).tolist(),
+                    np.asarray(coefs, dtype=float).tolist(),
+                )
+            )
+        )
+
+    def change_rhs(self, rows, rhs):
+        self.cpx.linear_constraints.set_rhs(
+            list(zip(np.asarray(rows).tolist(), np.asarray(rhs, dtype=float).tolist()))
+        )
+
+    def relax(self):
+        self.cpx.variables.set_types([(col, "C") for col in self.binaries])
+        self.cpx.set_problem_type(self.cpx.problem_type.LP)
+
+    def set_start(self, cols, values):
+        self.cpx.MIP_starts.add(
+            list(self._start_vector(cols, values)),
+            self.cpx.MIP_starts.effort_level.auto,
+        )
+
+    def set_cutoff(self, value):
+        self.cpx.parameters.mip.tolerances.uppercutoff.set(value)
+
+    def clear_start(self):
+        # every solve leaves its incumbent as MIP start for the next one
+        if self.cpx.get_problem_type() != self.cpx.problem_type.LP:
+            self.cpx.MIP_starts.delete()
+        self.cpx.parameters.mip.tolerances.uppercutoff.reset()
+
+    def solve(self):
+        start = self.cpx.get_time()
+        self.cpx.solve()
+        self.solve_time = self.cpx.get_time() - start
+        solved = self.cpx.solution.is_primal_feasible()
+        self.mip_gap = self.nodes = self.best_bound = None
+        if solved:
+            self.objective_value = self.cpx.solution.get_objective_value()
+            if self.cpx.get_problem_type() != self.cpx.problem_type.LP:
+                self.mip_gap = self.cpx.solution.MIP.get_mip_relative_gap()
+                self.nodes = self.cpx.solution.progress.get_num_nodes_processed()
+                self.best_bound = self.cpx.solution.MIP.get_best_objective()
+        return solved
+
+    def values(self):
+        return np.array(self.cpx.solution.get_values())
+
+    def solve_relaxation(self):
+        cpx = self.cpx
+        relaxed = cpx.get_problem_type() == cpx.problem_type.LP
+        cpx.set_problem_type(cpx.problem_type.LP)  # drops the binaries and MIP starts
+        try:
+            if not self.solve():
+                return None
+            return self.values(), np.array(cpx.solution.get_reduced_costs())
+        finally:
+            if not relaxed:
+                cpx.variables.set_types([(col, "B") for col in self.binaries])
+
+    def explain_infeasibility(self):
+        cpx = self.cpx
+        cpx.conflict.refine(cpx.conflict.linear_constraints())
+        conflict = [
+            group[1][0][1]
+            for status, group in zip(cpx.conflict.get(), cpx.conflict.get_groups())
+            if status != cpx.conflict.group_status.excluded
+        ]
+        print(f"conflict(s): {len(conflict)}")
+        for row in conflict:
+            print(f"  - {cpx.linear_constraints.get_names(row)}")
+
+
+class HighsBackend(SolverBackend):
+    """
+    HiGHS through highspy.
+
+    The model is kept as NumPy arrays (CSR constraint matrix) that are changed in place and loaded into
+    HiGHS with a single passModel call before every solve. HiGHS' own modification methods work
+    entry by entry, which is slow for the many demand coefficients that change every period.
+    """
+
+    name = "highs"
+
+    def __init__(self, verbose=False, mipgap=0.01, threads=0):
+        import highspy
+
+        super().__init__(verbose, mipgap, threads)
+        self.highspy = highspy
+        h = highspy.Highs()
+        h.setOptionValue("output_flag", bool(verbose))
+        h.setOptionValue("mip_rel_gap", mipgap)
+        if threads:
+            h.setOptionValue("threads", threads)
+        self.h = h
+        self.cost = np.zeros(0)
+        self.lb = np.zeros(0)
+        self.ub = np.zeros(0)
+        self.integrality = np.zeros(0, dtype=np.int32)
+        self.sense = np.zeros(0, dtype="<U1")
+        self.rhs = np.zeros(0)
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.index = np.zeros(0, dtype=np.int64)
+        self.value = np.zeros(0)
+        self.keys = None  # sorted row * num_vars + col of all entries
+        self.start = None
+        self.cutoff = INF
+
+    def add_vars(self, lb, ub, binary=False, names=None):
+        n = len(lb)
+        self.cost = np.append(self.cost, np.zeros(n))
+        self.lb = np.append(self.lb, lb)
+        self.ub = np.append(self.ub, ub)
+        self.integrality = np.append(self.integrality, np.full(n, int(binary)))
+        self.keys = None
+        return self._new_vars(n, binary)
+
+    def add_rows(self, sense, rhs, starts, index, value, names=None):
+        n = len(rhs)
+        self.starts = np.append(self.starts, len(self.index) + np.asarray(starts))
+        self.index = np.append(self.index, index)
+        self.value = np.append(self.value, value)
+        self.sense = np.append(self.sense, list(sense))
+        self.rhs = np.append(self.rhs, rhs)
+        self.keys = None
+        return self._new_rows(n, len(index))
+
+    def _positions(self, rows, cols):
+        "Positions of the (row, col) entries in the CSR arrays."
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        if self.keys is None:
+            ends = np.append(self.starts[1:], len(self.index))
+            row_of = np.repeat(np.arange(self.num_rows), ends - self.starts)
+            self.keys = row_of * self.num_vars + self.index
+        keys = self.keys
+        pos = np.searchsorted(keys, rows * self.num_vars + cols)
+        pos = np.minimum(pos, len(keys) - 1)
+        if (keys[pos] != rows * self.num_vars + cols).any():
+            raise ValueError("Only existing coefficients can be changed.")
+        return pos
+
+    def set_objective(self, cols, coefs):
+        self.cost[np.asarray(cols)] = coefs
+
+    def change_bounds(self, cols, lb, ub):
+        self.lb[np.asarray(cols)] = lb
+        self.ub[np.asarray(cols)] = ub
+
+    def change_coefficients(self, rows, cols, coefs):
+        self.value[self._positions(rows, cols)] = coefs
+
+    def change_rhs(self, rows, rhs):
+        self.rhs[np.asarray(rows)] = rhs
+
+    def relax(self):
+        self.integrality[:] = 0
+
+    def set_start(self, cols, values):
+        self.start = self._start_vector(cols, values)
+
+    def set_cutoff(self, value):
+        self.cutoff = value
+
+    def clear_start(self):
+        self.start = None
+        self.cutoff = INF
+
+    def solve(self):
+        h = self.h
+        time_start = time.perf_counter()
+        h.passModel(
+            self.num_vars,
+            self.num_rows,
+            len(self.index),
+            2,  # MatrixFormat.kRowwise
+            1,  # ObjSense.kMinimize
+            0,
+            self.cost,
+            self.lb,
+            self.ub,
+            np.where(self.sense == "L", -INF, self.rhs),
+            np.where(self.sense == "G", INF, self.rhs),
+            self.starts.astype(np.int32),
+            self.index.astype(np.int32),
+            self.value,
+            self.integrality.astype(np.int32),
+        )
+        if self.start is not None:
+            cols, values = self.start
+            h.setSolution(
+                len(cols),
+                np.asarray(cols, dtype=np.int32),
+                np.asarray(values, dtype=float),
+            )
+        h.setOptionValue("objective_bound", self.cutoff)
+        h.run()
+        self.solve_time = time.perf_counter() - time_start
+        info = h.getInfo()
+        solved = info.primal_solution_status == 2  # kSolutionStatusFeasible
+        self.mip_gap = self.nodes = self.best_bound = None
+        if solved:
+            self.objective_value = info.objective_function_value
+            if self.integrality.any():
+                self.mip_gap = info.mip_gap
+                self.nodes = info.mip_node_count
+                self.best_bound = info.mip_dual_bound
+        return solved
+
+    def values(self):
+        return np.array(self.h.getSolution().col_value)
+
+    def solve_relaxation(self):
+        integrality = self.integrality
+        self.integrality = np.zeros_like(integrality)
+        try:
+            if not self.solve():
+                return None
+            return self.values(), np.array(self.h.getSolution().col_dual)
+        finally:
+            self.integrality = integrality
+
+    def explain_infeasibility(self):
+        print(self.h.modelStatusToString(self.h.getModelStatus()))
+
+
+BACKENDS = {backend.name: backend for backend in (CplexBackend, HighsBackend)}
+
+
+def getBackend(name, verbose=False, mipgap=0.01, threads=0):
+    """
+        Instantiate a solver backend
+
+    Parameters
+    ----------
+    name : str
+        name of the backend, one of 'cplex' and 'highs'.
+    verbose : boolean, optional
+        Whether or not to log solver output. The default is False.
+    mipgap : float, optional
+        Relative MIP gap. The default is 0.01.
+    threads : int, optional
+        Number of solver threads, 0 lets the solver decide. The default is 0.
+
+    Returns
+    -------
+    SolverBackend
+        backend with an empty model.
+    """
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown solver backend '{name}', choose one of {sorted(BACKENDS)}."
+        )
+    return BACKENDS[name](verbose=verbose, mipgap=mipgap, threads=threads)
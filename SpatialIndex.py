@@ -0,0 +1,84 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS = 6371.0  # km
+
+
+class SpatialIndex:
+    """
+    KD-tree over the positions of laboratories (or any other points) on the earth.
+
+    Positions (latitude, longitude in degrees) are mapped to 3D unit vectors, the straight-line (chord)
+    distance between unit vectors is monotone in the great-circle distance. Nearest neighbor and radius
+    queries therefore take O(log J) instead of computing all distances. Distances are great-circle distances
+    in km times detour, e.g., as estimate of road distances.
+    """
+
+    def __init__(self, positions, detour=1.0):
+        self.detour = detour
+        self.tree = cKDTree(unitVectors(positions))
+
+    def nearest(self, positions):
+        """
+            Closest point of the index for every position
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            latitudes and longitudes with shape (n, 2).
+
+        Returns
+        -------
+        dist, idx : np.ndarray
+            distance to and index of the closest point.
+        """
+        chord, idx = self.tree.query(unitVectors(positions))
+        return self.distance(chord), idx
+
+    def within(self, positions, radius):
+        """
+            All pairs of a position and a point of the index within distance radius
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            latitudes and longitudes with shape (n, 2).
+        radius : float
+            maximum distance in km.
+
+        Returns
+        -------
+        scipy.sparse.coo_matrix
+            distances with shape (n, number of points), only pairs within radius are stored (explicitly,
+            also distance 0).
+        """
+        max_chord = 2 * np.sin(min(radius / self.detour / EARTH_RADIUS, np.pi) / 2)
+        pairs = cKDTree(unitVectors(positions)).sparse_distance_matrix(
+            self.tree, max_chord, output_type="ndarray"
+        )
+        return coo_matrix(
+            (self.distance(pairs["v"]), (pairs["i"], pairs["j"])),
+            shape=(len(positions), self.tree.n),
+        )
+
+    def distance(self, chord):
+        "Distance in km of unit vectors with straight-line distance chord."
+        return self.detour * 2 * EARTH_RADIUS * np.arcsin(np.minimum(chord, 2) / 2)
+
+
+def unitVectors(positions):
+    "3D unit vectors of latitudes and longitudes (degrees) with shape (n, 2)."
+    lat, lon = np.radians(np.asarray(positions, dtype=float)).T
+    return np.column_stack(
+        (np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat))
+    )
@@ -0,0 +1,596 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import os
+import argparse
+import copy
+import json
+import platform
+import sys
+import time
+import pandas as pd
+import numpy as np
+import numpy.random as npr
+from concurrent.futures import ProcessPoolExecutor
+
+import OnlineProcedure
+from Instance import Instance
+from Instrumentation import Instrumentation
+from instance_generator import CDPInstance
+
+# regions and horizons of the instance ladder, all generated from data_raw
+regions = {
+    "state": ["Hessen"],
+    "states": ["Hessen", "Rheinland-Pfalz", "Saarland", "Baden-Württemberg"],
+    "nationwide": "nationwide",
+}
+horizons = [7, 28, 280]
+start_date = "2020-03-09"
+# tau_max and formulations of the scaling benchmark, see runTauScaling
+tau_values = [1, 2, 3, 5, 7]
+formulations = ["slots", "compact"]
+
+# fixed parameters of runOnlineProcedure, crit methods that need no files besides data_raw
+params = {
+    "tau_max": 2,
+    "C": 150,
+    "Mc": 150,
+    "theta": 0.001,
+    "eta": 1,
+    "crit_I_meth": "workload",
+    "crit_J_meth": "workload",
+}
+
+# metrics compared against the baseline, larger values are worse
+timings = ["generate_time", "load_time", "build_time", "solve_time", "runtime"]
+metrics = timings + ["peak_rss_mb"]
+
+
+def ladder(region_names=None, days=None):
+    "Names, states and horizons of the benchmark instances, smallest first."
+    region_names = list(regions) if region_names is None else region_names
+    days = horizons if days is None else days
+    return [
+        (f"bench_{region}_{n}d", regions[region], n)
+        for region in region_names
+        for n in days
+    ]
+
+
+def runBenchmark(
+    name,
+    state,
+    days,
+    data_path,
+    periods,
+    backend,
+    threads,
+    tau_max=params["tau_max"],
+    formulation="slots",
+    warm_start=True,
+    reference=False,
+):
+    """
+        Generate one instance of the ladder and run the procedure on it. Runs in a fresh process, such that
+        peak_rss_mb is the memory of this instance only. data_raw does not contain the weekly incidences,
+        they are derived from the tests and positive rates, see RawData.readIncidences.
+
+    Parameters
+    ----------
+    name : str
+        name of the instance.
+    state : str or list
+        state(s) of the instance, see CDPInstance.
+    days : int
+        number of periods of the instance.
+    data_path : str
+        directory the instance is written to.
+    periods : int
+        number of periods the procedure runs, None for all.
+    backend : str
+        Solver backend, 'cplex' or 'highs'.
+    threads : int
+        Number of solver threads.
+    tau_max : int, optional
+        Target processing time in days. The default is params["tau_max"].
+    formulation : str, optional
+        Formulation of the snapshot model, 'slots' or 'compact'. The default is 'slots'.
+    warm_start : boolean, optional
+        Warm start every snapshot, see OnlineProcedure.runOnlineProcedure. The default is True.
+    reference : boolean, optional
+        Solve every period also with the model of formulation 'slots' built for the period, on the same
+        state (objective values in period_ref_obj). The default is False.
+
+    Returns
+    -------
+    dict
+        size of the instance, times in seconds, peak memory in MB, objective value and, per period, solve
+        time, objective value, objective value of the MIP start and lower bound.
+    """
+    end_date = str((pd.Timestamp(start_date) + pd.Timedelta(days=days - 1)).date())
+    start = time.perf_counter()
+    CDPInstance.set_data_path(data_path)
+    npr.seed(0)  # ties of the default assignment are broken randomly
+    inst = CDPInstance(
+        name=name,
+        tau_max=tau_max,
+        state=state,
+        start_date=start_date,
+        end_date=end_date,
+        derive_incidences=True,
+    )
+    inst.write_to_disk()
+    generate_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = Instance.load(data_path + name)
+    load_time = time.perf_counter() - start
+    if periods is not None:
+        data["pandemic_duration"] = min(periods, data["pandemic_duration"])
+
+    stats = Instrumentation()
+    ref_obj = []
+    solve = OnlineProcedure.solveSnapshot
+    if reference:
+        OnlineProcedure.solveSnapshot = solveWithReference(solve, backend, ref_obj)
+    start = time.perf_counter()
+    try:
+        solution = OnlineProcedure.runOnlineProcedure(
+            data,
+            verbose=False,
+            backend=backend,
+            threads=threads,
+            **{**params, "tau_max": tau_max},
+            formulation=formulation,
+            warm_start=warm_start,
+            stats=stats,
+        )
+    except SystemExit:  # runOnlineProcedure exits on an infeasible snapshot problem
+        status, obj, per_period = "infeasible", None, dict()
+    else:
+        status, obj = "solved", sum(solution.sol["obj"])
+        per_period = {
+            "period_obj": solution.sol["obj"],
+            "period_start_obj": solution.sol["warm_start"],
+            "period_bound": solution.sol["bound"],
+        }
+        if reference:
+            per_period["period_ref_obj"] = ref_obj
+    finally:
+        OnlineProcedure.solveSnapshot = solve
+    runtime = time.perf_counter() - start
+
+    frame = stats.to_frame()
+    return {
+        "I": len(data.tc_names),
+        "J": len(data.lab_names),
+        "days": days,
+        "tau_max": tau_max,
+        "formulation": formulation,
+        "warm_start": warm_start,
+        "periods": data["pandemic_duration"],
+        "status": status,
+        "vars": int(frame["vars"].max()) if len(frame) else None,
+        "rows": int(frame["rows"].max()) if len(frame) else None,
+        "generate_time": generate_time,
+        "load_time": load_time,
+        "build_time": stats.build.get("build_wall", 0),
+        "solve_time": float(frame["solve_wall"].sum()) if len(frame) else 0,
+        "runtime": runtime,
+        "peak_rss_mb": float(frame["peak_rss_mb"].max()) if len(frame) else None,
+        "obj": obj,
+        "period_solve_time": (
+            frame["solve_wall"].tolist() if "solve_wall" in frame else []
+        ),
+        **per_period,
+    }
+
+
+def runSuite(
+    out_file,
+    region_names=None,
+    days=None,
+    data_path="benchmark/",
+    periods=7,
+    backend="cplex",
+    threads=1,
+    repeat=1,
+):
+    """
+        Run the benchmark ladder and write the results to out_file (JSON).
+
+    Parameters
+    ----------
+    out_file : str
+        result file, e.g., the baseline.
+    region_names : list, optional
+        keys of regions. The default is None, i.e., all.
+    days : list, optional
+        horizons of the instances. The default is None, i.e., horizons.
+    data_path : str, optional
+        directory of the generated instances. The default is "benchmark/".
+    periods : int, optional
+        number of periods the procedure runs per instance, None for all. The default is 7.
+    backend : str, optional
+        Solver backend, 'cplex' or 'highs'. The default is 'cplex'.
+    threads : int, optional
+        Number of solver threads. The default is 1.
+    repeat : int, optional
+        Number of runs per instance, the minimum of every metric is kept. The default is 1.
+
+    Returns
+    -------
+    dict
+        environment, parameters and results per instance as written to out_file.
+    """
+    os.makedirs(data_path, exist_ok=True)
+    results = dict()
+    for name, state, n in ladder(region_names, days):
+        results[name] = runRepeated(
+            repeat, name, state, n, data_path, periods, backend, threads
+        )
+    return writeSuite(
+        out_file,
+        results,
+        backend,
+        threads,
+        {**params, "periods": periods, "repeat": repeat},
+    )
+
+
+def runTauScaling(
+    out_file,
+    region="state",
+    days=28,
+    tau_max=None,
+    formulation=None,
+    data_path="benchmark/",
+    periods=7,
+    backend="cplex",
+    threads=1,
+    repeat=1,
+):
+    """
+        Run the procedure on one instance of the ladder for increasing tau_max and every formulation of the
+        snapshot model (see DTSA_snap.formulations) and write the results to out_file (JSON), e.g., to
+        see how model size and solve time scale with tau_max. The objective values of every formulation are
+        compared with the ones of 'slots' on the same state of every period (obj_gap and period_obj_gap,
+        relative to at least one test, see runBenchmark).
+
+    Parameters
+    ----------
+    out_file : str
+        result file.
+    region : str, optional
+        key of regions. The default is "state".
+    days : int, optional
+        horizon of the instance. The default is 28.
+    tau_max : list, optional
+        values of tau_max. The default is None, i.e., tau_values.
+    formulation : list, optional
+        formulations. The default is None, i.e., formulations.
+    data_path, periods, backend, threads, repeat
+        see runSuite.
+
+    Returns
+    -------
+    dict
+        environment, parameters and results per tau_max and formulation as written to out_file.
+    """
+    os.makedirs(data_path, exist_ok=True)
+    results = dict()
+    for tau in tau_values if tau_max is None else tau_max:
+        # the capacities of an instance are padded for tau_max + 1 periods
+        name = f"bench_{region}_{days}d_tau{tau}"
+        for form in formulations if formulation is None else formulation:
+            results[f"{name}_{form}"] = runRepeated(
+                repeat,
+                name,
+                regions[region],
+                days,
+                data_path,
+                periods,
+                backend,
+                threads,
+                tau,
+                form,
+                True,
+                form != "slots",
+            )
+            result = results[f"{name}_{form}"]
+            ref_obj = result.get("period_ref_obj", [])
+            if result["obj"] is None or not ref_obj or None in ref_obj:
+                continue
+            result["obj_gap"] = objectiveGap(result["obj"], sum(ref_obj))
+            result["period_obj_gap"] = [
+                objectiveGap(obj, ref)
+                for obj, ref in zip(result["period_obj"], ref_obj)
+            ]
+            print(
+                f"{name} ({form}): objective gap {result['obj_gap']:.2%} against slots, "
+                f"at most {max(map(abs, result['period_obj_gap'])):.2%} per period"
+            )
+    return writeSuite(
+        out_file,
+        results,
+        backend,
+        threads,
+        {**params, "tau_max": None, "periods": periods, "repeat": repeat},
+    )
+
+
+def solveWithReference(solve, backend, ref_obj):
+    """
+    solveSnapshot that also solves the model of formulation 'slots' built for the period, on the same
+    state, and appends its objective value to ref_obj (None if not solved).
+    """
+
+    def solveBoth(data, sol, t, crit_I_fct, crit_J_fct, **kwargs):
+        fresh = copy.deepcopy(sol)  # the period must not be added to sol twice
+        y, L = solve(
+            data, fresh, t, crit_I_fct, crit_J_fct, verbose=False, backend=backend
+        )
+        ref_obj.append(fresh.sol["obj"][-1] if y is not None else None)
+        return solve(data, sol, t, crit_I_fct, crit_J_fct, **kwargs)
+
+    return solveBoth
+
+
+def objectiveGap(obj, ref):
+    "Relative difference of two objective values, relative to at least one test."
+    return (obj - ref) / max(abs(ref), 1)
+
+
+def runWarmStart(
+    out_file,
+    region="state",
+    days=28,
+    data_path="benchmark/",
+    periods=7,
+    backend="cplex",
+    threads=1,
+    repeat=1,
+):
+    """
+        Run the procedure on one instance of the ladder with and without warm start (see
+        DTSA_snap.SnapshotModel.set_start) and write the results to out_file (JSON), including the solve time,
+        objective value and objective value of the MIP start of every period.
+
+    Parameters
+    ----------
+    out_file : str
+        result file.
+    region : str, optional
+        key of regions. The default is "state".
+    days : int, optional
+        horizon of the instance. The default is 28.
+    data_path, periods, backend, threads, repeat
+        see runSuite.
+
+    Returns
+    -------
+    dict
+        environment, parameters and results with and without warm start as written to out_file.
+    """
+    os.makedirs(data_path, exist_ok=True)
+    name = f"bench_{region}_{days}d"
+    results = dict()
+    for warm_start in [True, False]:
+        results[f"{name}_{'warm' if warm_start else 'cold'}"] = runRepeated(
+            repeat,
+            name,
+            regions[region],
+            days,
+            data_path,
+            periods,
+            backend,
+            threads,
+            params["tau_max"],
+            "slots",
+            warm_start,
+        )
+    for t, (warm, cold) in enumerate(
+        zip(*(result["period_solve_time"] for result in results.values()))
+    ):
+        print(f"period {t}: solve {warm:.3f}s with, {cold:.3f}s without warm start")
+    return writeSuite(
+        out_file,
+        results,
+        backend,
+        threads,
+        {**params, "periods": periods, "repeat": repeat},
+    )
+
+
+def runRepeated(repeat, name, *args):
+    "Minimum of every metric over repeat runs of runBenchmark(name, *args), one process per run."
+    runs = []
+    for r in range(repeat):
+        # one process per run, the peak memory of earlier runs does not count
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            runs.append(pool.submit(runBenchmark, name, *args).result())
+    result = runs[0]
+    for metric in metrics:
+        values = [run[metric] for run in runs if run[metric] is not None]
+        result[metric] = min(values) if values else None
+    if runs[0]["period_solve_time"]:
+        result["period_solve_time"] = np.min(
+            [run["period_solve_time"] for run in runs], axis=0
+        ).tolist()
+    print(
+        f"{name} ({result['formulation']}, tau_max {result['tau_max']}): "
+        f"{result['I']} x {result['J']}, {result['periods']} periods, "
+        f"{result['vars']} vars, {result['rows']} rows, "
+        f"build {result['build_time']:.2f}s, solve {result['solve_time']:.2f}s, "
+        f"{result['peak_rss_mb']} MB, obj {result['obj']}"
+    )
+    return result
+
+
+def writeSuite(out_file, results, backend, threads, suite_params):
+    suite = {
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "backend": backend,
+            "threads": threads,
+        },
+        "params": suite_params,
+        "results": results,
+    }
+    with open(out_file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(suite, f, indent=4)
+    os.replace(out_file + ".tmp", out_file)
+    return suite
+
+
+def compare(baseline, current, threshold=0.2, min_time=0.05):
+    """
+        Compare two result files of runSuite
+
+    Parameters
+    ----------
+    baseline : dict
+        results of the baseline.
+    current : dict
+        results to be checked.
+    threshold : float, optional
+        relative increase of a metric that counts as regression. The default is 0.2.
+    min_time : float, optional
+        timings below min_time seconds in both runs are not compared (noise). The default is 0.05.
+
+    Returns
+    -------
+    list
+        messages on regressions and changed objective values, empty if there are none.
+    """
+    if baseline["params"] != current["params"]:
+        print(
+            f"Warning: parameters differ, baseline {baseline['params']}, current {current['params']}"
+        )
+    findings = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]
+        for metric in metrics:
+            old, new = base.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            if metric in timings and max(old, new) < min_time:
+                continue
+            if new > old * (1 + threshold):
+                findings.append(
+                    f"{name}: {metric} {old:.3f} -> {new:.3f} (+{new / old - 1:.0%})"
+                    if old > 0
+                    else f"{name}: {metric} {old:.3f} -> {new:.3f}"
+                )
+        old, new = base.get("obj"), result.get("obj")
+        if (old is None) != (new is None) or (
+            old is not None and abs(new - old) > 1e-6 * max(abs(old), 1)
+        ):
+            findings.append(
+                f"{name}: objective changed {base.get('obj')} -> {result.get('obj')}"
+            )
+    return findings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the procedure on a ladder of instances generated from data_raw"
+    )
+    parser.add_argument(
+        "--out", default="benchmark/results.json", help="result file of the run"
+    )
+    parser.add_argument(
+        "--baseline",
+        help="result file of an earlier run, regressions of this run are reported (exit code 1)",
+    )
+    parser.add_argument(
+        "--compare-only",
+        action="store_true",
+        help="compare --out with --baseline without running",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative increase that counts as regression",
+    )
+    parser.add_argument("--regions", nargs="+", choices=list(regions))
+    parser.add_argument("--days", nargs="+", type=int)
+    parser.add_argument(
+        "--periods",
+        type=int,
+        default=7,
+        help="periods of the procedure per instance, 0 for all",
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--tau-scaling",
+        action="store_true",
+        help="run the first of --regions and --days for every --tau_max and --formulations instead of the ladder",
+    )
+    parser.add_argument(
+        "--warm-start",
+        action="store_true",
+        help="run the first of --regions and --days with and without warm start instead of the ladder",
+    )
+    parser.add_argument("--tau_max", nargs="+", type=int, default=tau_values)
+    parser.add_argument(
+        "--formulations", nargs="+", choices=formulations, default=formulations
+    )
+    parser.add_argument("--backend", default="cplex", choices=["cplex", "highs"])
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.compare_only:
+        with open(args.out, encoding="utf-8") as f:
+            suite = json.load(f)
+    elif args.warm_start:
+        suite = runWarmStart(
+            args.out,
+            region=args.regions[0] if args.regions else "state",
+            days=args.days[0] if args.days else 28,
+            periods=args.periods or None,
+            backend=args.backend,
+            threads=args.threads,
+            repeat=args.repeat,
+        )
+    elif args.tau_scaling:
+        suite = runTauScaling(
+            args.out,
+            region=args.regions[0] if args.regions else "state",
+            days=args.days[0] if args.days else 28,
+            tau_max=args.tau_max,
+            formulation=args.formulations,
+            periods=args.periods or None,
+            backend=args.backend,
+            threads=args.threads,
+            repeat=args.repeat,
+        )
+    else:
+        suite = runSuite(
+            args.out,
+            region_names=args.regions,
+            days=args.days,
+            periods=args.periods or None,
+            backend=args.backend,
+            threads=args.threads,
+            repeat=args.repeat,
+        )
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        findings = compare(baseline, suite, threshold=args.threshold)
+        for finding in findings:
+            print(finding)
+        print(f"{len(findings)} regressions compared to {args.baseline}.")
+        sys.exit(1 if findings else 0)
@@ -12,8 +12,13 @@ import argparse
 import json
 import datetime
 import pandas as pd
+import numpy as np
 import numpy.random as npr
 
+from Instance import Instance
+import RawData
+from RawData import readRaw, readIncidences
+
 Bundeslaender = [ 
     "Baden-Württemberg",
     "Bayern",
@@ -50,13 +55,14 @@ class CDPInstance:
         district_data="district_data",
         laboratory_data="laboratory_data",
         test_per_district_vs_time_file="tests_per_district_vs_time_DF",  # path names to set if data is to be read from file
-        state="nationwide",
+        state="nationwide",  # a state, a list of states or "nationwide"
         start_date="2020-03-09",
         end_date="2020-12-13",  # data to be specified if only part of the data should be used for an instance
+        derive_incidences=False,  # derive the incidences if their file is missing, see RawData.readIncidences
     ):
 
         try:
-            os.mkdir(data_path + name)
+            os.mkdir(self.data_path + name)
         except OSError:
             print("Creation of the directory %s failed" % name)
         else:
@@ -67,27 +73,31 @@ class CDPInstance:
         self.data["properties"]["name"] = name
         self.data["properties"]["state"] = state
         self.data["tau_max"]=tau_max
-        # Read data from input files
-        with open("data_raw/" + laboratory_data + ".json", encoding="cp1252") as f:
-            laboratories = json.load(f)
-
-        with open("data_raw/" + district_data + ".json", encoding="utf-8") as f:
-            districts = json.load(f)
-
-        with open("data_raw/" + test_per_district_vs_time_file + ".json") as f:
-            tests = pd.read_json(f)
-
-        capacities = pd.read_excel(
-            "data_raw/laboratory_capacity_over_time.xlsx", engine="openpyxl"
+        self.test_per_district_vs_time_file = test_per_district_vs_time_file
+        # Read data from input files, parsed once per process and version of the files, see RawData.readRaw
+        laboratories = readRaw(
+            "data_raw/" + laboratory_data + ".json", "json", encoding="cp1252"
+        )
+        districts = readRaw("data_raw/" + district_data + ".json", "json")
+        tests = readRaw(
+            "data_raw/" + test_per_district_vs_time_file + ".json", "dataframe"
+        )
+        capacities = readRaw(
+            "data_raw/laboratory_capacity_over_time.xlsx", "excel", index="Datum"
         )
-        capacities.set_index("Datum", inplace=True)
 
-        incidences_file = "weekly_incidences_per_district_vs_time_DF"
-        with open("data_raw/" + incidences_file + ".json", encoding="utf-8") as f:
-            incidences = pd.read_json(f)
+        incidences = readIncidences(
+            test_file="data_raw/" + test_per_district_vs_time_file + ".json",
+            derive=derive_incidences,
+        )
+        # "derived" if the incidences are derived from tests and positive rates, kept by append_days
+        self.data["properties"]["incidences"] = (
+            "reported" if os.path.exists(RawData.incidence_file) else "derived"
+        )
 
         if state != "nationwide":  # filter according to states
             self.data["properties"]["state"] = state
+            states = [state] if isinstance(state, str) else list(state)
             remove = []
             for (
                 dist,
@@ -95,7 +105,7 @@ class CDPInstance:
             ) in (
                 districts.items()
             ):  # identify which districts are not in state and remove
-                if state != dist_info["Bundesland"]:
+                if dist_info["Bundesland"] not in states:
                     remove.append(dist)
             for dist in remove:
                 districts.pop(dist)
@@ -108,7 +118,7 @@ class CDPInstance:
             ) in (
                 laboratories.items()
             ):  # identify which laboratories are not in state and remove
-                if state != lab_info["Bundesland"]:
+                if lab_info["Bundesland"] not in states:
                     remove.append(lab)
             for lab in remove:
                 laboratories.pop(lab)
@@ -180,35 +190,57 @@ class CDPInstance:
         """
         Scale capacity to be proportional to the assigned demands
         """
-        s = 0
-        for lab, lab_info in self.data["laboratories"].items():
-            lab_info["num_def"] = 1
-            for TC, TC_info in self.data["test_centers"].items():
-                lab_info["num_def"] += TC_info["default_i"][lab]
-            s += lab_info["num_def"]
-
-        for t in range(self.data["pandemic_duration"]):
-            tot_cap = sum(
-                [
-                    lab_info["Cap_t"][t]
-                    for lab, lab_info in self.data["laboratories"].items()
-                ]
-            )
-            unit_cap = tot_cap / s
-            for lab, lab_info in self.data["laboratories"].items():
-                lab_info["Cap_t"][t] = int(unit_cap * lab_info["num_def"])
-        for lab, lab_info in self.data["laboratories"].items():
-            for t in range(
-                self.data["pandemic_duration"],
-                self.data["pandemic_duration"] + self.data["tau_max"] + 1,
-            ):
-                lab_info["Cap_t"][t] = lab_info["Cap_t"][
-                    self.data["pandemic_duration"] - 1
-                ]
-            lab_info["Cap_bar"] = [
-                self.data["laboratories"][lab]["Cap_t"][tau]
-                for tau in range(self.data["tau_max"])
+        labs = self.data["laboratories"]
+        T = self.data["pandemic_duration"]
+        tau_max = self.data["tau_max"]
+        # J x (T + tau_max + 1) capacity matrix
+        Cap = np.array([lab_info["Cap_t"] for lab_info in labs.values()])
+        default = np.array(
+            [
+                [TC_info["default_i"][lab] for lab in labs]
+                for TC_info in self.data["test_centers"].values()
             ]
+        )
+        num_def = 1 + default.sum(axis=0)
+
+        unit_cap = Cap[:, :T].sum(axis=0) / num_def.sum()
+        Cap[:, :T] = (unit_cap[None, :] * num_def[:, None]).astype(int)
+        Cap[:, T : T + tau_max + 1] = Cap[:, T - 1 : T]
+        for n, lab_info in enumerate(labs.values()):
+            lab_info["num_def"] = int(num_def[n])
+            lab_info["Cap_t"] = Cap[n].tolist()
+            lab_info["Cap_bar"] = lab_info["Cap_t"][:tau_max]
+
+    def append_days(self, end_date):
+        """
+            Extend the instance until end_date without regenerating it. Only the new days are read from the
+            raw data, the default assignment (and thus the scaling of the capacities) is kept, see appendDays.
+
+        Parameters
+        ----------
+        end_date : str
+            new last day of the instance, e.g., "2020-04-12".
+        """
+        tcs, labs = self.data["test_centers"], self.data["laboratories"]
+        T = self.data["pandemic_duration"]
+        tau_max = self.data["tau_max"]
+        d, inc, Cap = readDays(
+            list(tcs),
+            [lab_info["num_def"] for lab_info in labs.values()],
+            nextDay(self.data["properties"]["end_date"]),
+            end_date,
+            self.test_per_district_vs_time_file,
+            self.data["properties"]["incidences"] == "derived",
+        )
+        for n, TC_info in enumerate(tcs.values()):
+            TC_info["d_i"] += d[n].tolist()
+            TC_info["incidence_i"] += inc[n].tolist()
+        for n, lab_info in enumerate(labs.values()):
+            new = Cap[n].tolist()
+            lab_info["Cap_t"][T:] = new + new[-1:] * (tau_max + 1)
+        self.data["pandemic_duration"] = T + d.shape[1]
+        self.T = self.data["pandemic_duration"]
+        self.data["properties"]["end_date"] = end_date
 
     def __repr__(self):
         return json.dumps(self.data, indent=4, separators=(",", ":"))
@@ -224,25 +256,35 @@ class CDPInstance:
     def create_default_assignment(self):
         if self.verbose:
             print("Generating default assignment based on closest laboratory")
-        for i in self.data["test_centers"].keys():
-            self.data["test_centers"][i]["default_i"] = dict()
-            for j in self.data["laboratories"]:
-                self.data["test_centers"][i]["default_i"][str(j)] = 0
-            min_dist = min(self.data["test_centers"][i]["c_i"].values())
-            labs = self.getKeysByValue(self.data["test_centers"][i]["c_i"], min_dist)
-            random = npr.randint(0, len(labs))
-            j = labs[random]
-            self.data["test_centers"][i]["default_i"][j] = 1
-
-    def write_to_disk(self, file_name=None):
+        labs = list(self.data["laboratories"])
+        tcs = self.data["test_centers"]
+        # road distances of district_data.json, not SpatialIndex: the districts and laboratories have positions,
+        # but the closest laboratory by great-circle distance differs in 52 of 412 districts (up to 29 km)
+        c = np.array([[tcs[i]["c_i"][j] for j in labs] for i in tcs]).astype(int)
+        # laboratories at most 1 further than the closest one are ties, see getKeysByValue
+        ties = c <= c.min(axis=1, keepdims=True) + 1
+        for n, i in enumerate(tcs):
+            tcs[i]["default_i"] = dict.fromkeys(labs, 0)
+            candidates = np.flatnonzero(ties[n])
+            random = npr.randint(0, len(candidates))
+            tcs[i]["default_i"][labs[candidates[random]]] = 1
+
+    def write_to_disk(self, file_name=None, file_format="npy"):
+        # file_format "npy": instance_meta.json + instance_<array>.npy in the instance directory (memory-mappable)
+        # file_format "json": single instance.json
         if file_name is None:
-            file_name = data_path + self.data["properties"]["name"] + "/instance.json"
+            file_name = self.data_path + self.data["properties"]["name"]
+            if file_format == "json":
+                file_name += "/instance.json"
 
         try:
-            with open(file_name, "w") as f:
-                json.dump(
-                    self.data, f, indent=4, separators=(",", ":"), ensure_ascii=False
-                )
+            if file_format == "npy":
+                Instance.from_dict(self.data).save(file_name)
+            else:
+                with open(file_name, "w") as f:
+                    json.dump(
+                        self.data, f, indent=4, separators=(",", ":"), ensure_ascii=False
+                    )
         except Exception as e:
             print("Error: " + str(e))
 
@@ -256,13 +298,130 @@ class CDPInstance:
         return listOfKeys
 
 
+def nextDay(date):
+    return str((pd.Timestamp(date) + pd.Timedelta(days=1)).date())
+
+
+def readDays(
+    tc_names,
+    num_def,
+    start_date,
+    end_date,
+    test_per_district_vs_time_file="tests_per_district_vs_time_DF",
+    derive_incidences=False,
+):
+    """
+        Tests, incidences and capacities of the days start_date to end_date, scaled as in
+        CDPInstance.resize_capacity. The capacity of a day only depends on the number of default test centers
+        per laboratory, so appended days get the same capacities as in a regenerated instance.
+
+    Parameters
+    ----------
+    tc_names : list
+        districts (test centers) of the instance.
+    num_def : list
+        num_def per laboratory of the instance.
+    start_date, end_date : str
+        first and last day.
+    derive_incidences : boolean, optional
+        Derive the incidences if their file is missing, see RawData.readIncidences. The default is False.
+
+    Returns
+    -------
+    d, inc : np.ndarray
+        number of tests and weekly incidences with shape (I, days).
+    Cap : np.ndarray
+        capacities with shape (J, days).
+    """
+    tests = readRaw(
+        "data_raw/" + test_per_district_vs_time_file + ".json", "dataframe"
+    )
+    incidences = readIncidences(
+        test_file="data_raw/" + test_per_district_vs_time_file + ".json",
+        derive=derive_incidences,
+    )
+    capacities = readRaw(
+        "data_raw/laboratory_capacity_over_time.xlsx", "excel", index="Datum"
+    )
+    days = pd.date_range(start_date, end_date)
+    tests = tests.loc[tests.index.isin(days), tc_names]
+    if len(tests.index) == 0:
+        raise ValueError(f"No tests from {start_date} to {end_date} in the raw data.")
+    incidences = incidences.loc[incidences.index.isin(tests.index), tc_names]
+    capacities = capacities.loc[capacities.index.isin(tests.index), "Kapazitaet"]
+    if min(len(incidences.index), len(capacities)) < len(tests.index):
+        raise ValueError(
+            f"Incidences or capacities missing from {start_date} to {end_date}."
+        )
+
+    num_def = np.array(num_def)
+    # every laboratory has the capacity of the raw data before scaling
+    unit_cap = len(num_def) * capacities.to_numpy() / num_def.sum()
+    Cap = (unit_cap[None, :] * num_def[:, None]).astype(int)
+    return tests.to_numpy().T, incidences.to_numpy().T, Cap
+
+
+def appendDays(
+    data, end_date, test_per_district_vs_time_file="tests_per_district_vs_time_DF"
+):
+    """
+        Extend a stored instance (Instance, e.g., Instance.load) until end_date, see CDPInstance.append_days.
+        Runs in time proportional to the number of new days, the default assignment is kept.
+
+    Parameters
+    ----------
+    data : Instance
+        Problem instance generated by CDPInstance.
+    end_date : str
+        new last day of the instance.
+    """
+    # incidences derived as when the instance was generated, see CDPInstance
+    d, inc, Cap = readDays(
+        data.tc_names,
+        [meta["num_def"] for meta in data.lab_meta],
+        nextDay(data.properties["end_date"]),
+        end_date,
+        test_per_district_vs_time_file,
+        data.properties.get("incidences") == "derived",
+    )
+    data.append_periods(d, inc, Cap)
+    data.properties["end_date"] = end_date
+
+
 if __name__ == "__main__":
     data_path = "data/"
     parser = argparse.ArgumentParser(description="Generate CDP instances")
     parser.add_argument(
         "-N", nargs="?", type=int, default=1, help="number of instances to be generated"
     )
+    parser.add_argument(
+        "--format", choices=["npy", "json"], default="npy", help="on-disk format of the instances"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not store parsed raw data in " + RawData.cache_path,
+    )
+    parser.add_argument(
+        "--extend",
+        help="append the days until --end_date to the instance data/<EXTEND>",
+    )
+    parser.add_argument("--end_date", help="new last day of the instance to extend")
     args = parser.parse_args()
+    if args.no_cache:
+        RawData.cache_path = None
+
+    if args.extend is not None:
+        # not memory-mapped, the instance files are overwritten
+        path = data_path + args.extend
+        data = Instance.load(path, mmap=False)
+        appendDays(data, args.end_date)
+        if os.path.exists(os.path.join(path, Instance.meta_file)):
+            data.save(path)
+        else:
+            data.write_json(os.path.join(path, Instance.json_file))
+        print(f"Extended {args.extend} until {args.end_date}.")
+        raise SystemExit
 
     CDPInstance.set_verbose(True)  # for debugging
     CDPInstance.set_data_path(data_path)
@@ -272,11 +431,11 @@ if __name__ == "__main__":
         end_date="2020-04-05",
         tau_max=2,
     )
-    inst.write_to_disk()
+    inst.write_to_disk(file_format=args.format)
     inst = CDPInstance(
         name="Phase2Nov",
         start_date="2020-11-02",
         end_date="2020-11-29",
         tau_max=2,
     )
-    inst.write_to_disk()
+    inst.write_to_disk(file_format=args.format)
@@ -7,15 +7,29 @@ Created on Thu Nov 26 08:02:33 2020
 @author: Stefan Nickel (stefan.nickel@kit.edu)
 """
 
-import json
+import argparse
+
 import OnlineProcedure
+from Instance import Instance
+from Solution import SolutionStream
 
 # Press the green button in the gutter to run the script.
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the procedure on an instance")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue after the last period in sol.jsonl, which must stem from the same parameters",
+    )
+    args = parser.parse_args()
     instance = "Phase1Mär"
 
-    with open("data/" + instance + "/instance.json") as f:
-        data = json.load(f)
+    # binary instance format if available, else instance.json
+    data = Instance.load("data/" + instance)
+    # every period is appended to sol.jsonl, with --resume a restarted run continues after its last period
+    solution = SolutionStream(
+        data, "data/" + instance + "/sol.jsonl", resume=args.resume
+    )
     solution = OnlineProcedure.runOnlineProcedure(
         data,
         verbose=False,
@@ -26,8 +40,5 @@ if __name__ == "__main__":
         eta=1,
         crit_I_meth="R7_values",
         crit_J_meth="workload",
+        solution=solution,
     )
-
-    data["solution"] = solution.sol
-    with open("data/" + instance + "/sol.json", "w") as file:
-        json.dump(data, file, indent=4, separators=(",", ":"))
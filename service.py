@@ -0,0 +1,396 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import os
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import pandas as pd
+from contextlib import nullcontext
+
+from DTSA_snap import solveSnapshot
+from Instance import Instance
+from OnlineProcedure import (
+    setParameters,
+    buildSnapshot,
+    replaySolution,
+    updateSnapshotInputParameters,
+    gen_crit_J_fct,
+    crit_I_values,
+    crit_from_R,
+)
+from Solution import SolutionStream
+
+
+class AssignmentService:
+    """
+    The rolling horizon procedure as resident service.
+
+    The instance, the snapshot model and the state of the procedure stay in memory. On start, the periods of
+    the instance that the solution does not hold yet are solved. Every update appends one period (tests,
+    incidences, capacities and R values of a new day) to the instance and solves it, see update. Updates are
+    appended to the JSON Lines file log, such that a restarted service extends the instance in the same way and
+    continues after the last period of the solution (e.g., a SolutionStream with resume=True).
+    """
+
+    R_labels = {"R_values": "R", "R7_values": "R7"}
+
+    def __init__(
+        self,
+        data,
+        solution,
+        log=None,
+        verbose=False,
+        tau_max=2,
+        C=150,
+        Mc=150,
+        theta=0.001,
+        eta=1.0,
+        crit_I_meth="all-zeroes",
+        crit_J_meth="all-zeroes",
+        warm_start=True,
+        backend="cplex",
+        threads=0,
+        heuristic=False,
+        decompose=False,
+        processes=None,
+        stats=None,
+    ):
+        self.data = data
+        self.solution = solution
+        self.log = log
+        self.verbose = verbose
+        self.crit_I_meth = crit_I_meth
+        self.warm_start = warm_start
+        self.stats = stats
+        self.latency = []  # seconds per update
+
+        setParameters(data, tau_max, C, Mc, theta, eta)
+        print(f"Using crit_I() method '{crit_I_meth}'.")
+        self.crit_I = list(crit_I_values(crit_I_meth, data).T)  # one array per period
+        if log is not None and os.path.exists(log):
+            with open(log, encoding="utf-8") as f:
+                for line in f:
+                    self.append(json.loads(line))
+        self.crit_J_fct = gen_crit_J_fct(crit_J_meth, data)
+        self.snapshot = buildSnapshot(
+            data,
+            verbose=verbose,
+            backend=backend,
+            threads=threads,
+            heuristic=heuristic,
+            decompose=decompose,
+            processes=processes,
+            stats=stats,
+        )
+        if len(solution.sol["obj"]) > data["pandemic_duration"]:
+            raise ValueError("The solution holds more periods than the instance.")
+        self.t, self.y, self.L = replaySolution(data, solution)
+        while self.t < data["pandemic_duration"]:
+            self.step()
+
+    def update(self, update):
+        """
+            Append one period to the instance and solve it
+
+        Parameters
+        ----------
+        update : dict
+            data of the new period, see append.
+
+        Returns
+        -------
+        dict
+            assignment and backlogs of the new period (see result) and the latency of the update in seconds.
+        """
+        start = time.perf_counter()
+        T = self.data["pandemic_duration"]
+        self.append(update)
+        log_size = None
+        if self.log is not None:
+            log_size = os.path.getsize(self.log) if os.path.exists(self.log) else 0
+            with open(self.log, "a", encoding="utf-8") as f:
+                f.write(json.dumps(update, ensure_ascii=False) + "\n")
+        try:
+            self.step()
+        except RuntimeError:
+            # undo the update, the service continues with the state before
+            self.data.truncate_periods(T)
+            del self.crit_I[T:]
+            if log_size is not None:
+                with open(self.log, "r+b") as f:
+                    f.truncate(log_size)
+            raise
+        latency = time.perf_counter() - start
+        self.latency.append(latency)
+        return {**self.result(), "latency": latency}
+
+    def append(self, update):
+        """
+            Append one period to the instance
+
+        Parameters
+        ----------
+        update : dict
+            "d_i": tests per test center (all test centers),
+            "incidence_i": weekly incidence per test center, optional,
+            "Cap_t": capacity per laboratory, optional,
+            "R": R value per test center, required for crit_I_meth 'R_values' and 'R7_values'.
+            Test centers and laboratories that are not given keep the value of the last period.
+        """
+        data = self.data
+        T = data["pandemic_duration"]
+        d = column(update.get("d_i"), data.tc_index, "d_i")
+        inc = column(
+            update.get("incidence_i"), data.tc_index, "incidence_i", data.inc[:, T - 1]
+        )
+        Cap = column(update.get("Cap_t"), data.lab_index, "Cap_t", data.Cap[:, T - 1])
+        if self.crit_I_meth in self.R_labels:
+            R = column(update.get("R"), data.tc_index, "R")
+            day = pd.DatetimeIndex([self.date(T)])
+            crit = crit_from_R(
+                R[:, None], data.tc_names, day, self.R_labels[self.crit_I_meth]
+            )[:, 0]
+
+        data.append_periods(
+            d[:, None].astype(data.d.dtype),
+            inc[:, None],
+            Cap[:, None].astype(data.Cap.dtype),
+        )
+        if self.crit_I_meth not in self.R_labels:
+            crit = crit_I_values(self.crit_I_meth, data, T)
+        self.crit_I.append(crit)
+
+    def step(self):
+        "Solve the next period, raise a RuntimeError (and keep the state) if it cannot be solved."
+        data, t = self.data, self.t
+        Cap_bar, L_state = data.Cap_bar.copy(), data.L.copy()
+        stats = self.stats
+        phase = stats.phase if stats is not None else nullcontext
+        if stats is not None:
+            stats.start_period(t)
+        with phase("update"):
+            updateSnapshotInputParameters(data, t, self.y, self.L)
+        y, L = solveSnapshot(
+            data,
+            self.solution,
+            t,
+            self.crit_I_fct,
+            self.crit_J_fct,
+            verbose=self.verbose,
+            snapshot=self.snapshot,
+            y_start=self.y if self.warm_start else None,
+            stats=stats,
+        )
+        if stats is not None:
+            stats.end_period(self.snapshot)
+        if y is None or L is None:
+            data.Cap_bar[:] = Cap_bar
+            data.L[:] = L_state
+            raise RuntimeError(f"Snapshot problem in period {t} could not be solved.")
+        self.t, self.y, self.L = t + 1, y, L
+
+    def crit_I_fct(self, data, sol, t):
+        return self.crit_I[t]
+
+    def date(self, t):
+        return str(
+            (
+                pd.Timestamp(self.data["properties"]["start_date"])
+                + pd.Timedelta(days=t)
+            ).date()
+        )
+
+    def result(self):
+        "Assignment (laboratory and slot tau per test center) and backlogs of the last solved period."
+        t = self.t - 1
+        return {
+            "t": t,
+            "date": self.date(t),
+            "obj": self.solution.sol["obj"][t] if t >= 0 else None,
+            "assignment": {
+                i: {"laboratory": j, "tau": tau}
+                for (i, j, tau), val in self.y.items()
+                if val
+            },
+            "backlog": self.L,
+        }
+
+    def status(self):
+        "Next period, horizon and latency statistics of the updates in seconds."
+        status = {
+            "t": self.t,
+            "periods": self.data["pandemic_duration"],
+            "end_date": self.data["properties"].get("end_date"),
+            "updates": len(self.latency),
+        }
+        if self.latency:
+            latency = np.array(self.latency)
+            status["latency"] = {
+                "last": latency[-1],
+                "mean": latency.mean(),
+                "p50": np.percentile(latency, 50),
+                "p95": np.percentile(latency, 95),
+                "max": latency.max(),
+            }
+        return status
+
+    def close(self):
+        self.snapshot.close()
+
+
+def column(values, index, name, previous=None):
+    """
+        Array of the values of a {name: value} dict in the order of index
+
+    Parameters
+    ----------
+    values : dict
+        values per test center or laboratory.
+    index : dict
+        position of every test center or laboratory.
+    name : str
+        name of the values in error messages.
+    previous : np.ndarray, optional
+        values of entries that are not given. The default is None, i.e., all entries are required.
+
+    Returns
+    -------
+    np.ndarray
+    """
+    values = values or dict()
+    col = (
+        np.full(len(index), np.nan)
+        if previous is None
+        else np.array(previous, dtype=float)
+    )
+    for key, val in values.items():
+        if key not in index:
+            raise ValueError(f"Unknown entry '{key}' in {name}.")
+        col[index[key]] = val
+    if previous is None and len(values) < len(index):
+        raise ValueError(f"{name} needs a value for all {len(index)} entries.")
+    return col
+
+
+async def readRequest(reader):
+    "Method, path and body of an HTTP request."
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) < 2:
+        raise ValueError("Malformed request.")
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return request_line[0], request_line[1], body
+
+
+async def serve(service, host="127.0.0.1", port=8765, socket=None):
+    """
+    Answer HTTP requests to the service on host:port or on the Unix socket socket:
+        POST /update (JSON body, see AssignmentService.append) - append and solve a period
+        GET /assignment - assignment and backlogs of the last period
+        GET /status - next period, horizon and latency statistics
+    Updates are processed one after another in a worker thread, such that other requests are answered
+    while the model is solved.
+    """
+    lock = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+
+    async def handle(reader, writer):
+        try:
+            method, path, body = await readRequest(reader)
+            if method == "POST" and path == "/update":
+                update = json.loads(body)
+                async with lock:
+                    response = await loop.run_in_executor(None, service.update, update)
+            elif method == "GET" and path == "/assignment":
+                response = service.result()
+            elif method == "GET" and path == "/status":
+                response = service.status()
+            else:
+                raise LookupError(f"{method} {path} not found.")
+            status = "200 OK"
+        except LookupError as e:
+            status, response = "404 Not Found", {"error": str(e)}
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, response = "400 Bad Request", {"error": str(e)}
+        except RuntimeError as e:
+            status, response = "422 Unprocessable Entity", {"error": str(e)}
+        except Exception as e:  # answer the request, the server keeps running
+            status, response = "500 Internal Server Error", {"error": repr(e)}
+        body = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            (
+                f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            ).encode("latin-1")
+            + body
+        )
+        await writer.drain()
+        writer.close()
+
+    if socket is not None:
+        server = await asyncio.start_unix_server(handle, path=socket)
+        print(f"Serving on {socket}")
+    else:
+        server = await asyncio.start_server(handle, host, port)
+        print(f"Serving on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the procedure as service that solves one period per update"
+    )
+    parser.add_argument("instance", help="name of the instance in data/")
+    parser.add_argument("--socket", help="Unix socket, else TCP on --host and --port")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--backend", default="cplex", choices=["cplex", "highs"])
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--heuristic", action="store_true")
+    parser.add_argument("--decompose", action="store_true")
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--crit_I", default="R7_values")
+    parser.add_argument("--crit_J", default="workload")
+    args = parser.parse_args()
+
+    path = "data/" + args.instance
+    data = Instance.load(path)
+    # solution and updates of the service, a restarted service continues after the last update
+    solution = SolutionStream(data, path + "/service_sol.jsonl", resume=True)
+    service = AssignmentService(
+        data,
+        solution,
+        log=path + "/service_updates.jsonl",
+        tau_max=2,
+        C=150,
+        Mc=150,
+        theta=0.001,
+        eta=1,
+        crit_I_meth=args.crit_I,
+        crit_J_meth=args.crit_J,
+        backend=args.backend,
+        threads=args.threads,
+        heuristic=args.heuristic,
+        decompose=args.decompose,
+        processes=args.processes,
+    )
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.socket))
+    finally:
+        service.close()
@@ -0,0 +1,231 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import os
+import argparse
+import itertools
+import json
+import time
+import multiprocessing
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import OnlineProcedure
+from Instance import Instance
+
+# parameters of runOnlineProcedure that can be varied, with the values used in main.py
+default_grid = {
+    "tau_max": [2],
+    "C": [150],
+    "Mc": [150],
+    "theta": [0.001],
+    "eta": [1],
+    "crit_I_meth": ["R7_values"],
+    "crit_J_meth": ["workload"],
+}
+summary_series = ["obj", "delay", "reassignment", "backlog", "time"]
+
+
+def runName(instance, config):
+    "Unique, file system friendly name of a run."
+    return instance + "_" + "_".join(f"{key}={config[key]}" for key in sorted(config))
+
+
+def runConfig(instance, config, data_path="data/", backend="cplex", threads=1):
+    """
+        Run the procedure for one instance and parameter configuration
+
+    Parameters
+    ----------
+    instance : str
+        name of the instance, read from data_path + instance.
+    config : dict
+        parameters of runOnlineProcedure, see default_grid.
+    data_path : str, optional
+        directory of the instances. The default is "data/".
+    backend : str, optional
+        Solver backend, 'cplex' or 'highs'. The default is 'cplex'.
+    threads : int, optional
+        Number of solver threads of the run. The default is 1.
+
+    Returns
+    -------
+    dict
+        instance, configuration, status, runtime and the summary series of the solution.
+    """
+    data = Instance.load(data_path + instance)
+    start = time.perf_counter()
+    result = {"instance": instance, "config": config, "status": "solved"}
+    try:
+        solution = OnlineProcedure.runOnlineProcedure(
+            data, verbose=False, backend=backend, threads=threads, **config
+        )
+    except SystemExit:  # runOnlineProcedure exits on an infeasible snapshot problem
+        result["status"] = "infeasible"
+    else:
+        for series in summary_series:
+            result[series] = solution.sol[series]
+    result["runtime"] = time.perf_counter() - start
+    return result
+
+
+@contextmanager
+def limitThreads(threads):
+    """
+    Keep numerical libraries of the worker processes started inside the context from starting more threads
+    than a run may use. The libraries read the variables once when NumPy is imported, so they only take
+    effect in freshly spawned processes, not in forked ones (NumPy is already imported here).
+    """
+    variables = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+    previous = {var: os.environ.get(var) for var in variables}
+    os.environ.update(dict.fromkeys(variables, str(threads)))
+    try:
+        yield
+    finally:
+        for var, value in previous.items():
+            if value is None:
+                del os.environ[var]
+            else:
+                os.environ[var] = value
+
+
+def runSweep(
+    instances,
+    grid,
+    out_path,
+    data_path="data/",
+    backend="cplex",
+    processes=None,
+    threads=1,
+):
+    """
+        Run the procedure for all instances and combinations of parameter values in a process pool.
+        Every run writes its result to out_path/<run name>.json as soon as it is finished, runs with an
+        existing result are skipped, so an interrupted sweep continues where it stopped.
+
+    Parameters
+    ----------
+    instances : list
+        names of the instances.
+    grid : dict
+        values per parameter of runOnlineProcedure, parameters that are not given take the value of default_grid.
+    out_path : str
+        directory of the results.
+    data_path : str, optional
+        directory of the instances. The default is "data/".
+    backend : str, optional
+        Solver backend, 'cplex' or 'highs'. The default is 'cplex'.
+    processes : int, optional
+        Number of parallel runs. The default is None, i.e., number of cores // threads.
+    threads : int, optional
+        Number of solver threads per run. The default is 1.
+
+    Returns
+    -------
+    pd.DataFrame
+        summary table of all finished runs, also written to out_path/summary.csv.
+    """
+    grid = {**default_grid, **grid}
+    if processes is None:
+        processes = max(1, (os.cpu_count() or 1) // threads)
+    os.makedirs(out_path, exist_ok=True)
+
+    runs = [
+        (instance, dict(zip(grid, values)))
+        for instance in instances
+        for values in itertools.product(*grid.values())
+    ]
+    todo = [
+        run
+        for run in runs
+        if not os.path.exists(os.path.join(out_path, runName(*run) + ".json"))
+    ]
+    print(f"{len(runs) - len(todo)} of {len(runs)} runs already finished.")
+
+    # workers are spawned on demand, the variables stay set until all are started
+    with limitThreads(threads), ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        # the solver threads are passed to the backend of every run
+        futures = {
+            pool.submit(runConfig, instance, config, data_path, backend, threads): (
+                instance,
+                config,
+            )
+            for instance, config in todo
+        }
+        for future in as_completed(futures):
+            name = runName(*futures[future])
+            try:
+                result = future.result()
+            except Exception as e:
+                # keep the sweep going, the run is repeated on resume
+                print(f"Run {name} failed: {e!r}")
+                continue
+            file_name = os.path.join(out_path, name + ".json")
+            with open(file_name + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            # only complete results count as finished
+            os.replace(file_name + ".tmp", file_name)
+            print(f"Finished run {name} ({result['status']}).")
+
+    summary = summarize(out_path)
+    summary.to_csv(os.path.join(out_path, "summary.csv"), index=False)
+    return summary
+
+
+def summarize(out_path):
+    "Summary table (one row per run) of the results in out_path."
+    rows = []
+    for file_name in sorted(os.listdir(out_path)):
+        if not file_name.endswith(".json"):
+            continue
+        with open(os.path.join(out_path, file_name), encoding="utf-8") as f:
+            result = json.load(f)
+        row = {"instance": result["instance"], **result["config"]}
+        row["status"] = result["status"]
+        for series in summary_series:
+            row[series] = sum(result[series]) if series in result else None
+        row["runtime"] = result["runtime"]
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a parameter sweep of the procedure"
+    )
+    parser.add_argument("instances", nargs="+", help="names of the instances in data/")
+    parser.add_argument(
+        "--grid",
+        help='JSON file with a list of values per parameter, e.g. {"tau_max": [1, 2], "C": [100, 150]}',
+    )
+    parser.add_argument("--out", default="sweep/", help="directory of the results")
+    parser.add_argument("--backend", default="cplex", choices=["cplex", "highs"])
+    parser.add_argument("--processes", type=int, help="number of parallel runs")
+    parser.add_argument(
+        "--threads", type=int, default=1, help="number of solver threads per run"
+    )
+    args = parser.parse_args()
+
+    grid = dict()
+    if args.grid is not None:
+        with open(args.grid) as f:
+            grid = json.load(f)
+    print(
+        runSweep(
+            args.instances,
+            grid,
+            args.out,
+            backend=args.backend,
+            processes=args.processes,
+            threads=args.threads,
+        )
+    )
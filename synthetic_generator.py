@@ -0,0 +1,317 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import os
+import copy
+import argparse
+import numpy as np
+import pandas as pd
+from numpy.lib import format as npy_format
+from scipy.sparse import csr_matrix, vstack
+
+from Instance import Instance, INF
+from SpatialIndex import SpatialIndex
+
+
+class SyntheticInstance:
+    """
+    Class creating a synthetic problem instance of arbitrary size in the schema of CDPInstance.
+
+    Test centers and laboratories are placed around cluster centers (e.g., metropolitan areas) in a
+    bounding box of latitudes and longitudes, the cluster of a test center is its region ("Bundesland").
+    Distances are great-circle distances times a detour factor (road distances of data_raw are about 1.55
+    times the great-circle distances), computed with a SpatialIndex of the laboratories: only the pairs within
+    max_distance are stored (sparse matrix in distances, c_i of the instance), the default laboratory of a
+    test center is the closest one (in closest). Test centers without laboratory within max_default_distance
+    are moved close to their closest laboratory. The dense arrays c and default of the instance take I x J
+    entries, they are only built when data is accessed; write_to_disk writes them in blocks of rows.
+    The number of tests follows the population of a test center and a number of epidemic waves, every
+    cluster with its own delay. Capacities are scaled to the number of default test centers of a laboratory
+    as in CDPInstance.resize_capacity, their total ramps from capacity_ramp[0] to capacity_ramp[1] times the
+    mean total demand over the horizon. All random numbers are drawn from a generator seeded with seed.
+    """
+
+    data_path = "data/"
+    block_size = 1000  # test centers per distance query and rows of c and default written at once
+
+    def __init__(
+        self,
+        name="synthetic",
+        I=5000,
+        J=1000,
+        T=28,
+        tau_max=2,
+        clusters=20,
+        cluster_spread=0.5,  # standard deviation of positions around a cluster center in degrees
+        lat=(47.0, 55.0),
+        lon=(6.0, 15.0),  # bounding box of the cluster centers
+        detour=1.55,
+        max_default_distance=150,  # C of main.py, the default laboratory must be permitted
+        max_distance=300,  # C + Mc of main.py, only pairs within max_distance are stored in c_i
+        tests_per_capita=0.002,  # tests per inhabitant and day at the peak of a wave
+        waves=2,
+        wave_width=21,  # standard deviation of a wave in days
+        cluster_delay=14,  # standard deviation of the delay of a wave per cluster in days
+        # total capacity relative to the mean total demand, in data_raw mostly 1 to 3 times the demand
+        capacity_ramp=(1.0, 2.0),
+        start_date="2020-03-09",
+        seed=0,
+    ):
+        self.rng = np.random.default_rng(seed)
+        self.I, self.J, self.T = I, J, T
+        self.tau_max = tau_max
+        self.detour = detour
+
+        # spatial clusters, larger clusters are more likely to get test centers and laboratories
+        centers = np.column_stack(
+            (self.rng.uniform(*lat, clusters), self.rng.uniform(*lon, clusters))
+        )
+        weights = self.rng.dirichlet(np.ones(clusters))
+        tc_cluster = self.place(I, clusters, weights)
+        lab_cluster = self.place(J, clusters, weights)
+        tc_pos = self.rng.normal(centers[tc_cluster], cluster_spread)
+        lab_pos = self.rng.normal(centers[lab_cluster], cluster_spread)
+
+        labs = SpatialIndex(lab_pos, detour=detour)
+        dist, closest = labs.nearest(tc_pos)
+        # move test centers without laboratory in reach close to the closest one
+        far = np.round(dist) > max_default_distance
+        while far.any():
+            tc_pos[far] = self.rng.normal(lab_pos[closest[far]], cluster_spread / 5)
+            dist[far], closest[far] = labs.nearest(tc_pos[far])
+            far = np.round(dist) > max_default_distance
+        self.closest = closest
+
+        # distances are rounded to km, radius + 0.5 includes all pairs rounded to radius
+        radius = max(max_distance, max_default_distance)
+        # in blocks of test centers, the pairs of all test centers take several times the memory of distances
+        blocks = []
+        for start in range(0, I, self.block_size):
+            pairs = labs.within(tc_pos[start : start + self.block_size], radius + 0.5)
+            keep = np.round(pairs.data) <= radius
+            blocks.append(
+                csr_matrix(
+                    (np.round(pairs.data[keep]), (pairs.row[keep], pairs.col[keep])),
+                    shape=pairs.shape,
+                )
+            )
+        self.distances = vstack(blocks, format="csr")
+
+        population = np.round(self.rng.lognormal(11.8, 0.6, I)).astype(int)
+        d, inc = self.demand(
+            population,
+            tc_cluster,
+            clusters,
+            tests_per_capita,
+            waves,
+            wave_width,
+            cluster_delay,
+        )
+        num_def = np.bincount(closest, minlength=J) + 1
+        Cap = self.capacity(d, num_def, capacity_ramp)
+
+        end_date = pd.Timestamp(start_date) + pd.Timedelta(days=T - 1)
+        region = [f"Cluster {k}" for k in range(clusters)]
+        # c and default are dense I x J arrays, they are built from distances and closest on demand
+        self._data = Instance(
+            properties={
+                "name": name,
+                "state": "synthetic",
+                "start_date": start_date,
+                "end_date": str(end_date.date()),
+                "seed": seed,
+            },
+            params={"tau_max": tau_max, "J": J, "I": I, "pandemic_duration": T},
+            tc_names=[f"TC {i}" for i in range(I)],
+            lab_names=[str(j) for j in range(J)],
+            d=d,
+            inc=inc,
+            c=None,
+            default=None,
+            Cap=Cap,
+            Cap_bar=Cap[:, :tau_max].astype(float),
+            L=np.zeros(J),
+            tc_meta=[
+                {
+                    "population": int(population[i]),
+                    "position": position(tc_pos[i]),
+                    "Bundesland": region[tc_cluster[i]],
+                }
+                for i in range(I)
+            ],
+            lab_meta=[
+                {
+                    "position": position(lab_pos[j]),
+                    "Bundesland": region[lab_cluster[j]],
+                    "Cap": int(Cap[j].max()),
+                    "num_def": int(num_def[j]),
+                }
+                for j in range(J)
+            ],
+        )
+
+    @property
+    def data(self):
+        "Instance with the dense arrays c and default, built on first access."
+        if self._data.c is None:
+            self._data.c, self._data.default = self.rows(0, self.I)
+        return self._data
+
+    def rows(self, start, stop):
+        "Rows start to stop of c and default, from the sparse distances and the closest laboratories."
+        block = self.distances[start:stop].tocoo()
+        c = np.full(block.shape, INF)
+        c[block.row, block.col] = block.data
+        default = np.zeros(block.shape, dtype=np.int8)
+        default[np.arange(block.shape[0]), self.closest[start:stop]] = 1
+        return c, default
+
+    def place(self, n, clusters, weights):
+        "Cluster of n entities, every cluster gets at least one if n >= clusters."
+        cluster = self.rng.choice(clusters, size=n, p=weights)
+        if n >= clusters:
+            cluster[self.rng.choice(n, size=clusters, replace=False)] = np.arange(
+                clusters
+            )
+        return cluster
+
+    def demand(
+        self,
+        population,
+        tc_cluster,
+        clusters,
+        tests_per_capita,
+        waves,
+        wave_width,
+        cluster_delay,
+    ):
+        """
+            Tests and weekly incidences per test center and period
+
+        Returns
+        -------
+        d, inc : np.ndarray
+            number of tests and weekly incidence per 100,000 inhabitants with shape (I, T).
+        """
+        T = self.T
+        t = np.arange(T)
+        peaks = np.sort(self.rng.uniform(0, T, waves))
+        heights = self.rng.uniform(0.3, 1, waves)
+        delay = self.rng.normal(0, cluster_delay, clusters)
+        # intensity of the epidemic per cluster and period, between 0.05 and about 1
+        shifted = t[None, :, None] - delay[:, None, None] - peaks[None, None, :]
+        intensity = 0.05 + (heights * np.exp(-0.5 * (shifted / wave_width) ** 2)).sum(
+            axis=2
+        )
+        weekday = np.where(t % 7 >= 5, 0.5, 1.0)  # fewer tests on weekends
+        mean = (
+            tests_per_capita
+            * population[:, None]
+            * intensity[tc_cluster]
+            * weekday[None, :]
+        )
+        d = self.rng.poisson(mean)
+
+        positive = self.rng.binomial(d, np.minimum(0.15 * intensity[tc_cluster], 1))
+        weekly = pd.DataFrame(positive.T).rolling(7, min_periods=1).sum().to_numpy().T
+        inc = np.round(weekly * 1e5 / population[:, None], 1)
+        return d, inc
+
+    def capacity(self, d, num_def, capacity_ramp):
+        """
+        Capacity per laboratory for T + tau_max + 1 periods, proportional to num_def. The last tau_max + 1
+        periods repeat the capacity of period T - 1 as in CDPInstance.resize_capacity.
+        """
+        total = np.linspace(*capacity_ramp, self.T) * d.sum(axis=0).mean()
+        Cap = (total[None, :] * num_def[:, None] / num_def.sum()).astype(int)
+        return np.concatenate(
+            (Cap, np.repeat(Cap[:, -1:], self.tau_max + 1, axis=1)), axis=1
+        )
+
+    def write_to_disk(self, file_name=None, file_format="npy"):
+        # file_format "npy": instance_meta.json + instance_<array>.npy in the instance directory (memory-mappable)
+        # file_format "json": single instance.json
+        if file_name is None:
+            file_name = self.data_path + self.data.properties["name"]
+            os.makedirs(file_name, exist_ok=True)
+            if file_format == "json":
+                file_name += "/instance.json"
+        if file_format == "npy" and self._data.c is None:
+            # c and default are written in blocks of rows and memory-mapped, see Instance.save
+            paths = [
+                os.path.join(file_name, f"instance_{a}.npy") for a in ("c", "default")
+            ]
+            with open(paths[0], "wb") as fc, open(paths[1], "wb") as fd:
+                for f, dtype in ((fc, float), (fd, np.int8)):
+                    header = {
+                        "descr": npy_format.dtype_to_descr(np.dtype(dtype)),
+                        "fortran_order": False,
+                        "shape": (self.I, self.J),
+                    }
+                    npy_format.write_array_header_1_0(f, header)
+                for start in range(0, self.I, self.block_size):
+                    c, default = self.rows(start, start + self.block_size)
+                    fc.write(c.tobytes())
+                    fd.write(default.tobytes())
+            data = copy.copy(self._data)
+            data.c = np.load(paths[0], mmap_mode="r")
+            data.default = np.load(paths[1], mmap_mode="r")
+            data.save(file_name)
+        elif file_format == "npy":
+            self.data.save(file_name)
+        else:
+            self.data.write_json(file_name)
+
+    @classmethod
+    def set_data_path(cls, data_path=""):
+        cls.data_path = data_path
+
+
+def position(pos):
+    "Position in the format of data_raw."
+    return {"lon": float(pos[1]), "lat": float(pos[0])}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic instances")
+    parser.add_argument("--name", default="synthetic")
+    parser.add_argument("-I", type=int, default=5000, help="number of test centers")
+    parser.add_argument("-J", type=int, default=1000, help="number of laboratories")
+    parser.add_argument("-T", type=int, default=28, help="number of periods")
+    parser.add_argument("--tau_max", type=int, default=2)
+    parser.add_argument("--clusters", type=int, default=20)
+    parser.add_argument("--waves", type=int, default=2)
+    parser.add_argument(
+        "--capacity_ramp",
+        nargs=2,
+        type=float,
+        default=[1.0, 2.0],
+        help="total capacity in the first and last period relative to the mean total demand",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--format",
+        choices=["npy", "json"],
+        default="npy",
+        help="on-disk format of the instance",
+    )
+    args = parser.parse_args()
+
+    inst = SyntheticInstance(
+        name=args.name,
+        I=args.I,
+        J=args.J,
+        T=args.T,
+        tau_max=args.tau_max,
+        clusters=args.clusters,
+        waves=args.waves,
+        capacity_ramp=tuple(args.capacity_ramp),
+        seed=args.seed,
+    )
+    inst.write_to_disk(file_format=args.format)
@@ -0,0 +1,70 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import os
+import sys
+
+import numpy as np
+import numpy.random as npr
+import pytest
+
+# the modules live in the repository root and read data_raw/ relative to it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from Instance import Instance  # noqa: E402
+from instance_generator import CDPInstance  # noqa: E402
+
+# parameters of main.py, tau_max = 1 and HiGHS keep the tests small and independent of CPLEX
+params = {
+    "tau_max": 1,
+    "C": 150,
+    "Mc": 150,
+    "theta": 0.001,
+    "eta": 1,
+    "crit_I_meth": "incidences",
+    "crit_J_meth": "incidences",
+    "backend": "highs",
+    "threads": 1,
+}
+
+
+def generateHessen(tmp_path_factory, tau_max, start_date="2020-10-01"):
+    "Hessen (26 test centers, 11 laboratories) over 8 days, generated from data_raw."
+    data_path = str(tmp_path_factory.mktemp("data")) + os.sep
+    CDPInstance.set_data_path(data_path)
+    npr.seed(0)  # ties of the default assignment are broken randomly
+    inst = CDPInstance(
+        name="hessen",
+        tau_max=tau_max,
+        state="Hessen",
+        start_date=start_date,
+        end_date=str(np.datetime64(start_date) + 7),
+        derive_incidences=True,
+    )
+    inst.write_to_disk()
+    return data_path + "hessen"
+
+
+@pytest.fixture(scope="session")
+def hessen_path(tmp_path_factory):
+    return generateHessen(tmp_path_factory, params["tau_max"])
+
+
+@pytest.fixture(scope="session")
+def hessen_congested_path(tmp_path_factory):
+    "Hessen in November 2020 with tau_max = 2, the districts do not always fit into the slots."
+    return generateHessen(tmp_path_factory, 2, start_date="2020-11-02")
+
+
+@pytest.fixture
+def hessen(hessen_path):
+    "A fresh copy of the Hessen instance in memory."
+    return Instance.load(hessen_path, mmap=False)
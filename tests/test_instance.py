@@ -0,0 +1,67 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import numpy as np
+import numpy.random as npr
+import pytest
+
+from Instance import Instance
+from RawData import readIncidences
+from instance_generator import CDPInstance, appendDays
+
+
+def assert_same_instance(a, b):
+    for name in Instance._array_names():
+        np.testing.assert_array_equal(getattr(a, name), getattr(b, name), err_msg=name)
+    assert a.to_dict() == b.to_dict()
+
+
+def test_npy_round_trip(hessen, tmp_path):
+    hessen.save(str(tmp_path))
+    assert_same_instance(Instance.load(str(tmp_path)), hessen)
+    assert_same_instance(Instance.load(str(tmp_path), mmap=False), hessen)
+    assert_same_instance(Instance.from_dict(hessen.to_dict()), hessen)
+
+
+def test_append_periods(hessen_path, hessen):
+    T = hessen["pandemic_duration"]
+    data = Instance.load(hessen_path)
+    data.truncate_periods(T - 3)
+    assert data["pandemic_duration"] == T - 3
+    for t in range(T - 3, T):
+        data.append_periods(
+            hessen.d[:, t : t + 1], hessen.inc[:, t : t + 1], hessen.Cap[:, t : t + 1]
+        )
+    assert_same_instance(data, hessen)
+
+
+def test_append_days(hessen, tmp_path):
+    CDPInstance.set_data_path(str(tmp_path) + "/")
+    npr.seed(0)
+    inst = CDPInstance(
+        name="hessen",
+        tau_max=hessen["tau_max"],
+        state="Hessen",
+        start_date="2020-10-01",
+        end_date="2020-10-05",
+        derive_incidences=True,
+    )
+    inst.write_to_disk()
+    data = Instance.load(str(tmp_path / "hessen"), mmap=False)
+    appendDays(data, "2020-10-08")
+    assert_same_instance(data, hessen)
+
+
+def test_derived_incidences(hessen, tmp_path):
+    missing = str(tmp_path / "incidences.json")
+    with pytest.raises(FileNotFoundError):
+        readIncidences(missing)
+    with pytest.warns(UserWarning, match="derived"):
+        readIncidences(missing, derive=True)
+    assert hessen.properties["incidences"] == "derived"
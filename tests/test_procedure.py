@@ -0,0 +1,181 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import copy
+import json
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+import OnlineProcedure
+from conftest import params
+from DTSA_snap import SnapshotModel, solveSnapshot
+from Instance import Instance
+from Solution import Solution, SolutionStream
+
+mipgap = 0.01  # of the solver backends, objective values of two solves may differ by this gap
+
+
+@pytest.fixture
+def reference(monkeypatch):
+    """
+    Solve every period of runOnlineProcedure also with a SnapshotModel built for the period alone (without
+    warm start) on the same state. Collects the pairs of objective values. The SnapshotModel itself is checked
+    against the original formulation in test_baseline.
+    """
+    pairs = []
+    solve = OnlineProcedure.solveSnapshot
+
+    def check(data, sol, t, crit_I_fct, crit_J_fct, **kwargs):
+        fresh = copy.deepcopy(sol)  # the period must not be added to sol twice
+        solve(data, fresh, t, crit_I_fct, crit_J_fct, verbose=False, backend="highs")
+        y, L = solve(data, sol, t, crit_I_fct, crit_J_fct, **kwargs)
+        pairs.append((sol.sol["obj"][-1], fresh.sol["obj"][-1]))
+        return y, L
+
+    monkeypatch.setattr(OnlineProcedure, "solveSnapshot", check)
+    return pairs
+
+
+def assert_optimal(pairs, periods):
+    assert len(pairs) == periods
+    obj, ref = np.array(pairs).T
+    np.testing.assert_allclose(obj, ref, rtol=1.1 * mipgap, atol=1e-4)
+
+
+def test_baseline(hessen):
+    """
+    Objective values of the original formulation (the docplex model DTSA_snap.solveSnapshot built in every
+    period before the model was persistent, CPLEX with mipgap 0.01) on the Hessen instance, pinned in
+    data/hessen_baseline.json with the assignments and backlogs of every period. Every period is solved on the
+    state the original procedure reached, as the trajectories may differ within the MIP gap.
+    """
+    with open(
+        os.path.join(os.path.dirname(__file__), "data", "hessen_baseline.json"),
+        encoding="utf-8",
+    ) as f:
+        baseline = json.load(f)
+    OnlineProcedure.setParameters(
+        hessen, *(params[key] for key in ["tau_max", "C", "Mc", "theta", "eta"])
+    )
+    crit_I_fct = OnlineProcedure.gen_crit_I_fct(params["crit_I_meth"], hessen)
+    crit_J_fct = OnlineProcedure.gen_crit_J_fct(params["crit_J_meth"], hessen)
+    snapshot = SnapshotModel(hessen, verbose=False, backend="highs")
+    sol = Solution(hessen)
+    y, L = dict(), dict.fromkeys(hessen.lab_names, 0)
+    for t in range(hessen["pandemic_duration"]):
+        OnlineProcedure.updateSnapshotInputParameters(hessen, t, y, L)
+        solveSnapshot(
+            hessen, sol, t, crit_I_fct, crit_J_fct, verbose=False, snapshot=snapshot
+        )
+        y = {tuple(key): 1 for key in baseline["y"][t]}
+        L = baseline["L"][t]
+        sol.y_last = y  # crit_j of the next period
+        sol.aggregate(t)
+    np.testing.assert_allclose(
+        sol.sol["obj"], baseline["obj"], rtol=1.1 * mipgap, atol=1e-4
+    )
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"formulation": "compact"},
+        {"decompose": True, "processes": 1},
+        {"presolve": True},
+    ],
+    ids=["persistent", "compact", "decomposition", "presolve"],
+)
+def test_optimal(hessen, reference, options):
+    solution = OnlineProcedure.runOnlineProcedure(hessen, **params, **options)
+    assert_optimal(reference, hessen["pandemic_duration"])
+    if "presolve" in options:
+        assert sum(record["fixed"] for record in solution.sol["presolve"]) > 0
+
+
+def test_compact_exact(hessen_congested_path, reference):
+    "CompactSnapshot is exact for tau_max > 1, also if the districts do not always fit into the slots."
+    data = Instance.load(hessen_congested_path, mmap=False)
+    data["pandemic_duration"] = 4  # the laboratories are congested from period 3
+    solution = OnlineProcedure.runOnlineProcedure(
+        data, **dict(params, tau_max=2), formulation="compact"
+    )
+    assert_optimal(reference, data["pandemic_duration"])
+    for y in solution.sol["y"]:
+        values = [val for y_i in y.values() for y_ij in y_i.values() for val in y_ij]
+        assert set(values) <= {0, 1} and sum(values) == len(data.tc_names)
+
+
+def test_heuristic(hessen, reference):
+    solution = OnlineProcedure.runOnlineProcedure(hessen, **params, heuristic=True)
+    obj, ref = np.array(reference).T
+    assert (obj >= ref * (1 - 1.1 * mipgap) - 1e-4).all()
+    assert (np.array(solution.sol["bound"]) <= obj + 1e-6).all()
+
+
+def test_checkpoint_resume(hessen_path, tmp_path):
+    full = OnlineProcedure.runOnlineProcedure(
+        Instance.load(hessen_path, mmap=False), **params
+    )
+    checkpoint = str(tmp_path / "state.pkl")
+    data = Instance.load(hessen_path, mmap=False)
+    data["pandemic_duration"] = 4  # interrupted after period 3
+    OnlineProcedure.runOnlineProcedure(data, **params, checkpoint=checkpoint)
+    with open(checkpoint, "rb") as f:
+        state = pickle.load(f)["solution"]
+    assert (
+        state["periods"] == 4 and "sol" not in state
+    )  # periods are in the journal only
+    resumed = OnlineProcedure.runOnlineProcedure(
+        Instance.load(hessen_path, mmap=False), **params, resume_from=checkpoint
+    )
+    np.testing.assert_allclose(resumed.sol["obj"], full.sol["obj"])
+    for key in ["y", "L", "s", "crit_i", "utilization"]:
+        assert resumed.sol[key] == full.sol[key]
+
+
+def test_stream_resume(hessen_path, tmp_path):
+    full = OnlineProcedure.runOnlineProcedure(
+        Instance.load(hessen_path, mmap=False), **params
+    )
+    file_name = str(tmp_path / "sol.jsonl")
+    data = Instance.load(hessen_path, mmap=False)
+    data["pandemic_duration"] = 4
+    OnlineProcedure.runOnlineProcedure(
+        data, **params, solution=SolutionStream(data, file_name)
+    )
+    with open(file_name, "a", encoding="utf-8") as f:
+        f.write('{"t": 4, "obj"')  # interrupted while writing period 4
+
+    data = Instance.load(hessen_path, mmap=False)
+    resumed = OnlineProcedure.runOnlineProcedure(
+        data, **params, solution=SolutionStream(data, file_name, resume=True)
+    )
+    np.testing.assert_allclose(resumed.sol["obj"], full.sol["obj"])
+    with open(file_name, encoding="utf-8") as f:
+        periods = [json.loads(line) for line in f]
+    assert [period["t"] for period in periods] == list(range(len(full.sol["obj"])))
+    for period, y in zip(periods, full.sol["y"]):
+        assert sorted(map(tuple, period["y"])) == sorted(
+            (i, j, tau + 1, val)
+            for i, y_i in y.items()
+            for j, y_ij in y_i.items()
+            for tau, val in enumerate(y_ij)
+            if val
+        )
+
+
+def test_unknown_criterion(hessen):
+    with pytest.raises(ValueError, match="crit_I"):
+        OnlineProcedure.crit_I_values("unknown", hessen)
+    with pytest.raises(ValueError, match="crit_J"):
+        OnlineProcedure.gen_crit_J_fct("unknown", hessen)
@@ -0,0 +1,72 @@
+"""
+Created on Thu Nov 26 08:02:33 2020
+
+@author: Hannah Bakker (hannah.bakker@kit.edu)
+@author: Viktor Bindewald (viktor.bindewald@kit.edu)
+@author: Fabian Dunke (fabian.dunke@kit.edu)
+@author: Stefan Nickel (stefan.nickel@kit.edu)
+"""
+
+import numpy as np
+
+import OnlineProcedure
+from conftest import params
+from Instance import Instance
+from Solution import SolutionStream
+from service import AssignmentService
+
+start = 6  # periods of the instance the service starts with
+
+
+def update(data, t):
+    "Data of period t of data as update of the service."
+    return {
+        "d_i": dict(zip(data.tc_names, data.d[:, t].tolist())),
+        "incidence_i": dict(zip(data.tc_names, data.inc[:, t].tolist())),
+        "Cap_t": dict(zip(data.lab_names, data.Cap[:, t].tolist())),
+    }
+
+
+def service(path, directory, resume=False, **kwargs):
+    directory.mkdir(exist_ok=True)
+    data = Instance.load(path, mmap=False)
+    data.truncate_periods(start)
+    solution = SolutionStream(data, str(directory / "sol.jsonl"), resume=resume)
+    return AssignmentService(
+        data, solution, log=str(directory / "log.jsonl"), **params, **kwargs
+    )
+
+
+def test_restart_after_update(hessen_path, hessen, tmp_path):
+    reference = service(hessen_path, tmp_path / "reference")
+    restarted = service(hessen_path, tmp_path / "restart")
+    for t in range(start, start + 2):
+        reference.update(update(hessen, t))
+        restarted.update(update(hessen, t))
+    restarted.close()
+
+    # the stored solution is ahead of the instance until the log is replayed
+    restarted = service(hessen_path, tmp_path / "restart", resume=True)
+    assert restarted.t == start + 2
+    np.testing.assert_allclose(restarted.solution.lab_load, reference.solution.lab_load)
+    np.testing.assert_allclose(
+        restarted.solution.lab_weighted, reference.solution.lab_weighted
+    )
+    for t in range(start + 2, hessen["pandemic_duration"]):
+        reference.update(update(hessen, t))
+        restarted.update(update(hessen, t))
+    np.testing.assert_allclose(
+        restarted.solution.sol["obj"], reference.solution.sol["obj"]
+    )
+
+
+def test_decomposed_updates(hessen_path, hessen, tmp_path):
+    "The regional models get the appended periods."
+    decomposed = service(hessen_path, tmp_path, decompose=True, processes=2)
+    for t in range(start, hessen["pandemic_duration"]):
+        decomposed.update(update(hessen, t))
+    decomposed.close()
+    full = OnlineProcedure.runOnlineProcedure(
+        hessen, **params, decompose=True, processes=2
+    )
+    np.testing.assert_allclose(decomposed.solution.sol["obj"], full.sol["obj"])